@@ -0,0 +1,457 @@
+import os
+import stat
+import time
+import zlib
+import logging
+import tarfile
+import zipfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from walker import Walker
+from transfer_stats import TransferStats
+
+
+BUFFER_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0x7fffffff
+CHUNK_SIZE = 16 * 1024 * 1024
+BATCH_FILES = 256
+PARALLEL_THRESHOLD = 32 * 1024 * 1024
+
+FORMATS = {
+    'zip': '.zip',
+    'tar.gz': '.tar.gz',
+    'tar.bz2': '.tar.bz2',
+    'tar.xz': '.tar.xz',
+}
+
+# Data in these formats is compressed already, a zip stores it as is
+COMPRESSED_SUFFIXES = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.lz4', '.jar', '.whl', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac', '.m4a',
+    '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.webm', '.docx', '.xlsx', '.pptx', '.odt', '.epub',
+}
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+class ArchiveEngine:
+    """
+    Writes zip, tar.gz, tar.bz2 and tar.xz archives of files and folders.
+
+    The archive is streamed into a hidden part file next to its destination and renamed into
+    place once complete, so the data is written once and a failed or cancelled archive leaves
+    nothing behind. Files are read in fixed size blocks, which keeps memory use constant
+    whatever the archive size. Zip members whose data is compressed already (images, media,
+    other archives) are stored rather than compressed again. Level 0 gives a stored zip.
+
+    Zip members are compressed independently of each other, so for larger zips the deflating
+    is done by a pool of processes, see ParallelZipWriter, which also deflates the members of
+    smaller zips itself. The tar formats are one compressed stream and are written by a single
+    thread.
+    """
+    def __init__(self, archive_format: str = 'zip', level: int = 6, progress=None,
+                 cancelled: threading.Event = None, workers: int = None):
+        """
+        :param archive_format: One of FORMATS
+        :param level: Compression level, 0 (zip only: stored) to 9
+        :param progress: Callable receiving the TransferStats as data is archived
+        :param cancelled: Event which stops the archive when set
+        :param workers: Number of compressing processes for zips, the CPU count by default
+        """
+        if archive_format not in FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format}")
+        self.archive_format = archive_format
+        self.level = level
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = TransferStats()
+
+    @staticmethod
+    def default_destination(items: list, archive_format: str = 'zip') -> str:
+        """
+        :return: Archive path next to the items, named after a single item or Archive
+        """
+        folder = os.path.dirname(os.path.abspath(items[0]))
+        if len(items) == 1:
+            name = os.path.basename(os.path.abspath(items[0])).split('.')[0] or 'Archive'
+        else:
+            name = 'Archive'
+        return os.path.join(folder, name + FORMATS[archive_format])
+
+    def create(self, items: list, destination: str) -> TransferStats:
+        """
+        This function archives the items, with paths relative to their common folder.
+
+        :param items: Files and folders to archive
+        :param destination: Path of the archive
+        :return: TransferStats of the archived data
+        """
+        base = os.path.commonpath([os.path.dirname(os.path.abspath(item)) for item in items])
+        self._measure(items)
+
+        folder, name = os.path.split(os.path.abspath(destination))
+        part = os.path.join(folder, f".{name}.commander-part")
+        try:
+            if self.archive_format == 'zip':
+                self._write_zip(part, items, base)
+            else:
+                self._write_tar(part, items, base)
+            os.replace(part, destination)
+        except (OSError, ArchiveCancelled):
+            if not self.cancelled.is_set():
+                raise
+        finally:
+            # Whatever stopped the archive, the part file does not stay behind
+            if os.path.exists(part):
+                os.remove(part)
+
+        self.stats.finish()
+        return self.stats
+
+    def _measure(self, items: list):
+        for path, status in self._entries(items):
+            if stat.S_ISREG(status.st_mode):
+                self.stats.expect(1, status.st_size)
+
+    def _entries(self, items: list):
+        """
+        :return: Generator of (path, lstat) of the items and everything below them
+        """
+        for item in items:
+            item = os.path.abspath(item)
+            yield item, os.lstat(item)
+            if os.path.isdir(item) and not os.path.islink(item):
+                for listing in Walker(stat=True, cancelled=self.cancelled).walk(item):
+                    for entry in sorted(listing.dirs + listing.files, key=lambda e: e.name):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+
+    # ======================================================================
+    def _write_zip(self, part: str, items: list, base: str):
+        compression = zipfile.ZIP_DEFLATED if self.level else zipfile.ZIP_STORED
+        pool = None
+        if self.level and self.workers > 1 and self.stats.total_bytes >= PARALLEL_THRESHOLD:
+            pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+        try:
+            with zipfile.ZipFile(part, 'w', compression, compresslevel=self.level or None,
+                                 allowZip64=True, strict_timestamps=False) as archive:
+                writer = ParallelZipWriter(self, archive, pool) if self.level else None
+                for path, status in self._entries(items):
+                    self._check_cancelled()
+                    arcname = os.path.relpath(path, base)
+                    compressed = os.path.splitext(path)[1].lower() in COMPRESSED_SUFFIXES
+
+                    if writer and stat.S_ISREG(status.st_mode) and not compressed:
+                        writer.add_file(path, zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False))
+                    elif writer:
+                        writer.add_inline(lambda path=path, arcname=arcname, status=status:
+                                          self._write_zip_member(archive, path, arcname, status))
+                    else:
+                        self._write_zip_member(archive, path, arcname, status)
+                if writer:
+                    writer.finish()
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+    def _write_zip_member(self, archive: zipfile.ZipFile, path: str, arcname: str, status: os.stat_result):
+        if stat.S_ISLNK(status.st_mode):
+            info = zipfile.ZipInfo(arcname, self._date_time(status))
+            info.external_attr = (status.st_mode & 0xFFFF) << 16
+            archive.writestr(info, os.readlink(path))
+        elif stat.S_ISDIR(status.st_mode):
+            archive.write(path, arcname)
+        elif stat.S_ISREG(status.st_mode):
+            # Only stored members are written here, ParallelZipWriter deflates the others
+            info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as file_in, \
+                    archive.open(info, 'w', force_zip64=status.st_size > ZIP64_LIMIT) as file_out:
+                self._stream(file_in, file_out)
+            self._advance(1, 0)
+
+    @staticmethod
+    def _date_time(status: os.stat_result) -> tuple:
+        return max(time.localtime(status.st_mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+    def _write_tar(self, part: str, items: list, base: str):
+        mode = 'w:' + self.archive_format.split('.')[1]
+        if self.archive_format == 'tar.xz':
+            options = {'preset': self.level}
+        else:
+            options = {'compresslevel': max(self.level, 1)}
+
+        with tarfile.open(part, mode, copybufsize=BUFFER_SIZE, **options) as archive:
+            for path, status in self._entries(items):
+                self._check_cancelled()
+                info = archive.gettarinfo(path, os.path.relpath(path, base))
+                if info is None:
+                    logging.info(f"{path} skipped, sockets cannot be archived")
+                elif info.isreg():
+                    with open(path, 'rb') as file_in:
+                        archive.addfile(info, _ProgressReader(file_in, self))
+                    self._advance(1, 0)
+                else:
+                    archive.addfile(info)
+
+    # ======================================================================
+    def _stream(self, file_in, file_out):
+        while True:
+            self._check_cancelled()
+            block = file_in.read(BUFFER_SIZE)
+            if not block:
+                return
+            file_out.write(block)
+            self._advance(0, len(block))
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set():
+            raise ArchiveCancelled()
+
+    def _advance(self, files: int, size: int):
+        self.stats.add(files, size)
+        if self.progress:
+            self.progress(self.stats)
+
+
+class _ProgressReader:
+    """
+    File wrapper counting the data tarfile reads through it.
+    """
+    def __init__(self, file, engine: ArchiveEngine):
+        self.file = file
+        self.engine = engine
+
+    def read(self, size: int = -1) -> bytes:
+        self.engine._check_cancelled()
+        block = self.file.read(size)
+        self.engine._advance(0, len(block))
+        return block
+
+
+class ParallelZipWriter:
+    """
+    Appends deflated zip members compressed by a process pool, or right here without one.
+
+    Files are cut into pieces of at most CHUNK_SIZE; small files are batched into one task,
+    large ones are spread over several tasks and so over several cores. Every piece but the
+    last of a file ends with a full flush, which byte aligns it and leaves no back references,
+    so the pieces concatenate into one valid deflate stream. Their CRCs are joined with
+    crc32_combine. Members are written strictly in the order they were added (entries the
+    pool does not handle, like folders, are queued as inline writes). Once more than about
+    two chunks per worker are in flight the oldest pieces are waited for and written, even
+    those of a file still being added, which bounds memory.
+    """
+    def __init__(self, engine: ArchiveEngine, archive: zipfile.ZipFile, pool: ProcessPoolExecutor):
+        self.engine = engine
+        self.archive = archive
+        self.pool = pool
+
+        self.members = deque()
+        self.batch: list = []
+        self.batch_pieces: list = []
+        self.batch_bytes = 0
+        self.in_flight = 0
+        self.limit = engine.workers * 2 * CHUNK_SIZE
+
+    def add_file(self, path: str, info: zipfile.ZipInfo):
+        member = _Member(info)
+        self.members.append(member)
+
+        size = info.file_size
+        offset = 0
+        while True:
+            length = min(CHUNK_SIZE, size - offset)
+            final = offset + length >= size
+            piece = [None, len(self.batch)]
+            member.pieces.append(piece)
+            self.batch.append((path, offset, length, final))
+            self.batch_pieces.append(piece)
+            self.batch_bytes += length
+            if self.batch_bytes >= CHUNK_SIZE or len(self.batch) >= BATCH_FILES:
+                self._submit()
+            offset += length
+            if final:
+                break
+
+        member.complete = True
+        self._write_ready()
+
+    def add_inline(self, write):
+        member = _Member(None, write)
+        member.complete = True
+        self.members.append(member)
+        self._write_ready()
+
+    def finish(self):
+        self._submit()
+        while self.members:
+            self._write(self.members.popleft())
+
+    def _submit(self):
+        if not self.batch:
+            return
+        if self.pool:
+            future = self.pool.submit(compress_pieces, self.batch, self.engine.level)
+        else:
+            future = Future()
+            future.set_result(compress_pieces(self.batch, self.engine.level))
+        for piece in self.batch_pieces:
+            piece[0] = future
+        self.in_flight += self.batch_bytes
+        self.batch, self.batch_pieces, self.batch_bytes = [], [], 0
+
+        # Back pressure, the oldest pieces are written before more data is read
+        while self.in_flight > self.limit and self.members:
+            member = self.members[0]
+            if self._submitted(member):
+                self._write(self.members.popleft())
+            elif member.pieces and member.pieces[0][0] is not None:
+                self._write_pieces(member)
+            else:
+                break
+
+    def _write_ready(self):
+        while self.members and self._submitted(self.members[0]) \
+                and all(future.done() for future, _ in self.members[0].pieces):
+            self._write(self.members.popleft())
+
+    @staticmethod
+    def _submitted(member) -> bool:
+        return member.complete and all(future is not None for future, _ in member.pieces)
+
+    def _write(self, member):
+        if member.write:
+            member.write()
+            return
+
+        self._write_pieces(member)
+
+        # Rewrite the header now the CRC and sizes are known, its length does not change
+        archive = self.archive
+        info = member.info
+        info.CRC, info.file_size, info.compress_size = member.crc, member.size, member.compressed
+        end = archive.fp.tell()
+        archive.fp.seek(info.header_offset)
+        archive.fp.write(info.FileHeader(member.zip64))
+        archive.fp.seek(end)
+
+        archive.start_dir = end
+        archive.filelist.append(info)
+        archive.NameToInfo[info.filename] = info
+        archive._didModify = True
+        self.engine._advance(1, 0)
+
+    def _write_pieces(self, member):
+        """
+        This function writes the leading pieces of a member which were submitted, after its
+        header if that was not written yet. Only the first member in the queue may be written.
+        """
+        archive = self.archive
+        info = member.info
+        if member.zip64 is None:
+            member.zip64 = info.file_size * 1.05 > ZIP64_LIMIT
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.CRC = 0
+            info.compress_size = 0
+            archive.fp.seek(archive.start_dir)
+            info.header_offset = archive.fp.tell()
+            archive.fp.write(info.FileHeader(member.zip64))
+
+        while member.pieces and member.pieces[0][0] is not None:
+            self.engine._check_cancelled()
+            future, index = member.pieces.popleft()
+            results = future.result()
+            piece_crc, length, data = results[index]
+            results[index] = None
+            archive.fp.write(data)
+            member.crc = crc32_combine(member.crc, piece_crc, length)
+            member.size += length
+            member.compressed += len(data)
+            self.in_flight -= length
+            self.engine._advance(0, length)
+
+
+class _Member:
+    __slots__ = ('info', 'write', 'pieces', 'complete', 'zip64', 'crc', 'size', 'compressed')
+
+    def __init__(self, info: zipfile.ZipInfo = None, write=None):
+        self.info = info
+        self.write = write
+        self.pieces = deque()
+        self.complete = False
+        # Set once the header is written, with the CRC and sizes of the pieces written so far
+        self.zip64 = None
+        self.crc, self.size, self.compressed = 0, 0, 0
+
+
+def compress_pieces(pieces: list, level: int) -> list:
+    """
+    This function deflates pieces of files, it runs in the worker processes.
+
+    :param pieces: List of (path, offset, length, final)
+    :param level: Compression level
+    :return: List of (crc32, length read, raw deflate data) per piece
+    """
+    results = []
+    for path, offset, length, final in pieces:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            data = file.read(length)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        results.append((zlib.crc32(data), len(data),
+                        compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_FULL_FLUSH)))
+    return results
+
+
+def _gf2_times(matrix: list, vector: int) -> int:
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix: list) -> list:
+    return [_gf2_times(matrix, matrix[row]) for row in range(32)]
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    This function returns the CRC-32 of two blocks joined from their separate CRCs, as
+    zlib's crc32_combine (which Python does not expose) does.
+
+    :param crc1: CRC-32 of the first block
+    :param crc2: CRC-32 of the second block
+    :param length2: Length of the second block
+    """
+    if length2 <= 0:
+        return crc1
+
+    odd = [0xedb88320] + [1 << row for row in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
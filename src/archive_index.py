@@ -0,0 +1,269 @@
+import os
+import time
+import zlib
+import errno
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+from collections import namedtuple, OrderedDict
+from transfer_stats import TransferStats
+
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+CACHED_INDEXES = 16
+BUFFER_SIZE = 1024 * 1024
+EXTRACT_HOME = os.path.join(tempfile.gettempdir(), f"commander-{os.getuid()}", 'extracted')
+
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'is_dir', 'size', 'mtime', 'member'])
+
+
+class ArchiveIndex:
+    """
+    Listing of the members of a zip or tar archive, by folder.
+
+    A zip's listing comes from its central directory alone; a tar has to be read through
+    once (decompressing it if needed). Indexes are built lazily and kept in a small LRU
+    cache keyed by the archive's path, size and mtime, so reopening an unchanged archive
+    costs nothing. Single members are extracted on demand: straight from their offset for
+    zips and plain tars, and for compressed tars by reading only up to the member.
+    """
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.folders: dict = {}
+        self.is_zip = False
+        self.compressed_tar = False
+
+    # ======================================================================
+    @staticmethod
+    def is_archive(path: str) -> bool:
+        return path.lower().endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+    @staticmethod
+    def split(path: str):
+        """
+        This function finds the archive a virtual path like /data/backup.zip/docs/a.txt is in.
+
+        :return: (archive path, member path inside it) or None for ordinary paths, the member
+            is empty for the archive itself
+        """
+        location = os.path.abspath(path) if path else ''
+        while location and not os.path.isdir(location):
+            if ArchiveIndex.is_archive(location):
+                member = os.path.relpath(os.path.abspath(path), location).replace(os.sep, '/')
+                return location, '' if member == '.' else member
+            if os.path.dirname(location) == location:
+                break
+            location = os.path.dirname(location)
+        return None
+
+    @staticmethod
+    def remove_extracted():
+        """
+        This function removes the members extracted on their own to be opened, at the end of
+        the session.
+        """
+        shutil.rmtree(EXTRACT_HOME, ignore_errors=True)
+
+    @staticmethod
+    def is_member(path: str) -> bool:
+        """
+        :return: True for a path inside an archive, False for ordinary paths and archives themselves
+        """
+        inside = ArchiveIndex.split(path)
+        return bool(inside and inside[1])
+
+    @classmethod
+    def cached(cls, path: str):
+        """
+        :return: The index of the archive if it was built and is still current, else None
+        """
+        status = os.stat(path)
+        with cls._cache_lock:
+            index = cls._cache.get((path, status.st_size, status.st_mtime_ns))
+            if index:
+                cls._cache.move_to_end((path, status.st_size, status.st_mtime_ns))
+            return index
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        This function returns the index of an archive, building it if it is not cached.
+        """
+        path = os.path.abspath(path)
+        index = cls.cached(path)
+        if index:
+            return index
+
+        status = os.stat(path)
+        index = ArchiveIndex(path)
+        try:
+            index._build()
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as error:
+            raise OSError(errno.EINVAL, f"Not a readable archive: {error}", path)
+        with cls._cache_lock:
+            cls._cache[(path, status.st_size, status.st_mtime_ns)] = index
+            while len(cls._cache) > CACHED_INDEXES:
+                cls._cache.popitem(last=False)
+        return index
+
+    # ======================================================================
+    def _build(self):
+        self.folders = {'': {}}
+        self.is_zip = zipfile.is_zipfile(self.path)
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                for info in archive.infolist():
+                    self._add(info.filename, info.is_dir(), info.file_size,
+                              self._zip_time(info.date_time), info)
+        else:
+            with open(self.path, 'rb') as file:
+                self.compressed_tar = file.read(6).startswith(COMPRESSED_MAGIC)
+            with tarfile.open(self.path, 'r:*') as archive:
+                for info in archive:
+                    self._add(info.name, info.isdir(), info.size, info.mtime, info)
+
+    @staticmethod
+    def _zip_time(date_time: tuple) -> float:
+        return time.mktime(date_time + (0, 0, -1))
+
+    def _add(self, name: str, is_dir: bool, size: int, mtime: float, member):
+        name = name.strip('/')
+        if not name or name.startswith('../') or '/../' in f"/{name}/":
+            return
+        folder, _, base = name.rpartition('/')
+        self._folder(folder)[base] = ArchiveEntry(base, is_dir, size, mtime, member)
+        if is_dir:
+            self._folder(name)
+
+    def _folder(self, folder: str) -> dict:
+        """
+        :return: Entries of a folder, creating it and its parents, which zips often omit
+        """
+        entries = self.folders.get(folder)
+        if entries is None:
+            entries = self.folders[folder] = {}
+            if folder:
+                parent, _, base = folder.rpartition('/')
+                siblings = self._folder(parent)
+                if base not in siblings:
+                    siblings[base] = ArchiveEntry(base, True, 0, 0, None)
+        return entries
+
+    def listing(self, folder: str) -> list:
+        """
+        :return: Entries of a folder inside the archive, folders first
+        """
+        entries = self.folders.get(folder.strip('/'), {})
+        return sorted(entries.values(), key=lambda entry: (not entry.is_dir, entry.name.lower()))
+
+    def entry(self, member: str):
+        folder, _, base = member.strip('/').rpartition('/')
+        return self.folders.get(folder, {}).get(base)
+
+    # ======================================================================
+    @staticmethod
+    def extract_item(path: str, destination: str = None, progress=None, cancelled=None) -> str:
+        """
+        This function extracts the item behind a virtual path like /data/backup.zip/docs.
+
+        :param path: Virtual path of a member
+        :param destination: Path the extracted item should have, by default in a temporary folder
+        :return: Path of the extracted item
+        """
+        archive, member = ArchiveIndex.split(path) or (None, None)
+        if archive is None:
+            raise FileNotFoundError(errno.ENOENT, "Not inside an archive", path)
+        return ArchiveIndex.open(archive).extract(member, destination, progress, cancelled)
+
+    def extract(self, member: str, destination: str = None, progress=None, cancelled=None) -> str:
+        """
+        This function extracts one member (a folder with everything in it) without
+        decompressing the rest of the archive.
+
+        :param member: Path of the member inside the archive
+        :param destination: Path the extracted item should have, by default in a temporary folder
+        :param progress: Callable receiving the TransferStats as data is written
+        :param cancelled: Event which stops the extraction when set
+        :return: Path of the extracted item
+        """
+        member = member.strip('/')
+        if destination is None:
+            destination = os.path.join(EXTRACT_HOME, f"{zlib.crc32(self.path.encode()):08x}", member)
+
+        wanted = {}
+        if member in self.folders:
+            prefix = f"{member}/" if member else ''
+            for folder, entries in self.folders.items():
+                if folder != member and not folder.startswith(prefix):
+                    continue
+                target = os.path.join(destination, folder[len(prefix):])
+                os.makedirs(target, exist_ok=True)
+                wanted.update((f"{folder}/{entry.name}" if folder else entry.name,
+                               os.path.join(target, entry.name))
+                              for entry in entries.values() if not entry.is_dir)
+        elif self.entry(member):
+            wanted[member] = destination
+        else:
+            raise FileNotFoundError(errno.ENOENT, "Not in the archive", os.path.join(self.path, member))
+
+        stats = TransferStats(sum(self.entry(path).size for path in wanted), len(wanted))
+        try:
+            if self.is_zip:
+                with zipfile.ZipFile(self.path) as archive:
+                    for path, target in wanted.items():
+                        self._write(archive.open(self.entry(path).member), target, stats, progress, cancelled)
+            else:
+                self._extract_tar(wanted, stats, progress, cancelled)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as error:
+            raise OSError(errno.EIO, f"Damaged archive: {error}", self.path)
+        stats.finish()
+        return destination
+
+    def _extract_tar(self, wanted: dict, stats: TransferStats, progress, cancelled):
+        if not self.compressed_tar:
+            with tarfile.open(self.path, 'r:') as archive:
+                for path, target in wanted.items():
+                    info = self.entry(path).member
+                    if info.isreg():
+                        self._write(archive.extractfile(info), target, stats, progress, cancelled)
+            return
+
+        # A compressed stream cannot seek, it is read only as far as the last wanted member
+        remaining = dict(wanted)
+        with tarfile.open(self.path, 'r|*') as archive:
+            for info in archive:
+                target = remaining.pop(info.name.strip('/'), None)
+                if target and info.isreg():
+                    self._write(archive.extractfile(info), target, stats, progress, cancelled)
+                if not remaining:
+                    break
+
+    @staticmethod
+    def _write(file_in, target: str, stats: TransferStats, progress, cancelled):
+        if cancelled and cancelled.is_set():
+            file_in.close()
+            raise OSError(errno.ECANCELED, "Extraction cancelled", target)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with file_in, open(target, 'wb') as file_out:
+            while True:
+                block = file_in.read(BUFFER_SIZE)
+                if not block:
+                    break
+                file_out.write(block)
+                stats.add(size=len(block))
+                if progress:
+                    progress(stats)
+                if cancelled and cancelled.is_set():
+                    break
+        if cancelled and cancelled.is_set():
+            os.unlink(target)
+            raise OSError(errno.ECANCELED, "Extraction cancelled", target)
+        stats.add(files=1)
@@ -0,0 +1,141 @@
+import os
+import logging
+import threading
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex, QDateTime, QLocale, pyqtSignal
+from PyQt5.QtWidgets import QFileIconProvider
+from archive_index import ArchiveIndex
+
+
+COLUMNS = ('Name', 'Size', 'Type', 'Date Modified')
+
+
+class _Node:
+    __slots__ = ('member', 'entry', 'parent', 'row', 'children')
+
+    def __init__(self, member: str, entry, parent, row: int):
+        self.member = member
+        self.entry = entry
+        self.parent = parent
+        self.row = row
+        self.children = None
+
+
+class ArchiveModel(QAbstractItemModel):
+    """
+    Tree model showing a folder inside a zip or tar archive like a directory.
+
+    It has the columns of QFileSystemModel and answers filePath() with virtual paths
+    (archive path + member path), so the panes treat it like the file system model. The
+    index is taken from the ArchiveIndex cache, or built on a thread so a large tar does not
+    block the window; folders are only listed once they are expanded.
+    """
+    loaded = pyqtSignal()
+
+    def __init__(self, archive: str, folder: str = '', parent=None):
+        """
+        :param archive: Path of the archive
+        :param folder: Member folder shown at the top level
+        """
+        super(ArchiveModel, self).__init__(parent)
+        self.archive = archive
+        self.folder = folder.strip('/')
+        self.index_data = None
+        self.error = None
+        self.root = _Node(self.folder, None, None, 0)
+        self.icons = QFileIconProvider()
+
+        self.loaded.connect(self._loaded)
+        self.index_data = ArchiveIndex.cached(archive)
+        if self.index_data is None:
+            threading.Thread(target=self._load, daemon=True).start()
+
+    def _load(self):
+        try:
+            self.index_data = ArchiveIndex.open(self.archive)
+        except Exception as error:
+            self.error = error
+        self.loaded.emit()
+
+    def _loaded(self):
+        if self.error:
+            logging.error(f"Could not read {self.archive}: {self.error}")
+        self.beginResetModel()
+        self.root.children = None
+        self.endResetModel()
+
+    # ======================================================================
+    def _children(self, node: _Node) -> list:
+        if node.children is None:
+            if self.index_data is None:
+                return []
+            node.children = [_Node(f"{node.member}/{entry.name}" if node.member else entry.name, entry, node, row)
+                             for row, entry in enumerate(self.index_data.listing(node.member))]
+        return node.children
+
+    def _node(self, index: QModelIndex) -> _Node:
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row: int, column: int, parent=QModelIndex()) -> QModelIndex:
+        children = self._children(self._node(parent))
+        if 0 <= row < len(children) and 0 <= column < len(COLUMNS):
+            return self.createIndex(row, column, children[row])
+        return QModelIndex()
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        node = self._node(index).parent
+        if node is None or node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        node = self._node(parent)
+        if node.entry is not None and not node.entry.is_dir:
+            return 0
+        return len(self._children(node))
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return len(COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()) -> bool:
+        node = self._node(parent)
+        return node.entry is None or node.entry.is_dir
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._node(index).entry
+        column = index.column()
+
+        if role == Qt.DecorationRole and column == 0:
+            return self.icons.icon(QFileIconProvider.Folder if entry.is_dir else QFileIconProvider.File)
+        if role == Qt.TextAlignmentRole and column == 1:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role != Qt.DisplayRole:
+            return None
+
+        if column == 0:
+            return entry.name
+        if column == 1:
+            return '' if entry.is_dir else QLocale().formattedDataSize(entry.size)
+        if column == 2:
+            extension = os.path.splitext(entry.name)[1][1:]
+            return 'Folder' if entry.is_dir else f"{extension} File" if extension else 'File'
+        if column == 3 and entry.mtime:
+            return QDateTime.fromSecsSinceEpoch(int(entry.mtime)).toString(Qt.DefaultLocaleShortDate)
+        return None
+
+    # ======================================================================
+    def filePath(self, index: QModelIndex) -> str:
+        node = self._node(index)
+        return os.path.join(self.archive, *node.member.split('/')) if node.member else self.archive
+
+    def isDir(self, index: QModelIndex) -> bool:
+        node = self._node(index)
+        return node.entry is None or node.entry.is_dir
@@ -0,0 +1,173 @@
+import os
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from transfer_stats import TransferStats
+
+
+BLOCK_SIZE = 4 * 1024 * 1024
+PAGE_SIZE = 4096
+REGION_SIZE = 64 * 1024 * 1024
+MAX_RANGES = 10000
+SNIFF_SIZE = 8192
+
+
+class BinaryDiffEngine:
+    """
+    Byte for byte comparison of two files of any type.
+
+    Files of different sizes are reported as such without reading them. Otherwise the files
+    are split in regions compared by threads, each reading both files in 4 MB blocks into
+    buffers it reuses and comparing them as a whole; reads release the GIL so the regions
+    keep several requests in flight. Only blocks which differ are looked at more closely:
+    their differing pages are joined into ranges whose ends are narrowed down to the exact
+    byte, so differences less than a page apart are one range.
+    """
+    def __init__(self, left: str, right: str, workers: int = None, progress=None,
+                 cancelled: threading.Event = None):
+        """
+        :param left: File
+        :param right: File to compare it with
+        :param workers: Number of regions compared at once
+        :param progress: Callable receiving the TransferStats as the files are compared
+        :param cancelled: Event which stops the comparison when set
+        """
+        self.left = os.path.abspath(left)
+        self.right = os.path.abspath(right)
+        self.workers = workers or min(8, (os.cpu_count() or 1) * 2)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.sizes = (0, 0)
+        self.ranges: list = []
+        self.truncated = False
+
+    @staticmethod
+    def is_binary(path: str) -> bool:
+        """
+        :return: True if the start of the file holds a NUL byte, which text files do not
+        """
+        with open(path, 'rb') as file:
+            return b'\0' in file.read(SNIFF_SIZE)
+
+    @property
+    def first_difference(self):
+        """
+        :return: Offset of the first differing byte, None if the files are identical or differ in size
+        """
+        return self.ranges[0][0] if self.ranges else None
+
+    def summary(self) -> str:
+        if self.sizes[0] != self.sizes[1]:
+            return f"Sizes differ: {self.sizes[0]:,} and {self.sizes[1]:,} bytes"
+        if not self.ranges:
+            return f"Identical, {self.sizes[0]:,} bytes in {self.stats.elapsed:.1f}s " \
+                   f"({self.stats.bytes_per_second / 1048576:.0f} MB/s)"
+        return f"First difference at byte {self.first_difference:,} (0x{self.first_difference:x}), " \
+               f"{len(self.ranges)}{'+' if self.truncated else ''} differing ranges, " \
+               f"{sum(end - start for start, end in self.ranges):,} bytes in {self.stats.elapsed:.1f}s"
+
+    # ======================================================================
+    def compare(self) -> list:
+        """
+        :return: List of (start, end) byte ranges which differ, at most MAX_RANGES, empty if the
+            files are identical or differ in size
+        """
+        self.sizes = (os.path.getsize(self.left), os.path.getsize(self.right))
+        self.ranges = []
+        if self.sizes[0] != self.sizes[1]:
+            self.stats.finish()
+            return self.ranges
+
+        size = self.sizes[0]
+        self.stats.expect(2, 2 * size)
+        count = max(1, min(self.workers, size // REGION_SIZE))
+        step = max(-(-size // count // BLOCK_SIZE), 1) * BLOCK_SIZE
+        with ThreadPoolExecutor(count) as pool:
+            regions = list(pool.map(lambda start: self._compare_region(start, min(start + step, size)),
+                                    range(0, size, step)))
+
+        for ranges in regions:
+            for start, end in ranges:
+                if self.ranges and self.ranges[-1][1] == start:
+                    self.ranges[-1] = (self.ranges[-1][0], end)
+                else:
+                    self.ranges.append((start, end))
+        if len(self.ranges) > MAX_RANGES:
+            self.ranges, self.truncated = self.ranges[:MAX_RANGES], True
+        self.stats.finish()
+        return self.ranges
+
+    def _compare_region(self, start: int, end: int) -> list:
+        ranges = []
+        first, second = bytearray(BLOCK_SIZE), bytearray(BLOCK_SIZE)
+        with open(self.left, 'rb', buffering=0) as left, open(self.right, 'rb', buffering=0) as right:
+            left.seek(start)
+            right.seek(start)
+            position = start
+            while position < end and not self.cancelled.is_set():
+                size = min(BLOCK_SIZE, end - position)
+                self._read(left, first, size)
+                self._read(right, second, size)
+                if (first != second) if size == BLOCK_SIZE else (first[:size] != second[:size]):
+                    ranges.extend(self._block_ranges(position, first, second, size))
+                    if len(ranges) > MAX_RANGES:
+                        # Later ranges would be dropped anyway
+                        self.truncated = True
+                        break
+                position += size
+                self.stats.add(0, 2 * size)
+                if self.progress:
+                    self.progress(self.stats)
+        return ranges
+
+    @staticmethod
+    def _read(file, buffer: bytearray, size: int):
+        view = memoryview(buffer)
+        done = 0
+        while done < size:
+            count = file.readinto(view[done:size])
+            if not count:
+                raise OSError(errno.ESTALE, "File truncated during the comparison", file.name)
+            done += count
+
+    @staticmethod
+    def _block_ranges(offset: int, first: bytearray, second: bytearray, size: int) -> list:
+        """
+        :return: Differing (start, end) ranges of a block, pages apart differences joined
+        """
+        pages = []
+        start = None
+        for page in range(0, size, PAGE_SIZE):
+            # The buffers hold an older block past size
+            limit = min(page + PAGE_SIZE, size)
+            differs = first[page:limit] != second[page:limit]
+            if differs and start is None:
+                start = page
+            elif not differs and start is not None:
+                pages.append((start, page))
+                start = None
+        if start is not None:
+            pages.append((start, size))
+
+        ranges = []
+        for start, end in pages:
+            # Narrow the ends down to the first and last differing byte
+            low, high = start, min(start + PAGE_SIZE, end)
+            while high - low > 1:
+                middle = (low + high) // 2
+                if first[low:middle] == second[low:middle]:
+                    low = middle
+                else:
+                    high = middle
+            start = low
+            low, high = max(end - PAGE_SIZE, start), end
+            while high - low > 1:
+                middle = (low + high) // 2
+                if first[middle:high] == second[middle:high]:
+                    high = middle
+                else:
+                    low = middle
+            ranges.append((offset + start, offset + high))
+        return ranges
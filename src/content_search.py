@@ -0,0 +1,241 @@
+import os
+import re
+import mmap
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from walker import Walker
+
+
+MAX_FILE_SIZE = 512 * 1024 * 1024
+SNIFF_SIZE = 8192
+READ_SIZE = 4 * 1024 * 1024
+TASK_FILES = 256
+TASK_BYTES = 64 * 1024 * 1024
+LINE_LIMIT = 300
+
+
+class Matcher:
+    """
+    Search criteria for content searches, picklable so it can be shipped to worker processes.
+
+    Literal text is located with the byte-string find of the buffer (a fast two-way search
+    in C); for case insensitive literals the buffer is lower-cased block by block first,
+    which is much faster than the regex engine's case folding. Regular expressions use
+    the re module in MULTILINE mode, as whole files are searched at once ^ and $ match at
+    line boundaries. Patterns are bytes, so case folding is ASCII only in all three cases.
+    """
+    FOLD_BLOCK = 8 * 1024 * 1024
+
+    def __init__(self, text: str, regex: bool = False, case_sensitive: bool = False):
+        """
+        :param text: Text to look for
+        :param regex: Treat the text as a regular expression rather than a literal
+        :param case_sensitive: Match case
+        """
+        needle = text.encode('utf-8', 'surrogateescape')
+
+        self.case_sensitive = case_sensitive
+        self.needle = needle if case_sensitive else needle.lower()
+        self.pattern = re.compile(needle, re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE) if regex else None
+
+    def finder(self, buffer):
+        """
+        :param buffer: bytes or mmap to search
+        :return: Callable mapping a start position to the offset of the next match or -1
+        """
+        if self.pattern:
+            def find(position):
+                match = self.pattern.search(buffer, position)
+                return match.start() if match else -1
+        elif self.case_sensitive:
+            def find(position):
+                return buffer.find(self.needle, position)
+        else:
+            cache = [-1, b'']
+
+            def find(position):
+                overlap = max(len(self.needle) - 1, 0)
+                while position < len(buffer):
+                    if not cache[0] <= position < cache[0] + len(cache[1]) - overlap:
+                        cache[0] = position
+                        cache[1] = buffer[position:position + self.FOLD_BLOCK + overlap].lower()
+                    offset = cache[1].find(self.needle, position - cache[0])
+                    if offset >= 0:
+                        return cache[0] + offset
+                    position = cache[0] + max(len(cache[1]) - overlap, 1)
+                return -1
+        return find
+
+
+def scan_files(paths: list, matcher: Matcher, max_size: int) -> list:
+    """
+    Worker process entry point, scans a batch of files.
+
+    :return: List of (path, line number, line text) hits
+    """
+    hits = []
+    for path in paths:
+        try:
+            hits.extend(scan_file(path, matcher, max_size))
+        except OSError:
+            continue
+    return hits
+
+
+def scan_file(path: str, matcher: Matcher, max_size: int = MAX_FILE_SIZE) -> list:
+    """
+    This function finds the lines of a file matching the search criteria. Regular files are memory
+    mapped and searched in one pass of the regex engine, anything that cannot be mapped is
+    read in large blocks. Files that look binary (NUL byte near the start) or exceed the
+    size cap are skipped.
+
+    :return: List of (path, line number, line text) hits
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size > max_size:
+            return []
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return _scan_stream(path, file, matcher, max_size)
+
+        with buffer:
+            if b'\0' in buffer[:SNIFF_SIZE]:
+                return []
+            return _scan_buffer(path, buffer, matcher)
+
+
+def _scan_buffer(path: str, buffer, matcher: Matcher, first_line: int = 1) -> list:
+    find = matcher.finder(buffer)
+    hits = []
+    line_number = first_line
+    counted = 0
+    position = 0
+
+    while True:
+        found = find(position)
+        if found < 0:
+            return hits
+
+        start = buffer.rfind(b'\n', 0, found) + 1
+        end = buffer.find(b'\n', found)
+        if end < 0:
+            end = len(buffer)
+
+        line_number += buffer[counted:start].count(b'\n')
+        counted = start
+
+        line = buffer[start:min(end, start + LINE_LIMIT)].decode('utf-8', 'replace').rstrip('\r')
+        hits.append((path, line_number, line))
+
+        position = end + 1
+        if position > len(buffer):
+            return hits
+
+
+def _scan_stream(path: str, file, matcher: Matcher, max_size: int) -> list:
+    hits = []
+    line_number = 1
+    carry = b''
+    total = 0
+
+    while True:
+        block = file.read(READ_SIZE)
+        total += len(block)
+        if total > max_size:
+            return []
+        if not carry and total == len(block) and b'\0' in block[:SNIFF_SIZE]:
+            return []
+
+        data = carry + block
+        cut = data.rfind(b'\n') + 1 if block else len(data)
+        if cut:
+            hits.extend(_scan_buffer(path, data[:cut], matcher, line_number))
+            line_number += data.count(b'\n', 0, cut)
+        carry = data[cut:]
+
+        if not block:
+            return hits
+
+
+class ContentSearcher:
+    """
+    grep-style search of file contents below a directory.
+
+    Files found by the parallel walker are handed to a pool of worker processes in batches,
+    and the hits come back batch by batch as the workers finish, so results can be shown
+    while the rest of the tree is still being searched.
+    """
+    def __init__(self, text: str, regex: bool = False, case_sensitive: bool = False,
+                 max_size: int = MAX_FILE_SIZE, workers: int = None,
+                 cancelled: threading.Event = None):
+        self.matcher = Matcher(text, regex, case_sensitive)
+        self.max_size = max_size
+        self.workers = workers or os.cpu_count() or 1
+        self.cancelled = cancelled or threading.Event()
+
+        self.files_scanned = 0
+        self.bytes_scanned = 0
+
+    def search(self, location: str):
+        """
+        :param location: Directory to search
+        :return: Generator of hit lists (possibly empty), each hit being (path, line number, line text)
+        """
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        pending = {}
+
+        try:
+            for batch, batch_bytes in self._batches(location):
+                pending[pool.submit(scan_files, batch, self.matcher, self.max_size)] = len(batch), batch_bytes
+                yield self._collect(pending, 0)
+                while len(pending) >= self.workers * 4:
+                    yield self._collect(pending, 0.05)
+
+            while pending and not self.cancelled.is_set():
+                yield self._collect(pending, 0.05)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, pending: dict, timeout: float) -> list:
+        """
+        :param pending: Futures of the batches being scanned, with their number of files and bytes
+        :return: Hits of the batches finished, which are counted as scanned
+        """
+        hits = []
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, size = pending.pop(future)
+            hits.extend(future.result())
+            self.files_scanned += files
+            self.bytes_scanned += size
+        return hits
+
+    def _batches(self, location: str):
+        batch = []
+        batch_bytes = 0
+
+        for listing in Walker(stat=True, cancelled=self.cancelled).walk(location):
+            for entry in listing.files:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                if size == 0 or size > self.max_size:
+                    continue
+
+                batch.append(entry.path)
+                batch_bytes += size
+
+                if len(batch) >= TASK_FILES or batch_bytes >= TASK_BYTES:
+                    yield batch, batch_bytes
+                    batch = []
+                    batch_bytes = 0
+
+        if batch and not self.cancelled.is_set():
+            yield batch, batch_bytes
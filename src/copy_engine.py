@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from walker import Walker
+from transfer_stats import TransferStats
+
+
+LARGE_FILE = 16 * 1024 * 1024
+KERNEL_CHUNK = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+BATCH_FILES = 64
+RESUMABLE_FILE = 1024 * 1024 * 1024
+RESUME_CHUNK = 64 * 1024 * 1024
+
+
+class CopyEngine:
+    """
+    Copies single files or whole directory trees.
+
+    The source tree is listed by the parallel walker and directories are created on the
+    destination as soon as their parent is listed, i.e. ahead of the file copies, which are
+    spread over a bounded thread pool. Large files are copied inside the kernel with
+    os.copy_file_range (or os.sendfile) so their data never passes through Python.
+    Symlinks are recreated rather than followed and file metadata (mode, times) is kept.
+
+    Very large files are copied resumably, see ResumableCopy.
+    """
+    def __init__(self, workers: int = None, progress=None, cancelled: threading.Event = None):
+        """
+        :param workers: Number of concurrent file copies
+        :param progress: Callable receiving the TransferStats whenever progress is made
+        :param cancelled: Event which stops the copy when set
+        """
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+        self.stats = TransferStats()
+        self.completed = set()
+        self._tracked = set()
+
+    def copy(self, source: str, destination: str) -> TransferStats:
+        """
+        This function copies a file or directory to the given destination path.
+
+        :param source: File or directory to copy
+        :param destination: Path the copy should have
+        :return: TransferStats of the copy
+        """
+        return self.copy_all([(source, destination)])
+
+    def copy_all(self, pairs: list) -> TransferStats:
+        """
+        This function copies several files and directories as one operation. The files are
+        copied together, spread over the thread pool, the directories one tree after another.
+
+        :param pairs: List of (source, destination path)
+        :return: TransferStats of all the copies, the sources copied completely are added to completed
+        """
+        errors = []
+        files = []
+        trees = []
+        for source, destination in pairs:
+            if os.path.isdir(source) and not os.path.islink(source):
+                if os.path.commonpath([os.path.abspath(source), os.path.abspath(destination)]) \
+                        == os.path.abspath(source):
+                    errors.append(OSError(errno.EINVAL, "Cannot copy a directory into itself", destination))
+                else:
+                    trees.append((source, destination))
+                continue
+            try:
+                files.append((source, destination, os.lstat(source).st_size, os.path.islink(source)))
+            except OSError as error:
+                errors.append(error)
+
+        self._tracked = {source for source, *_ in files}
+        errors.extend(self.copy_files(files))
+
+        for source, destination in trees:
+            if self.cancelled.is_set():
+                break
+            try:
+                self.copy_tree(source, destination)
+                if not self.cancelled.is_set():
+                    self.completed.add(source)
+            except OSError as error:
+                errors.append(error)
+
+        self.stats.finish()
+        if errors:
+            raise errors[0]
+        return self.stats
+
+    def copy_tree(self, source: str, destination: str):
+        errors = []
+        directories = [(source, destination)]
+        pending = set()
+
+        os.makedirs(destination, exist_ok=True)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for listing in Walker(stat=True, cancelled=self.cancelled, onerror=errors.append).walk(source):
+                target = os.path.join(destination, os.path.relpath(listing.path, source))
+
+                for entry in listing.dirs:
+                    try:
+                        os.makedirs(os.path.join(target, entry.name), exist_ok=True)
+                        directories.append((entry.path, os.path.join(target, entry.name)))
+                    except OSError as error:
+                        errors.append(error)
+
+                batch = []
+                for entry in listing.files:
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError as error:
+                        errors.append(error)
+                        continue
+                    self.stats.expect(1, size)
+                    batch.append((entry.path, os.path.join(target, entry.name), size, entry.is_symlink()))
+
+                    if len(batch) >= BATCH_FILES or size >= LARGE_FILE:
+                        pending = self._submit(pool, pending, batch, errors)
+                        batch = []
+                if batch:
+                    pending = self._submit(pool, pending, batch, errors)
+
+            for future in wait(pending).done:
+                errors.extend(future.result())
+
+        # Directory times change while their contents are written, so they are set last
+        for directory, target in reversed(directories):
+            try:
+                shutil.copystat(directory, target)
+            except OSError as error:
+                errors.append(error)
+
+        if errors:
+            raise errors[0]
+
+    def copy_files(self, files) -> list:
+        """
+        This function copies individual files, spread over the thread pool.
+
+        :param files: Iterable of (source, destination, size, symlink)
+        :return: List of the errors met
+        """
+        errors = []
+        pending = set()
+        batch = []
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for item in files:
+                self.stats.expect(1, item[2])
+                batch.append(item)
+                if len(batch) >= BATCH_FILES or item[2] >= LARGE_FILE:
+                    pending = self._submit(pool, pending, batch, errors)
+                    batch = []
+            if batch:
+                pending = self._submit(pool, pending, batch, errors)
+
+            for future in wait(pending).done:
+                errors.extend(future.result())
+
+        return errors
+
+    def _submit(self, pool: ThreadPoolExecutor, pending: set, batch: list, errors: list) -> set:
+        if len(pending) >= self.workers * 2:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                errors.extend(future.result())
+        pending.add(pool.submit(self._copy_batch, batch))
+        return pending
+
+    def _copy_batch(self, batch: list) -> list:
+        errors = []
+        for source, destination, size, symlink in batch:
+            try:
+                if self.copy_file(source, destination, size, symlink) and source in self._tracked:
+                    self.completed.add(source)
+            except OSError as error:
+                errors.append(error)
+        return errors
+
+    def copy_file(self, source: str, destination: str, size: int, symlink: bool = False) -> bool:
+        """
+        :return: True if the file was copied completely, False if the copy was cancelled
+        """
+        if self.cancelled.is_set():
+            return False
+        if self._same_file(source, destination, symlink):
+            # Opening the destination would truncate the source
+            raise shutil.SameFileError(f"{source} and {destination} are the same file")
+
+        if symlink:
+            if os.path.lexists(destination):
+                os.unlink(destination)
+            os.symlink(os.readlink(source), destination)
+            self._advance(1, 0)
+            return True
+
+        if size >= RESUMABLE_FILE:
+            if not ResumableCopy(source, destination, self.cancelled, self._advance).run():
+                return False
+        elif size >= LARGE_FILE:
+            if not self._copy_large(source, destination):
+                return False
+        else:
+            shutil.copyfile(source, destination)
+            self._advance(0, size)
+
+        shutil.copystat(source, destination)
+        self._advance(1, 0)
+        return True
+
+    @staticmethod
+    def _same_file(source: str, destination: str, symlink: bool) -> bool:
+        """
+        :return: True if the destination is the source itself, a hard link to it or (unless the
+            source is a symlink, which is recreated) a symlink to it
+        """
+        try:
+            if symlink:
+                first, second = os.lstat(source), os.lstat(destination)
+            else:
+                first, second = os.stat(source), os.stat(destination)
+        except OSError:
+            return False
+        return (first.st_dev, first.st_ino) == (second.st_dev, second.st_ino)
+
+    def _copy_large(self, source: str, destination: str) -> bool:
+        """
+        This function copies into a hidden part file which is renamed over the destination once
+        complete, so a cancelled copy leaves no truncated file and the destination as it was.
+
+        :return: False if the copy was cancelled
+        """
+        folder, name = os.path.split(destination)
+        part = os.path.join(folder, f".{name}.commander-part")
+        try:
+            with open(source, 'rb') as file_in, open(part, 'wb') as file_out:
+                self._copy_data(file_in, file_out)
+            if self.cancelled.is_set():
+                return False
+            os.replace(part, destination)
+            return True
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+
+    def _copy_data(self, file_in, file_out):
+        in_fd = file_in.fileno()
+        out_fd = file_out.fileno()
+
+        for method in (self._copy_file_range, self._sendfile):
+            try:
+                if method(in_fd, out_fd):
+                    return
+            except OSError:
+                # Not supported for this pair of file systems, continue where it stopped
+                file_in.seek(os.lseek(in_fd, 0, os.SEEK_CUR))
+                file_out.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+
+        while not self.cancelled.is_set():
+            block = file_in.read(BUFFER_SIZE)
+            if not block:
+                return
+            file_out.write(block)
+            self._advance(0, len(block))
+
+    def _copy_file_range(self, in_fd: int, out_fd: int) -> bool:
+        if not hasattr(os, 'copy_file_range'):
+            return False
+        while not self.cancelled.is_set():
+            copied = os.copy_file_range(in_fd, out_fd, KERNEL_CHUNK)
+            if not copied:
+                return True
+            self._advance(0, copied)
+        return True
+
+    def _sendfile(self, in_fd: int, out_fd: int) -> bool:
+        if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+            return False
+        while not self.cancelled.is_set():
+            copied = os.sendfile(out_fd, in_fd, None, KERNEL_CHUNK)
+            if not copied:
+                return True
+            self._advance(0, copied)
+        return True
+
+    def _advance(self, files: int, size: int):
+        self.stats.add(files, size)
+        if self.progress:
+            self.progress(self.stats)
+
+
+class ResumableCopy:
+    """
+    Chunked copy of one large file which survives being interrupted.
+
+    Data goes to a hidden temporary sibling of the destination in fixed size chunks. After
+    each chunk is flushed to disk its hash is recorded in a journal next to it. A later copy
+    of the same (unchanged) source re-hashes the chunks already written, carries on after
+    the last one that verifies, and only renames the finished file into place at the end.
+    """
+    def __init__(self, source: str, destination: str, cancelled: threading.Event = None, advance=None):
+        """
+        :param source: File to copy
+        :param destination: Path the copy should have
+        :param cancelled: Event which interrupts the copy when set, leaving it resumable
+        :param advance: Callable receiving (files, bytes) as progress is made
+        """
+        self.source = source
+        self.destination = destination
+        self.cancelled = cancelled or threading.Event()
+        self.advance = advance or (lambda files, size: None)
+
+        folder, name = os.path.split(destination)
+        self.part = os.path.join(folder, f".{name}.commander-part")
+        self.journal = os.path.join(folder, f".{name}.commander-journal")
+
+    def run(self) -> bool:
+        """
+        :return: True once the destination is complete, False if interrupted
+        """
+        status = os.stat(self.source)
+        identity = {'source': os.path.abspath(self.source), 'size': status.st_size,
+                    'mtime_ns': status.st_mtime_ns, 'chunk': RESUME_CHUNK}
+        hashes = self._verified_chunks(identity)
+
+        buffer = bytearray(RESUME_CHUNK)
+        with open(self.source, 'rb') as file_in, \
+                open(self.part, 'r+b' if hashes else 'wb') as file_out:
+            offset = len(hashes) * RESUME_CHUNK
+            file_in.seek(offset)
+            file_out.truncate(offset)
+            file_out.seek(offset)
+            self.advance(0, offset)
+
+            while True:
+                if self.cancelled.is_set():
+                    return False
+                count = file_in.readinto(buffer)
+                if not count:
+                    break
+                chunk = memoryview(buffer)[:count]
+                file_out.write(chunk)
+                file_out.flush()
+                os.fsync(file_out.fileno())
+
+                hashes.append(hashlib.blake2b(chunk, digest_size=16).hexdigest())
+                self._write_journal(identity, hashes)
+                self.advance(0, count)
+
+        os.replace(self.part, self.destination)
+        os.remove(self.journal)
+        return True
+
+    def _verified_chunks(self, identity: dict) -> list:
+        try:
+            with open(self.journal) as file:
+                journal = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if journal.get('identity') != identity or not os.path.isfile(self.part):
+            return []
+
+        verified = []
+        with open(self.part, 'rb') as file:
+            for digest in journal.get('hashes', []):
+                chunk = file.read(RESUME_CHUNK)
+                if hashlib.blake2b(chunk, digest_size=16).hexdigest() != digest:
+                    break
+                verified.append(digest)
+        return verified
+
+    def _write_journal(self, identity: dict, hashes: list):
+        temporary = self.journal + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'identity': identity, 'hashes': hashes}, file)
+        os.replace(temporary, self.journal)
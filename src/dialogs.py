@@ -1,11 +1,29 @@
 import os
 import logging
 import re
-import shutil
+import sqlite3
 from PyQt5 import uic
 from PyQt5.QtWidgets import QMessageBox, QDialog
+from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QIcon
 from support_dictionaries import Supports
+from support_functions import Supporting
+from search_index import TrigramIndex
+from search_worker import SearchWorker
+from content_search import ContentSearcher
+from result_model import ResultListModel, DiffTableModel, DuplicateTreeModel, TextDiffModel
+from copy_engine import CopyEngine
+from move_engine import MoveEngine
+from permission_engine import PermissionEngine
+from archive_engine import ArchiveEngine, FORMATS
+from archive_index import ArchiveIndex
+from extract_engine import ExtractEngine
+from sync_engine import SyncEngine, COPY, DELETE
+from diff_engine import DiffEngine, STATUSES
+from duplicate_engine import DuplicateEngine
+from text_diff_engine import TextDiffEngine
+from binary_diff_engine import BinaryDiffEngine
+from transfer_queue import Job
 
 
 class MoveDialog(QDialog):
@@ -15,7 +33,12 @@ class MoveDialog(QDialog):
 
         self.setWindowIcon(QIcon('../images/folder.png'))
 
-        if dir_1:
+        self.sources = dir_1 if isinstance(dir_1, list) else []
+        if self.sources:
+            self.dir1 = f"{len(self.sources)} selected items"
+            self.dir2 = dir_2
+            self.fname = ''
+        elif dir_1:
             self.dir1 = dir_1
             self.dir2 = dir_2
             self.fname = os.path.basename(self.dir1)
@@ -35,21 +58,43 @@ class MoveDialog(QDialog):
         self.move_to_edit.setText(self.dir2)
         self.file_name_edit.setText(self.fname)
 
-        self.buttonBox.accepted.connect(lambda: self.move_item(self.move_from_edit.text(),
-                                                               self.move_to_edit.text(),
-                                                               self.file_name_edit.text()))
+        if self.sources:
+            self.move_from_edit.setReadOnly(True)
+            self.file_name_edit.setEnabled(False)
+
+        self.buttonBox.accepted.connect(self._queue_move)
+
+    def _queue_move(self):
+        source = self.move_from_edit.text()
+        destination = self.move_to_edit.text()
+        filename = self.file_name_edit.text()
+        verify = self.verify_check.isChecked()
+
+        if self.sources:
+            sources = self.sources
+            self.parent().transfer_queue.submit(Job('move', f"Move {len(sources)} items to {destination}",
+                                                    lambda job: self.move_items(sources, destination, verify,
+                                                                                job.progress, job.cancelled)))
+            return
+
+        self.parent().transfer_queue.submit(Job('move', f"Move {source} to {destination}",
+                                                lambda job: self.move_item(source, destination, filename, verify,
+                                                                           job.progress, job.cancelled)))
 
     @staticmethod
-    def move_item(source: str, destination: str, filename: str):
+    def move_item(source: str, destination: str, filename: str, verify: bool = False,
+                  progress=None, cancelled=None) -> bool:
         if not filename:
             filename = os.path.basename(source)
 
         move_to = os.path.join(destination, filename)
 
         try:
-            os.rename(source, move_to)
-            # shutil.move(source, move_to)
-            logging.info(f"Moved {source} to {destination} as {filename}")
+            engine = MoveEngine(verify, progress=progress, cancelled=cancelled)
+            stats = engine.move(source, move_to)
+            if not engine.cancelled.is_set():
+                logging.info(f"Moved {source} to {destination} as {filename} - {stats.summary()}")
+            return True
         # Source is a file, but destination is a directory
         except IsADirectoryError:
             logging.error('Destination only a directory')
@@ -61,6 +106,27 @@ class MoveDialog(QDialog):
         except OSError as error:
             logging.error(error)
 
+        return False
+
+    @staticmethod
+    def move_items(sources: list, destination: str, verify: bool = False, progress=None, cancelled=None) -> bool:
+        """
+        This function moves several items into the destination folder, keeping their names.
+
+        :return: False if any of the moves failed
+        """
+        try:
+            engine = MoveEngine(verify, progress=progress, cancelled=cancelled)
+            stats = engine.move_all([(source, os.path.join(destination, os.path.basename(source.rstrip(os.sep))))
+                                     for source in sources])
+            if not engine.cancelled.is_set():
+                logging.info(f"Moved {len(sources)} items to {destination} - {stats.summary()}")
+            return True
+        except OSError as error:
+            logging.error(error)
+
+        return False
+
 
 class CopyDialog(QDialog):
     def __init__(self, parent, dir_1=None, dir_2=None):
@@ -69,7 +135,12 @@ class CopyDialog(QDialog):
 
         self.setWindowIcon(QIcon('../images/copy.png'))
 
-        if dir_1:
+        self.sources = dir_1 if isinstance(dir_1, list) else []
+        if self.sources:
+            self.dir1 = f"{len(self.sources)} selected items"
+            self.dir2 = dir_2
+            self.fname = ''
+        elif dir_1:
             self.dir1 = dir_1
             self.dir2 = dir_2
             self.fname = os.path.basename(self.dir1)
@@ -89,17 +160,47 @@ class CopyDialog(QDialog):
         self.copy_to_edit.setText(self.dir2)
         self.file_name_edit.setText(self.fname)
 
-        self.buttonBox.accepted.connect(lambda: self.copy_item(self.copy_from_edit.text(),
-                                                               self.copy_to_edit.text(),
-                                                               self.file_name_edit.text()))
+        if self.sources:
+            self.copy_from_edit.setReadOnly(True)
+            self.file_name_edit.setEnabled(False)
+
+        self.buttonBox.accepted.connect(self._queue_copy)
+
+    def _queue_copy(self):
+        source = self.copy_from_edit.text()
+        destination = self.copy_to_edit.text()
+        name = self.file_name_edit.text()
+
+        if self.sources:
+            sources = self.sources
+            self.parent().transfer_queue.submit(Job('copy', f"Copy {len(sources)} items to {destination}",
+                                                    lambda job: self.copy_items(sources, destination,
+                                                                                job.progress, job.cancelled)))
+            return
+
+        self.parent().transfer_queue.submit(Job('copy', f"Copy {source} to {destination}",
+                                                lambda job: self.copy_item(source, destination, name,
+                                                                           job.progress, job.cancelled)))
 
     @staticmethod
-    def copy_item(copy_source: str, destination: str, copy_name: str):
+    def copy_item(copy_source: str, destination: str, copy_name: str, progress=None, cancelled=None) -> bool:
+        if not copy_name:
+            copy_name = os.path.basename(copy_source.rstrip(os.sep))
+
         copy_destination = os.path.join(destination, copy_name)
 
         try:
-            shutil.copy(copy_source, copy_destination)
-            logging.info(f"Copied {copy_source} as {copy_destination}")
+            # Members of a browsed archive are extracted instead
+            if ArchiveIndex.is_member(copy_source):
+                ArchiveIndex.extract_item(copy_source, copy_destination, progress, cancelled)
+                logging.info(f"Extracted {copy_source} as {copy_destination}")
+                return True
+
+            engine = CopyEngine(progress=progress, cancelled=cancelled)
+            stats = engine.copy(copy_source, copy_destination)
+            if not engine.cancelled.is_set():
+                logging.info(f"Copied {copy_source} as {copy_destination} - {stats.summary()}")
+            return True
         # Source is a file, but destination is a directory
         except IsADirectoryError:
             logging.error('Destination only a directory')
@@ -111,9 +212,666 @@ class CopyDialog(QDialog):
         except OSError as error:
             logging.error(error)
 
+        return False
+
+    @staticmethod
+    def copy_items(sources: list, destination: str, progress=None, cancelled=None) -> bool:
+        """
+        This function copies several items into the destination folder as one operation,
+        keeping their names.
+
+        :return: False if any of the copies failed
+        """
+        try:
+            members = [source for source in sources if ArchiveIndex.is_member(source)]
+            for member in members:
+                ArchiveIndex.extract_item(member, os.path.join(destination, os.path.basename(member)),
+                                          progress, cancelled)
+
+            engine = CopyEngine(progress=progress, cancelled=cancelled)
+            stats = engine.copy_all([(source, os.path.join(destination, os.path.basename(source.rstrip(os.sep))))
+                                     for source in sources if source not in members])
+            if not engine.cancelled.is_set():
+                logging.info(f"Copied {len(sources)} items to {destination} - {stats.summary()}")
+            return True
+        except OSError as error:
+            logging.error(error)
+
+        return False
+
+
+class ArchiveDialog(QDialog):
+    def __init__(self, parent, items: list):
+        super(ArchiveDialog, self).__init__(parent)
+        uic.loadUi('../ui/archive.ui', self)
+
+        self.setWindowIcon(QIcon('../images/add-file.png'))
+
+        self.items = items
+
+        self.set_up()
+
+    def set_up(self):
+        self.items_label.setText('Archive')
+        self.destination_label.setText('Archive as')
+        self.format_label.setText('Format')
+
+        self.items_edit.setText(self.items[0] if len(self.items) == 1 else f"{len(self.items)} selected items")
+        self.format_combo.addItems(list(FORMATS))
+        self.destination_edit.setText(ArchiveEngine.default_destination(self.items))
+
+        self.format_combo.currentTextChanged.connect(self._format_changed)
+        self.buttonBox.accepted.connect(self._queue_archive)
+
+    def _format_changed(self, archive_format: str):
+        """
+        This function swaps the extension of the archive name for the chosen format.
+        """
+        destination = self.destination_edit.text()
+        for extension in sorted(FORMATS.values(), key=len, reverse=True):
+            if destination.endswith(extension):
+                destination = destination[:-len(extension)]
+                break
+        self.destination_edit.setText(destination + FORMATS[archive_format])
+        self.level_spin.setMinimum(0 if archive_format == 'zip' else 1)
+
+    def _queue_archive(self):
+        items = self.items
+        destination = self.destination_edit.text()
+        archive_format = self.format_combo.currentText()
+        level = self.level_spin.value()
+
+        self.parent().transfer_queue.submit(Job('zip', f"Archive {self.items_edit.text()} as {destination}",
+                                                lambda job: self.archive_items(items, destination, archive_format,
+                                                                               level, job.progress, job.cancelled)))
+
+    @staticmethod
+    def archive_items(items: list, destination: str, archive_format: str = 'zip', level: int = 6,
+                      progress=None, cancelled=None) -> bool:
+        """
+        This function attempts to archive the user selected items.
+
+        :return: True if the archive was created
+        """
+        try:
+            engine = ArchiveEngine(archive_format, level, progress, cancelled)
+            stats = engine.create(items, destination)
+            if not engine.cancelled.is_set():
+                logging.info(f"Archive {destination} created - {stats.summary()}")
+            return True
+        except OSError as error:
+            logging.error(error)
+
+        return False
+
+
+class ExtractDialog(QDialog):
+    def __init__(self, parent, archives: list):
+        super(ExtractDialog, self).__init__(parent)
+        uic.loadUi('../ui/extract.ui', self)
+
+        self.setWindowIcon(QIcon('../images/add-file.png'))
+
+        self.archives = archives
+
+        self.set_up()
+
+    def set_up(self):
+        self.items_label.setText('Extract')
+        self.destination_label.setText('Extract into')
+
+        self.items_edit.setText(self.archives[0] if len(self.archives) == 1
+                                else f"{len(self.archives)} selected archives")
+        self.destination_edit.setText(os.path.dirname(self.archives[0]))
+
+        self.buttonBox.accepted.connect(self._queue_extract)
+
+    def _queue_extract(self):
+        destination = self.destination_edit.text()
+        for archive in self.archives:
+            target = os.path.join(destination, os.path.basename(ExtractEngine.default_destination(archive)))
+            self.parent().transfer_queue.submit(Job('extract', f"Extract {archive} to {target}",
+                                                    lambda job, archive=archive, target=target:
+                                                    self.extract_archive(archive, target, job.progress,
+                                                                         job.cancelled)))
+
+    @staticmethod
+    def extract_archive(archive: str, destination: str, progress=None, cancelled=None) -> bool:
+        """
+        This function attempts to extract the archive into a folder of its own.
+
+        :return: True if everything was extracted
+        """
+        try:
+            engine = ExtractEngine(progress=progress, cancelled=cancelled)
+            stats = engine.extract(archive, destination)
+            if not engine.cancelled.is_set():
+                logging.info(f"Extracted {archive} to {destination} - {stats.summary()}")
+            return True
+        except OSError as error:
+            logging.error(error)
+
+        return False
+
+
+class SyncDialog(QDialog):
+    def __init__(self, parent, dir_1=None, dir_2=None):
+        super(SyncDialog, self).__init__(parent)
+        uic.loadUi('../ui/sync.ui', self)
+
+        self.setWindowIcon(QIcon('../images/copy.png'))
+
+        if dir_1:
+            self.dir1 = dir_1
+            self.dir2 = dir_2
+        else:
+            self.dir1 = ''
+            self.dir2 = ''
+
+        self.plan = None
+        self.plan_options = None
+        self.preview_job = None
+        self.preview_model = ResultListModel(self)
+
+        self.set_up()
+
+    def set_up(self):
+        self.source_label.setText('Sync from')
+        self.destination_label.setText('Sync to')
+
+        self.source_edit.setText(self.dir1)
+        self.destination_edit.setText(self.dir2)
+        self.preview_list.setModel(self.preview_model)
+
+        self.preview_button.released.connect(self._queue_preview)
+        self.parent().transfer_queue.job_finished.connect(self._preview_finished)
+
+        self.buttonBox.accepted.connect(self._queue_sync)
+
+    def done(self, result: int):
+        # The queue outlives the dialog, which would otherwise be called for every job
+        self.parent().transfer_queue.job_finished.disconnect(self._preview_finished)
+        super(SyncDialog, self).done(result)
+
+    def _options(self) -> tuple:
+        return (self.source_edit.text(), self.destination_edit.text(),
+                self.hash_check.isChecked(), self.delete_check.isChecked())
+
+    def _queue_preview(self):
+        """
+        This function plans the sync in the background (a dry run), the actions are listed
+        once the plan is complete and reused by the sync if the options are not changed.
+        """
+        options = self._options()
+        if not os.path.isdir(options[0]) or not options[1]:
+            logging.error("Sync needs a source folder and a destination")
+            return
+
+        self.plan = None
+        self.preview_model.clear()
+        self.status_label.setText("Comparing folders...")
+        self.preview_job = self.parent().transfer_queue.submit(
+            Job('sync', f"Preview sync of {options[0]} to {options[1]}",
+                lambda job: self._plan(options, job)))
+
+    def _plan(self, options: tuple, job: Job) -> bool:
+        source, destination, use_hash, delete_extras = options
+        engine = SyncEngine(source, destination, use_hash, delete_extras, cancelled=job.cancelled)
+        try:
+            plan = engine.plan()
+        except OSError as error:
+            logging.error(error)
+            return False
+        for error in engine.errors[:10]:
+            logging.error(error)
+        if not job.cancelled.is_set():
+            self.plan, self.plan_options = plan, options
+        return True
+
+    def _preview_finished(self, job: Job):
+        if job is not self.preview_job:
+            return
+        self.preview_job = None
+        if self.plan is None:
+            self.status_label.setText("Preview failed or was cancelled")
+            return
+
+        self.preview_model.append([f"{action.action:<7} {action.relative}  ({action.reason})"
+                                   for action in self.plan])
+        copies = [action for action in self.plan if action.action == COPY]
+        deletes = sum(action.action == DELETE for action in self.plan)
+        self.status_label.setText(f"{len(copies)} to copy ({sum(action.size for action in copies) / 1048576:.1f} MB), "
+                                  f"{deletes} to delete, {len(self.plan) - len(copies) - deletes} other")
+
+    def _queue_sync(self):
+        options = self._options()
+        if not os.path.isdir(options[0]) or not options[1]:
+            logging.error("Sync needs a source folder and a destination")
+            return
+
+        plan = self.plan if self.plan_options == options else None
+        self.parent().transfer_queue.submit(Job('sync', f"Sync {options[0]} to {options[1]}",
+                                                lambda job: self.sync_folders(*options, plan,
+                                                                              job.progress, job.cancelled)))
+
+    @staticmethod
+    def sync_folders(source: str, destination: str, use_hash: bool = False, delete_extras: bool = False,
+                     plan: list = None, progress=None, cancelled=None) -> bool:
+        """
+        This function brings the destination up to date with the source, only copying what
+        is new or changed.
+
+        :param plan: Actions of an earlier preview, planned again when not given
+        :return: False if the sync failed
+        """
+        engine = SyncEngine(source, destination, use_hash, delete_extras, progress, cancelled)
+        try:
+            if plan is None:
+                plan = engine.plan()
+                for error in engine.errors[:10]:
+                    logging.error(error)
+            stats = engine.apply(plan).stats
+            if not engine.cancelled.is_set():
+                deletes = sum(action.action == DELETE for action in plan)
+                logging.info(f"Synced {source} to {destination} - {deletes} removed, {stats.summary()}")
+            return True
+        except PermissionError:
+            logging.error('Operation not permitted')
+        except OSError as error:
+            logging.error(error)
+
+        return False
+
+
+class DiffDialog(QDialog):
+    def __init__(self, parent, left: str, right: str):
+        super(DiffDialog, self).__init__(parent)
+        uic.loadUi('../ui/diff.ui', self)
+
+        self.setWindowIcon(QIcon('../images/search.png'))
+
+        self.left = left
+        self.right = right
+
+        self.engine = None
+        self.entries = None
+        self.compare_job = None
+        self.result_model = DiffTableModel(self)
+
+        self.set_up()
+
+    def set_up(self):
+        self.left_label.setText('Left')
+        self.right_label.setText('Right')
+
+        self.left_edit.setText(self.left)
+        self.right_edit.setText(self.right)
+        self.filter_combo.addItems(['all'] + list(STATUSES))
+        self.result_table.setModel(self.result_model)
+        self.result_table.sortByColumn(1, Qt.AscendingOrder)
+
+        self.filter_combo.currentTextChanged.connect(
+            lambda status: self.result_model.set_status_filter(None if status == 'all' else status))
+        self.compare_button.released.connect(self._queue_compare)
+        self.parent().transfer_queue.job_finished.connect(self._compare_finished)
+
+        self._queue_compare()
+
+    def done(self, result: int):
+        self.parent().transfer_queue.job_finished.disconnect(self._compare_finished)
+        super(DiffDialog, self).done(result)
+
+    def _queue_compare(self):
+        """
+        This function compares the two folders (or files) in the background, the results
+        are listed once the comparison is complete.
+        """
+        left, right = self.left_edit.text(), self.right_edit.text()
+        if not os.path.exists(left) or not os.path.exists(right):
+            logging.error("Compare needs two existing folders or files")
+            return
+
+        self.entries = None
+        self.result_model.set_entries([])
+        self.status_label.setText("Comparing...")
+        options = (left, right, self.contents_check.isChecked(), self.same_check.isChecked())
+        self.compare_job = self.parent().transfer_queue.submit(
+            Job('compare', f"Compare {left} with {right}", lambda job: self._compare(options, job)))
+
+    def _compare(self, options: tuple, job: Job) -> bool:
+        engine = DiffEngine(*options, progress=job.progress, cancelled=job.cancelled)
+        try:
+            entries = engine.compare()
+        except OSError as error:
+            logging.error(error)
+            return False
+        for error in engine.errors[:10]:
+            logging.error(error)
+        if not job.cancelled.is_set():
+            self.engine, self.entries = engine, entries
+            logging.info(f"Compared {options[0]} with {options[1]} - {engine.summary()}")
+        return True
+
+    def _compare_finished(self, job: Job):
+        if job is not self.compare_job:
+            return
+        self.compare_job = None
+        if self.entries is None:
+            self.status_label.setText("Compare failed or was cancelled")
+            return
+
+        self.result_model.set_entries(self.entries)
+        self.result_table.resizeColumnsToContents()
+        self.status_label.setText(self.engine.summary())
+
+
+class TextDiffDialog(QDialog):
+    def __init__(self, parent, left: str, right: str):
+        super(TextDiffDialog, self).__init__(parent)
+        uic.loadUi('../ui/text_diff.ui', self)
+
+        self.setWindowIcon(QIcon('../images/search.png'))
+
+        self.left = left
+        self.right = right
+
+        self.engine = None
+        self.compared = None
+        self.compare_job = None
+        self.result_model = TextDiffModel(self)
+
+        self.set_up()
+
+    def set_up(self):
+        self.left_label.setText('Left')
+        self.right_label.setText('Right')
+
+        self.left_edit.setText(self.left)
+        self.right_edit.setText(self.right)
+        self.result_table.setModel(self.result_model)
+        self.result_table.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 4)
+
+        self.compare_button.released.connect(self._queue_compare)
+        self.parent().transfer_queue.job_finished.connect(self._compare_finished)
+        self.finished.connect(lambda: self._set_engine(None))
+
+        self._queue_compare()
+
+    def done(self, result: int):
+        self.parent().transfer_queue.job_finished.disconnect(self._compare_finished)
+        super(TextDiffDialog, self).done(result)
+
+    def _queue_compare(self):
+        """
+        This function compares the two text files in the background, the differences are
+        rendered as the table is scrolled once the comparison is complete.
+        """
+        left, right = self.left_edit.text(), self.right_edit.text()
+        if not os.path.isfile(left) or not os.path.isfile(right):
+            logging.error("Text compare needs two existing files")
+            return
+
+        self._set_engine(None)
+        self.status_label.setText("Comparing...")
+        self.compare_job = self.parent().transfer_queue.submit(
+            Job('compare', f"Compare {left} with {right}", lambda job: self._compare(left, right, job)))
+
+    def _compare(self, left: str, right: str, job: Job) -> bool:
+        try:
+            engine = TextDiffEngine(left, right, progress=job.progress, cancelled=job.cancelled)
+            engine.compare()
+        except (OSError, ValueError) as error:
+            logging.error(error)
+            return False
+        if job.cancelled.is_set():
+            engine.close()
+            return True
+        self.compared = engine
+        logging.info(f"Compared {left} with {right} - {engine.summary()}")
+        return True
+
+    def _compare_finished(self, job: Job):
+        if job is not self.compare_job:
+            return
+        self.compare_job = None
+        if self.compared is None:
+            self.status_label.setText("Compare failed or was cancelled")
+            return
+
+        self._set_engine(self.compared)
+        self.compared = None
+        if self.result_model.canFetchMore():
+            self.result_model.fetchMore()
+        self.result_table.resizeColumnsToContents()
+        self.status_label.setText("Files are identical" if not self.engine.hunks else self.engine.summary())
+
+    def _set_engine(self, engine):
+        """
+        This function shows the differences of a compared engine, closing the files of the
+        one shown before.
+        """
+        if self.engine is not None:
+            self.engine.close()
+        self.engine = engine
+        self.result_model.set_engine(engine)
+
+
+class BinaryDiffDialog(QDialog):
+    def __init__(self, parent, left: str, right: str):
+        super(BinaryDiffDialog, self).__init__(parent)
+        uic.loadUi('../ui/binary_diff.ui', self)
+
+        self.setWindowIcon(QIcon('../images/search.png'))
+
+        self.left = left
+        self.right = right
+
+        self.engine = None
+        self.compare_job = None
+        self.result_model = ResultListModel(self)
+
+        self.set_up()
+
+    def set_up(self):
+        self.left_label.setText('Left')
+        self.right_label.setText('Right')
+
+        self.left_edit.setText(self.left)
+        self.right_edit.setText(self.right)
+        self.result_list.setModel(self.result_model)
+
+        self.compare_button.released.connect(self._queue_compare)
+        self.parent().transfer_queue.job_finished.connect(self._compare_finished)
+
+        self._queue_compare()
+
+    def done(self, result: int):
+        self.parent().transfer_queue.job_finished.disconnect(self._compare_finished)
+        super(BinaryDiffDialog, self).done(result)
+
+    def _queue_compare(self):
+        """
+        This function compares the two files byte for byte in the background, the differing
+        ranges are listed once the comparison is complete.
+        """
+        left, right = self.left_edit.text(), self.right_edit.text()
+        if not os.path.isfile(left) or not os.path.isfile(right):
+            logging.error("Binary compare needs two existing files")
+            return
+
+        self.engine = None
+        self.result_model.clear()
+        self.status_label.setText("Comparing...")
+        self.compare_job = self.parent().transfer_queue.submit(
+            Job('compare', f"Compare {left} with {right}", lambda job: self._compare(left, right, job)))
+
+    def _compare(self, left: str, right: str, job: Job) -> bool:
+        engine = BinaryDiffEngine(left, right, progress=job.progress, cancelled=job.cancelled)
+        try:
+            engine.compare()
+        except OSError as error:
+            logging.error(error)
+            return False
+        if not job.cancelled.is_set():
+            self.engine = engine
+            logging.info(f"Compared {left} with {right} - {engine.summary()}")
+        return True
+
+    def _compare_finished(self, job: Job):
+        if job is not self.compare_job:
+            return
+        self.compare_job = None
+        if self.engine is None:
+            self.status_label.setText("Compare failed or was cancelled")
+            return
+
+        self.result_model.append([f"{start:,} - {end:,} (0x{start:x} - 0x{end:x}), {end - start:,} bytes"
+                                  for start, end in self.engine.ranges])
+        self.status_label.setText(self.engine.summary())
+
+
+class DuplicatesDialog(QDialog):
+    def __init__(self, parent, left: str, right: str):
+        super(DuplicatesDialog, self).__init__(parent)
+        uic.loadUi('../ui/duplicates.ui', self)
+
+        self.setWindowIcon(QIcon('../images/search.png'))
+
+        self.left = left
+        self.right = right
+
+        self.engine = None
+        self.groups = None
+        self.linked = None
+        self.find_job = None
+        self.link_job = None
+        self.result_model = DuplicateTreeModel(self)
+
+        self.set_up()
+
+    def set_up(self):
+        self.left_label.setText('Left')
+        self.right_label.setText('Right')
+        self.size_label.setText('Minimum size')
+
+        self.left_edit.setText(self.left)
+        self.right_edit.setText(self.right)
+        self.min_size_spin.setValue(1)
+        self.result_tree.setModel(self.result_model)
+        self.result_tree.sortByColumn(3, Qt.DescendingOrder)
+        self.link_button.setEnabled(False)
+
+        self.find_button.released.connect(self._queue_find)
+        self.link_button.released.connect(self._queue_link)
+        self.parent().transfer_queue.job_finished.connect(self._job_finished)
+
+        self._queue_find()
+
+    def done(self, result: int):
+        self.parent().transfer_queue.job_finished.disconnect(self._job_finished)
+        super(DuplicatesDialog, self).done(result)
+
+    def _queue_find(self):
+        """
+        This function searches both folders for duplicates in the background, the groups
+        are listed once the search is complete.
+        """
+        roots = [root for root in (self.left_edit.text(), self.right_edit.text()) if os.path.isdir(root)]
+        if not roots:
+            logging.error("Finding duplicates needs an existing folder")
+            return
+
+        self.groups = None
+        self.result_model.set_groups([])
+        self.link_button.setEnabled(False)
+        self.status_label.setText("Searching...")
+        min_size = self.min_size_spin.value() * 1024
+        self.find_job = self.parent().transfer_queue.submit(
+            Job('duplicates', f"Find duplicates in {', '.join(roots)}",
+                lambda job: self._find(roots, min_size, job)))
+
+    def _find(self, roots: list, min_size: int, job: Job) -> bool:
+        engine = DuplicateEngine(roots, min_size, progress=job.progress, cancelled=job.cancelled)
+        try:
+            groups = engine.find()
+        except OSError as error:
+            logging.error(error)
+            return False
+        for error in engine.errors[:10]:
+            logging.error(error)
+        if not job.cancelled.is_set():
+            self.engine, self.groups = engine, groups
+            logging.info(f"Duplicates in {', '.join(roots)} - {engine.summary(groups)}")
+        return True
+
+    def _queue_link(self):
+        """
+        This function replaces the copies of the selected groups (all groups if none is
+        selected) by hardlinks to the first file of each group, after a confirmation.
+        """
+        selected = {id(group): group for group in map(self.result_model.group,
+                                                      self.result_tree.selectionModel().selectedRows())}
+        groups = list(selected.values()) or self.groups
+        if not groups or not self._link_dialog(groups):
+            return
+
+        self.linked = None
+        self.link_button.setEnabled(False)
+        self.status_label.setText("Linking...")
+        self.link_job = self.parent().transfer_queue.submit(
+            Job('link', f"Hardlink {len(groups)} duplicate groups", lambda job: self._link(groups, job)))
+
+    def _link_dialog(self, groups: list) -> bool:
+        """
+        :return: Boolean response
+        """
+        link_check_dialog = QMessageBox()
+        icon = QIcon('../images/search.png')
+        link_check_dialog.setIconPixmap(icon.pixmap(20, 20))
+        link_check_dialog.setWindowTitle("Check Hardlink Event")
+        link_check_dialog.setText(f"Replace the copies in {len(groups)} groups by hardlinks, freeing "
+                                  f"{DuplicateEngine.reclaimable(groups) / 1048576:.1f} MB?")
+        link_check_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.Cancel)
+
+        return link_check_dialog.exec() == QMessageBox.Yes
+
+    def _link(self, groups: list, job: Job) -> bool:
+        engine = DuplicateEngine([], cancelled=job.cancelled)
+        linked, freed = engine.link(groups)
+        for error in engine.errors[:10]:
+            logging.error(error)
+        self.linked = (linked, freed, len(engine.errors))
+        logging.info(f"Replaced {linked} duplicates by hardlinks, {freed / 1048576:.1f} MB freed")
+        return not engine.errors
+
+    def _job_finished(self, job: Job):
+        if job is self.link_job:
+            self.link_job = None
+            if self.linked is None:
+                self.link_button.setEnabled(bool(self.groups))
+                self.status_label.setText("Linking failed or was cancelled")
+                return
+            linked, freed, failed = self.linked
+            self.status_label.setText(f"{linked} copies replaced by hardlinks, {freed / 1048576:.1f} MB freed"
+                                      + (f", {failed} failed (see log)" if failed else ''))
+            self._queue_find()
+            return
+        if job is not self.find_job:
+            return
+        self.find_job = None
+        if self.groups is None:
+            self.status_label.setText("Search failed or was cancelled")
+            return
+
+        self.result_model.set_groups(self.groups)
+        self.result_model.sort(3, Qt.DescendingOrder)
+        self.result_tree.resizeColumnToContents(0)
+        self.link_button.setEnabled(bool(self.groups))
+        self.status_label.setText(self.engine.summary(self.groups))
+
 
 class PermissionsDialog(QDialog):
-    def __init__(self, parent, path: str):
+    def __init__(self, parent, path):
         super(PermissionsDialog, self).__init__(parent)
         uic.loadUi('../ui/permissions.ui', self)
 
@@ -125,13 +883,20 @@ class PermissionsDialog(QDialog):
         self.owner_file_dict, self.owner_file_dict_2, self.group_file_dict, self.group_file_dict_2,\
             self.others_file_dict, self.others_file_dict_2 = Supports.dicts(self)
 
-        self.set_up(path)
+        self.paths = path if isinstance(path, list) else []
+
+        # Files show both the file and the folder permissions, so one is preferred for a selection
+        self.set_up(next((p for p in self.paths if os.path.isfile(p)), self.paths[0]) if self.paths else path)
 
     def set_up(self, path):
         current = oct(os.stat(path).st_mode)[-3:]
         self.start_boxes(path, current)
 
-        self.item_path_edit.setText(path)
+        if self.paths:
+            self.item_path_edit.setText(f"{len(self.paths)} selected items")
+            self.item_path_edit.setReadOnly(True)
+        else:
+            self.item_path_edit.setText(path)
 
         self.buttonBox.accepted.connect(self.change_permissions)
 
@@ -170,7 +935,21 @@ class PermissionsDialog(QDialog):
         self.calculate_permissions_file()
         self.calculate_permissions_folder()
 
-        self.set_permissions(self.item_path_edit.text())
+        path = self.item_path_edit.text()
+        recursive = self.recursive_check.isChecked()
+        dry_run = self.dry_run_check.isChecked()
+
+        if self.paths:
+            paths = self.paths
+            self.parent().transfer_queue.submit(Job('chmod', f"Permissions of {len(paths)} items",
+                                                    lambda job: self.set_permissions_all(paths, recursive, dry_run,
+                                                                                         job.progress,
+                                                                                         job.cancelled)))
+            return
+
+        self.parent().transfer_queue.submit(Job('chmod', f"Permissions of {path}",
+                                                lambda job: self.set_permissions(path, recursive, dry_run,
+                                                                                 job.progress, job.cancelled)))
 
     def calculate_permissions_file(self):
         """
@@ -256,7 +1035,8 @@ class PermissionsDialog(QDialog):
 
         self.folder_permissions = int(f"{owner}{group}{others}", 8)
 
-    def set_permissions(self, path: str):
+    def set_permissions(self, path: str, recursive: bool = False, dry_run: bool = False,
+                        progress=None, cancelled=None) -> bool:
         """
         This function attempts to set the permissions of the file/s and/or folder/s
         given by the user as defined in the dialog.
@@ -266,23 +1046,34 @@ class PermissionsDialog(QDialog):
 
         :param path: Path of the user selected file/folder for thich the permissions should
         be updated.
+        :param recursive: Apply the permissions to everything below a selected folder
+        :param dry_run: Only report what would change
+        :param progress: Callable receiving the TransferStats of a recursive change
+        :param cancelled: Event which stops a recursive change when set
+        :return: False if any of the changes failed
         """
-        if os.path.isfile(path):
-            os.chmod(path, self.file_permissions)
-            logging.info(f"Permissions of {path} have been updated to {self.file_permissions}")
-        else:
-            if self.recursive_check.isChecked():
-                for root, dirs, files in os.walk(path):
-                    for d in dirs:
-                        os.chmod(os.path.join(root, d), self.folder_permissions)
-                    for f in files:
-                        os.chmod(os.path.join(root, f), self.file_permissions)
-                logging.info(f"All files and directories in {path} have been updated to: \n"
-                             f"{self.file_permissions} \n"
-                             f"{self.folder_permissions}")
-            else:
-                os.chmod(path, self.folder_permissions)
-                logging.info(f"Permissions of {path} have been updated to {self.folder_permissions}")
+        return self.set_permissions_all([path], recursive, dry_run, progress, cancelled)
+
+    def set_permissions_all(self, paths: list, recursive: bool = False, dry_run: bool = False,
+                            progress=None, cancelled=None) -> bool:
+        """
+        This function sets the permissions of several user selected files and folders as one
+        operation, the folders' contents included for a recursive change.
+
+        :return: False if any of the changes failed
+        """
+        engine = PermissionEngine(self.file_permissions, self.folder_permissions, dry_run,
+                                  progress=progress, cancelled=cancelled)
+        engine.apply(paths, recursive)
+
+        for path, current, wanted in engine.preview:
+            logging.info(f"Would change {path} from {oct(current)} to {oct(wanted)}")
+        target = paths[0] if len(paths) == 1 else f"{len(paths)} selected items"
+        logging.info(f"Permissions of {target} (files {oct(self.file_permissions)}, "
+                     f"folders {oct(self.folder_permissions)}): {engine.summary()}")
+        for error in engine.errors:
+            logging.error(error)
+        return not engine.failed
 
 
 class RenameDialog(QDialog):
@@ -292,7 +1083,12 @@ class RenameDialog(QDialog):
 
         self.setWindowIcon(QIcon('../images/edit.png'))
 
-        if dir_1:
+        self.sources = dir_1 if isinstance(dir_1, list) else []
+        if self.sources:
+            self.dir1 = f"{len(self.sources)} selected items"
+            self.dir2 = '{name}{ext}'
+            self.fname = ''
+        elif dir_1:
             self.dir1 = dir_1
             self.dir2 = dir_1
             self.fname = os.path.basename(self.dir1)
@@ -310,8 +1106,56 @@ class RenameDialog(QDialog):
         self.current_name_edit.setText(self.dir1)
         self.rename_location_edit.setText(self.dir2)
 
-        self.buttonBox.accepted.connect(lambda: self.rename_item(self.current_name_edit.text(),
-                                                                 self.rename_location_edit.text()))
+        if self.sources:
+            self.current_name_edit.setReadOnly(True)
+            self.rename_location_label.setText('Pattern {name} {ext} {n}')
+            self.buttonBox.accepted.connect(self._queue_rename)
+        else:
+            self.buttonBox.accepted.connect(lambda: self.rename_item(self.current_name_edit.text(),
+                                                                     self.rename_location_edit.text()))
+
+    def _queue_rename(self):
+        sources = self.sources
+        pattern = self.rename_location_edit.text()
+
+        self.parent().transfer_queue.submit(Job('rename', f"Rename {len(sources)} items as {pattern}",
+                                                lambda job: self.rename_items(sources, pattern,
+                                                                              job.progress, job.cancelled)))
+
+    @staticmethod
+    def rename_items(sources: list, pattern: str, progress=None, cancelled=None) -> bool:
+        """
+        This function renames several items in place following a naming pattern, where {name}
+        and {ext} stand for each item's current name and extension and {n} for its number in
+        the selection. Nothing is renamed if the new names clash with each other or with
+        existing files.
+
+        :return: False if the renaming failed
+        """
+        renames = []
+        try:
+            for number, source in enumerate(sources, 1):
+                folder, base = os.path.split(source)
+                name, ext = os.path.splitext(base)
+                target = os.path.join(folder, pattern.format(name=name, ext=ext, n=number))
+                if target != source:
+                    renames.append((source, target))
+        except (KeyError, IndexError, ValueError) as error:
+            logging.error(f"Invalid naming pattern {pattern}: {error}")
+            return False
+
+        targets = [target for _, target in renames]
+        clashes = [target for target in targets if os.path.lexists(target)]
+        if clashes or len(set(targets)) != len(targets):
+            logging.error(f"Renaming as {pattern} would overwrite {clashes[0] if clashes else 'a renamed item'}")
+            return False
+
+        stats, errors = Supporting.run_batch(renames, lambda rename: os.rename(*rename), progress, cancelled)
+
+        logging.info(f"Renamed {stats.files - len(errors)} of {len(sources)} items as {pattern}")
+        for error in errors:
+            logging.error(error)
+        return not errors
 
     @staticmethod
     def rename_item(source: str, rename_to: str):
@@ -515,6 +1359,11 @@ class SearchDialog(QDialog):
 
         self.selected = ''
         self.active_view = active_view
+        self.worker = None
+        self.index_job = None
+        self.rescanned = None
+        self.match_count = 0
+        self.result_model = ResultListModel(self)
 
         self.set_up()
 
@@ -522,10 +1371,19 @@ class SearchDialog(QDialog):
         self.location_label.setText("Location")
         self.search_label.setText("Search")
 
+        self.filter_label.setText("Filter")
+
         self.location_edit.setText(self.dir1)
+        self.search_list.setModel(self.result_model)
 
         self.search_button.released.connect(self._find_matches)
-        self.search_list.itemClicked.connect(self._selected_item)
+        self.search_edit.returnPressed.connect(self._find_matches)
+        self.cancel_button.released.connect(self._cancel_search)
+        self.index_button.released.connect(self._index_location)
+        self.parent().transfer_queue.job_finished.connect(self._index_finished)
+        self.search_list.clicked.connect(self._selected_item)
+        self.filter_edit.textChanged.connect(self.result_model.set_filter)
+        self.sort_button.released.connect(self._sort_results)
 
         self.buttonBox.accepted.connect(self._share_result)
 
@@ -541,34 +1399,127 @@ class SearchDialog(QDialog):
         else:
             find = self.search_edit.text().lower()
 
+        self._cancel_search()
+        self.result_model.clear()
+        self.match_count = 0
+
         if location and find:
-            self.__load_matches(location, find)
-        else:
-            self.search_list.clear()
+            if self.contents_check.isChecked():
+                self.__load_content_matches(location, self.search_edit.text())
+            else:
+                self.__load_matches(location, find)
 
-    def __load_matches(self, location: str, find: str):
-        matches = []
+    def _index_location(self):
+        """
+        This function builds the search index for the chosen location in the background, or
+        incrementally updates the index already covering it.
+        """
+        location = self.location_edit.text()
+        if not os.path.isdir(location):
+            logging.error("No directory to index selected")
+            return
+
+        self.rescanned = None
+        self.index_button.setEnabled(False)
+        self.status_label.setText(f"Indexing {location}...")
+        self.index_job = self.parent().transfer_queue.submit(
+            Job('index', f"Index {location}", lambda job: self._index(location, job)))
+
+    def _index(self, location: str, job: Job) -> bool:
+        # The sqlite connection belongs to the thread which opens it
+        try:
+            index = TrigramIndex.index_for(location) or TrigramIndex(location)
+        except (OSError, sqlite3.Error) as error:
+            logging.error(error)
+            return False
+        try:
+            rescanned = index.update(job.progress, job.cancelled)
+            if not job.cancelled.is_set():
+                self.rescanned = index.root, rescanned
+            return True
+        except (OSError, sqlite3.Error) as error:
+            logging.error(error)
+            return False
+        finally:
+            index.close()
+
+    def _index_finished(self, job: Job):
+        if job is not self.index_job:
+            return
+        self.index_job = None
+        self.index_button.setEnabled(True)
+        if self.rescanned is None:
+            self.status_label.setText("Indexing failed or was cancelled")
+            return
+        root, rescanned = self.rescanned
+        self.status_label.setText(f"Index of {root} current ({rescanned} folders re-read)")
+
+    def __load_content_matches(self, location: str, text: str):
+        """
+        This function starts a background search of file contents, matching lines are
+        streamed into the result list as path:line: text.
+        """
+        try:
+            searcher = ContentSearcher(text, self.regex_check.isChecked(), self.case_check.isChecked(),
+                                       self.max_size_spin.value() * 1024 * 1024)
+        except re.error as error:
+            logging.error(f"Invalid regular expression: {error}")
+            return
 
-        for path, subdirs, files in os.walk(location):
-            for p in path:
-                if re.findall(find, p.lower()):
-                    matches.append(os.path.join(path, p))
-            for d in subdirs:
-                if re.findall(find, d.lower()):
-                    matches.append(os.path.join(path, d))
-            for f in files:
-                if re.findall(find, f.lower()):
-                    matches.append(os.path.join(path, f))
+        self.__load_matches(location, text, searcher)
 
-        self.__show_matches(matches)
+    def __load_matches(self, location: str, find: str, searcher: ContentSearcher = None):
+        """
+        This function starts a background search, matches are streamed into the result list
+        as they are found.
+        """
+        self.worker = SearchWorker(self, location, find, searcher)
+        self.worker.found.connect(self.__show_matches)
+        self.worker.progress.connect(self.__show_progress)
+        self.worker.completed.connect(self.__search_completed)
+        self.worker.start()
+
+        self.cancel_button.setEnabled(True)
+
+    def _cancel_search(self):
+        if self.worker:
+            self.worker.found.disconnect()
+            self.worker.progress.disconnect()
+            self.worker.completed.disconnect()
+            self.worker.cancel()
+            self.worker.finished.connect(self.worker.deleteLater)
+            self.worker = None
+            self.status_label.setText(f"Search cancelled - {self.match_count} matches")
+
+        self.cancel_button.setEnabled(False)
 
     def __show_matches(self, matches: list):
-        self.search_list.clear()
-
-        self.search_list.addItems(matches)
+        self.match_count += len(matches)
+        self.result_model.append(matches)
+
+    def __show_progress(self, scanned: int, rate: float):
+        self.status_label.setText(f"{self.match_count} matches - {scanned} entries ({rate:,.0f}/s)")
+
+    def __search_completed(self, scanned: int, elapsed: float):
+        self.status_label.setText(f"{self.match_count} matches - {scanned} entries in {elapsed:.2f}s")
+        self.cancel_button.setEnabled(False)
+        self.worker = None
+
+    def done(self, result: int):
+        self.parent().transfer_queue.job_finished.disconnect(self._index_finished)
+        self._cancel_search()
+        for worker in self.findChildren(SearchWorker):
+            worker.wait()
+        super(SearchDialog, self).done(result)
+
+    def _sort_results(self):
+        if self.result_model.sort_order == Qt.AscendingOrder:
+            self.result_model.sort(0, Qt.DescendingOrder)
+        else:
+            self.result_model.sort(0, Qt.AscendingOrder)
 
-    def _selected_item(self, item):
-        self.selected = item.text()
+    def _selected_item(self, index):
+        self.selected = self.result_model.path(index.row())
         print(self.selected)
 
     def _share_result(self):
@@ -0,0 +1,195 @@
+import os
+import stat
+import threading
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor
+from walker import Walker
+from hash_cache import HashCache
+from transfer_stats import TransferStats
+
+
+DiffEntry = namedtuple('DiffEntry', ['status', 'relative', 'left_size', 'right_size', 'reason'])
+
+ONLY_LEFT = 'only left'
+ONLY_RIGHT = 'only right'
+SAME = 'same'
+DIFFERENT = 'different'
+
+STATUSES = (DIFFERENT, ONLY_LEFT, ONLY_RIGHT, SAME)
+
+
+class DiffEngine:
+    """
+    Recursive comparison of two directory trees (or two files).
+
+    The left tree is walked in parallel and every directory compared with its right
+    counterpart from one scandir, so the first pass costs metadata only: entries missing on
+    one side are only-left/only-right (a missing folder is reported once, not its contents),
+    a type or size mismatch is different and files of equal size and mtime count as same.
+    Only files whose sizes match but whose mtimes differ (or all size matched files when
+    contents are compared) are then hashed, through the HashCache so files unchanged since
+    an earlier comparison are not read again.
+    """
+    def __init__(self, left: str, right: str, compare_contents: bool = False, include_same: bool = False,
+                 workers: int = None, progress=None, cancelled: threading.Event = None):
+        """
+        :param left: Folder or file
+        :param right: Folder or file to compare it with
+        :param compare_contents: Hash every pair of equally sized files, not only those whose mtime differs
+        :param include_same: List the identical entries too, otherwise they are only counted
+        :param workers: Number of directories compared at once
+        :param progress: Callable receiving the TransferStats as files are compared
+        :param cancelled: Event which stops the comparison when set
+        """
+        self.left = os.path.abspath(left)
+        self.right = os.path.abspath(right)
+        self.compare_contents = compare_contents
+        self.include_same = include_same
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.counts = Counter()
+        self.errors: list = []
+
+        self._lock = threading.Lock()
+
+    def summary(self) -> str:
+        return ', '.join(f"{self.counts[status]} {status}" for status in STATUSES) + \
+               f" in {self.stats.elapsed:.1f}s"
+
+    # ======================================================================
+    def compare(self) -> list:
+        """
+        :return: List of DiffEntry sorted by path, without the identical entries unless include_same
+        """
+        entries = []
+        candidates = []
+        if os.path.isdir(self.left) and os.path.isdir(self.right):
+            with ThreadPoolExecutor(self.workers) as pool:
+                futures = [pool.submit(self._compare_directory, listing)
+                           for listing in Walker(stat=True, cancelled=self.cancelled,
+                                                 onerror=self.errors.append).walk(self.left)]
+                for future in futures:
+                    found, hashes = future.result()
+                    entries.extend(found)
+                    candidates.extend(hashes)
+        else:
+            status, other_status = os.lstat(self.left), os.lstat(self.right)
+            entry = self._compare_files('', status, other_status)
+            if entry is None:
+                candidates.append(('', status.st_size, (status, other_status)))
+            else:
+                self._count([entry], 1)
+                entries.extend([entry] if self.include_same or entry.status != SAME else [])
+
+        entries.extend(self._hash_candidates(candidates))
+        self.stats.finish()
+        if not os.path.isdir(self.left):
+            entries = [entry._replace(relative=os.path.basename(self.left)) for entry in entries]
+        entries.sort(key=lambda entry: entry.relative)
+        return entries
+
+    def _compare_directory(self, listing) -> tuple:
+        """
+        :return: (list of DiffEntry, list of (relative path, size, stat results) still to be hashed)
+        """
+        relative = os.path.relpath(listing.path, self.left)
+        relative = '' if relative == '.' else relative
+
+        others = {}
+        try:
+            with os.scandir(os.path.join(self.right, relative)) as scan:
+                for entry in scan:
+                    others[entry.name] = entry
+        except (FileNotFoundError, NotADirectoryError):
+            # Inside a folder reported as only-left already
+            return [], []
+        except OSError as error:
+            self.errors.append(error)
+            return [], []
+
+        entries, candidates = [], []
+        for entry in listing.dirs + listing.files:
+            path = os.path.join(relative, entry.name)
+            other = others.pop(entry.name, None)
+            try:
+                status = entry.stat(follow_symlinks=False)
+                if other is None:
+                    entries.append(DiffEntry(ONLY_LEFT, path, self._size(status), -1, ''))
+                    continue
+                other_status = other.stat(follow_symlinks=False)
+                if stat.S_ISDIR(status.st_mode) and stat.S_ISDIR(other_status.st_mode):
+                    continue
+                result = self._compare_files(path, status, other_status)
+            except OSError as error:
+                self.errors.append(error)
+                continue
+            if result is None:
+                candidates.append((path, status.st_size, (status, other_status)))
+            else:
+                entries.append(result)
+
+        for name, other in others.items():
+            try:
+                entries.append(DiffEntry(ONLY_RIGHT, os.path.join(relative, name), -1,
+                                         self._size(other.stat(follow_symlinks=False)), ''))
+            except OSError as error:
+                self.errors.append(error)
+
+        self._count(entries, len(listing.dirs) + len(listing.files))
+        return [entry for entry in entries if self.include_same or entry.status != SAME], candidates
+
+    def _compare_files(self, path: str, status: os.stat_result, other: os.stat_result):
+        """
+        :return: DiffEntry decided from the metadata, or None if the contents have to be hashed
+        """
+        left_size, right_size = self._size(status), self._size(other)
+        if stat.S_IFMT(status.st_mode) != stat.S_IFMT(other.st_mode):
+            return DiffEntry(DIFFERENT, path, left_size, right_size, 'type differs')
+        if stat.S_ISLNK(status.st_mode):
+            same = os.readlink(self._join(self.left, path)) == os.readlink(self._join(self.right, path))
+            return DiffEntry(SAME if same else DIFFERENT, path, left_size, right_size,
+                             '' if same else 'link differs')
+        if status.st_size != other.st_size:
+            return DiffEntry(DIFFERENT, path, left_size, right_size, 'size differs')
+        if status.st_mtime_ns == other.st_mtime_ns and not self.compare_contents:
+            return DiffEntry(SAME, path, left_size, right_size, '')
+        return None
+
+    def _hash_candidates(self, candidates: list) -> list:
+        if not candidates:
+            return []
+        lefts = [self._join(self.left, path) for path, _, _ in candidates]
+        rights = [self._join(self.right, path) for path, _, _ in candidates]
+        with HashCache(progress=self.progress, cancelled=self.cancelled) as cache:
+            left_digests = cache.hashes(lefts, [statuses[0] for _, _, statuses in candidates])
+            right_digests = cache.hashes(rights, [statuses[1] for _, _, statuses in candidates])
+            self.errors.extend(cache.errors)
+
+        entries = []
+        for (path, size, _), left, right in zip(candidates, lefts, rights):
+            left, right = left_digests.get(left), right_digests.get(right)
+            if left and right:
+                same = left == right
+                entries.append(DiffEntry(SAME if same else DIFFERENT, path, size, size,
+                                         'same content, time differs' if same else 'content differs'))
+        self._count(entries, 0)
+        return [entry for entry in entries if self.include_same or entry.status != SAME]
+
+    @staticmethod
+    def _join(root: str, path: str) -> str:
+        return os.path.join(root, path) if path else root
+
+    @staticmethod
+    def _size(status: os.stat_result) -> int:
+        return -1 if stat.S_ISDIR(status.st_mode) else status.st_size
+
+    def _count(self, entries: list, checked: int):
+        with self._lock:
+            self.counts.update(entry.status for entry in entries)
+        if checked:
+            self.stats.add(checked)
+            if self.progress:
+                self.progress(self.stats)
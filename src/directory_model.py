@@ -0,0 +1,633 @@
+import os
+import heapq
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex, QPersistentModelIndex, QDateTime, QLocale, QTimer, \
+    QFileSystemWatcher, pyqtSignal
+from PyQt5.QtWidgets import QFileIconProvider
+from result_model import PathStore
+
+
+COLUMNS = ('Name', 'Size', 'Type', 'Date Modified')
+
+FIRST_BATCH = 1000
+BATCH = 20000
+FETCH_ROWS = 2000
+SORT_CHUNK = 50000
+STAT_BATCH = 256
+REFRESH_DELAY = 300
+UNKNOWN = -1
+FOLDER_ROWS = 10000
+
+FILE_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemNeverHasChildren
+FOLDER_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled
+
+
+class _Listing:
+    """
+    One listed folder: its entries in compact arrays indexed by position (the order scandir
+    returned them in, append only), the positions in the order they are sorted and the
+    number of them shown in the view.
+    """
+    __slots__ = ('path', 'parent', 'position', 'names', 'dirs', 'sizes', 'mtimes', 'requested', 'order',
+                 'shown', '_rows', 'children', 'complete', 'dirty', 'generation', 'alive')
+
+    def __init__(self, path: str, parent=None, position: int = 0):
+        self.path = path
+        self.parent = parent
+        self.position = position
+        self.names = PathStore()
+        self.dirs = bytearray()
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.requested = bytearray()
+        self.order = array('I')
+        self.shown = 0
+        self._rows = None
+        self.children = {}
+        self.complete = False
+        self.dirty = False
+        self.generation = 0
+        self.alive = True
+
+    def row(self, position: int) -> int:
+        """
+        :return: Row showing the entry at position, -1 if it is not shown
+        """
+        if self._rows is None:
+            self._rows = {position: row for row, position in enumerate(self.order[:self.shown])}
+        return self._rows.get(position, -1)
+
+    def reordered(self):
+        self._rows = None
+
+    def snapshot(self) -> tuple:
+        """
+        :return: Copies of the names, folder flags and sorted positions for a worker thread
+        """
+        return bytes(self.names.buffer), array('Q', self.names.offsets), bytes(self.dirs), array('I', self.order)
+
+
+class DirectoryModel(QAbstractItemModel):
+    """
+    Tree model of a folder for the explorer panes, built for folders of millions of entries.
+
+    A folder is listed by os.scandir on a worker thread and its entries arrive in batches,
+    the first one small so the first screenful shows at once. Names live in a PathStore and
+    the rest in arrays, no object is kept per entry. Rows are handed to the view FETCH_ROWS
+    at a time as it is scrolled down (canFetchMore/fetchMore), as the view lays out every
+    row it has. Sizes and dates are only looked up (os.stat on a worker thread) for the rows
+    the view asks for, i.e. the visible ones, or for all entries when sorting by them. The
+    Size of a folder is its recursive total, measured by a FolderSizes shared by the models.
+    Folders are sorted first and by name once listed completely. Subfolders are listed when
+    they are expanded. Listed folders are watched and listed again when they change, which
+    adds and removes rows in place.
+
+    It has the columns of QFileSystemModel and answers filePath()/isDir() like it.
+    """
+    result = pyqtSignal(object)
+
+    def __init__(self, path: str, parent=None, folder_sizes=None):
+        """
+        :param path: Folder shown at the top level
+        :param folder_sizes: FolderSizes giving the Size of folders, folders have none without it
+        """
+        super(DirectoryModel, self).__init__(parent)
+        self.root = _Listing(os.path.abspath(path))
+        self.folder_sizes = folder_sizes
+        self.sort_column = 0
+        self.sort_order = Qt.AscendingOrder
+        self.icons = QFileIconProvider()
+        self.folder_icon = self.icons.icon(QFileIconProvider.Folder)
+        self.file_icon = self.icons.icon(QFileIconProvider.File)
+
+        self._closed = threading.Event()
+        self._pool = ThreadPoolExecutor(2)
+        self._wanted = {}
+        self._watched = {}
+        self._changed = set()
+        self._retired = []
+        self._folders = OrderedDict()
+
+        self._stat_timer = QTimer(self, singleShot=True, interval=0)
+        self._stat_timer.timeout.connect(self._request_stats)
+        self._refresh_timer = QTimer(self, singleShot=True, interval=REFRESH_DELAY)
+        self._refresh_timer.timeout.connect(self._refresh_changed)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._directory_changed)
+        self.result.connect(self._apply)
+        if folder_sizes is not None:
+            folder_sizes.measured.connect(self._folder_measured)
+
+        self._list(self.root)
+
+    def close(self):
+        """
+        This function stops the worker threads and the watching, the model shows nothing more.
+        """
+        self._closed.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.folder_sizes is not None:
+            self.folder_sizes.measured.disconnect(self._folder_measured)
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+
+    def rootPath(self) -> str:
+        return self.root.path
+
+    # ======================================================================
+    def _listing(self, index: QModelIndex):
+        """
+        :return: Listing of the folder behind a valid index (None while not listed), the root otherwise
+        """
+        if not index.isValid():
+            return self.root
+        listing = index.internalPointer()
+        return listing.children.get(listing.order[index.row()])
+
+    def _parent_index(self, listing: _Listing) -> QModelIndex:
+        if listing is self.root or not listing.alive:
+            return QModelIndex()
+        row = listing.parent.row(listing.position)
+        return self.createIndex(row, 0, listing.parent) if row >= 0 else QModelIndex()
+
+    def index(self, row: int, column: int, parent=QModelIndex()) -> QModelIndex:
+        listing = self._listing(parent)
+        if listing is None or not 0 <= row < listing.shown or not 0 <= column < len(COLUMNS):
+            return QModelIndex()
+        return self.createIndex(row, column, listing)
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid():
+            return QModelIndex()
+        return self._parent_index(index.internalPointer())
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        listing = self._listing(parent)
+        return 0 if listing is None else listing.shown
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return len(COLUMNS)
+
+    def hasChildren(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() or (parent.column() == 0 and self.isDir(parent))
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        if parent.isValid() and not self.isDir(parent):
+            return False
+        listing = self._listing(parent)
+        return listing is None or listing.shown < len(listing.order)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        listing = self._listing(parent)
+        if listing is not None:
+            self._show(listing, listing.shown + FETCH_ROWS)
+            return
+        listing = parent.internalPointer()
+        position = listing.order[parent.row()]
+        child = _Listing(os.path.join(listing.path, listing.names[position]), listing, position)
+        listing.children[position] = child
+        self._list(child)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        listing = index.internalPointer()
+        flags = FOLDER_FLAGS if listing.dirs[listing.order[index.row()]] else FILE_FLAGS
+        return flags | Qt.ItemIsEditable if index.column() == 0 else flags
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        listing = index.internalPointer()
+        position = listing.order[index.row()]
+        column = index.column()
+        is_dir = listing.dirs[position]
+
+        if role == Qt.DecorationRole and column == 0:
+            return self.folder_icon if is_dir else self.file_icon
+        if role == Qt.TextAlignmentRole and column == 1:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+
+        name = listing.names[position]
+        if column == 0:
+            return name
+        if column == 2:
+            extension = os.path.splitext(name)[1][1:]
+            return 'Folder' if is_dir else f"{extension} File" if extension else 'File'
+        if column == 1 and is_dir:
+            return self._folder_size(listing, position, name)
+        if listing.sizes[position] == UNKNOWN:
+            self._want(listing, position)
+            return ''
+        if column == 1:
+            return QLocale().formattedDataSize(listing.sizes[position])
+        return QDateTime.fromSecsSinceEpoch(int(listing.mtimes[position])).toString(Qt.DefaultLocaleShortDate)
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole) -> bool:
+        """
+        This function renames an entry edited in the view, the folder watch then lists it
+        under its new name.
+        """
+        if role != Qt.EditRole or not index.isValid() or index.column() != 0 or not value:
+            return False
+        path = self.filePath(index)
+        try:
+            os.rename(path, os.path.join(os.path.dirname(path), value))
+        except OSError as error:
+            logging.error(error)
+            return False
+        return True
+
+    def sort(self, column: int = 0, order=Qt.AscendingOrder):
+        if (column, order) == (self.sort_column, self.sort_order):
+            return
+        self.sort_column, self.sort_order = column, order
+        for listing in self._listings(self.root):
+            if listing.complete:
+                self._request_sort(listing)
+
+    # ======================================================================
+    def filePath(self, index: QModelIndex) -> str:
+        if not index.isValid():
+            return self.root.path
+        listing = index.internalPointer()
+        return os.path.join(listing.path, listing.names[listing.order[index.row()]])
+
+    def isDir(self, index: QModelIndex) -> bool:
+        if not index.isValid():
+            return True
+        listing = index.internalPointer()
+        return bool(listing.dirs[listing.order[index.row()]])
+
+    def _listings(self, listing: _Listing):
+        yield listing
+        for child in list(listing.children.values()):
+            yield from self._listings(child)
+
+    def _show(self, listing: _Listing, count: int):
+        """
+        This function hands rows of a listing to the view up to count rows.
+        """
+        end = min(count, len(listing.order))
+        if end > listing.shown:
+            self.beginInsertRows(self._parent_index(listing), listing.shown, end - 1)
+            listing.shown = end
+            listing.reordered()
+            self.endInsertRows()
+
+    # ======================================================================
+    def _submit(self, work, *args):
+        if not self._closed.is_set():
+            self._pool.submit(work, *args)
+
+    def _emit(self, *result):
+        if self._closed.is_set():
+            return
+        try:
+            self.result.emit(result)
+        except RuntimeError:
+            # The model was deleted while the worker ran
+            self._closed.set()
+
+    def _apply(self, result: tuple):
+        kind, listing, generation = result[:3]
+        if self._closed.is_set() or not listing.alive or generation != listing.generation:
+            return
+        getattr(self, f"_apply_{kind}")(listing, *result[3:])
+
+    def _list(self, listing: _Listing):
+        if os.path.isdir(listing.path):
+            self.watcher.addPath(listing.path)
+            self._watched[listing.path] = listing
+        self._submit(self._scan, listing, listing.generation)
+
+    def _scan(self, listing: _Listing, generation: int):
+        """
+        This function lists a folder in batches, it runs on a worker thread. A folder which
+        fits in the first batch is sorted before it is shown.
+        """
+        batch = []
+        size = FIRST_BATCH
+        try:
+            with os.scandir(listing.path) as scan:
+                for entry in scan:
+                    if self._closed.is_set():
+                        return
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    batch.append((entry.name, is_dir))
+                    if len(batch) >= size:
+                        self._emit('rows', listing, generation, batch, False)
+                        batch, size = [], BATCH
+        except OSError:
+            pass
+        if size == FIRST_BATCH and self.sort_column in (0, 2):
+            sorting = self.sort_column, self.sort_order
+            batch = self._ordered(batch, lambda entry: entry[1], lambda entry: self._key(entry[0], 0, 0),
+                                  self.sort_order)
+            self._emit('rows', listing, generation, batch, sorting)
+        else:
+            self._emit('rows', listing, generation, batch, True)
+
+    def _apply_rows(self, listing: _Listing, batch: list, sort):
+        """
+        :param sort: False while more batches follow, then True if the folder still has to be sorted
+            or the (column, order) it is sorted by already
+        """
+        first = len(listing.names)
+        for name, is_dir in batch:
+            listing.names.append(name)
+        listing.dirs.extend(is_dir for _, is_dir in batch)
+        listing.sizes.extend([UNKNOWN] * len(batch))
+        listing.mtimes.extend([0.0] * len(batch))
+        listing.requested.extend(bytes(len(batch)))
+        listing.order.extend(range(first, first + len(batch)))
+        self._show(listing, FETCH_ROWS)
+
+        if sort is not False:
+            listing.complete = True
+            if sort != (self.sort_column, self.sort_order):
+                self._request_sort(listing)
+            if listing.dirty:
+                self._refresh(listing)
+
+    # ======================================================================
+    def _want(self, listing: _Listing, position: int):
+        if not listing.requested[position]:
+            listing.requested[position] = 1
+            self._wanted.setdefault(listing, []).append(position)
+            self._stat_timer.start()
+
+    def _request_stats(self):
+        wanted, self._wanted = self._wanted, {}
+        for listing, positions in wanted.items():
+            if listing.alive:
+                entries = [(position, os.path.join(listing.path, listing.names[position])) for position in positions]
+                self._submit(self._stat, listing, listing.generation, entries)
+
+    def _stat(self, listing: _Listing, generation: int, entries: list):
+        """
+        This function looks up the sizes and dates of entries, it runs on a worker thread.
+        """
+        results = []
+        for position, path in entries:
+            if self._closed.is_set():
+                return
+            results.append((position, *self._status(path)))
+            if len(results) >= STAT_BATCH:
+                self._emit('stats', listing, generation, results)
+                results = []
+        self._emit('stats', listing, generation, results)
+
+    @staticmethod
+    def _status(path: str) -> tuple:
+        """
+        :return: (size, modification time) of a path, of the link itself if it is broken
+        """
+        try:
+            status = os.stat(path)
+        except OSError:
+            try:
+                status = os.lstat(path)
+            except OSError:
+                return 0, 0.0
+        return status.st_size, status.st_mtime
+
+    def _apply_stats(self, listing: _Listing, results: list):
+        rows = []
+        for position, size, mtime in results:
+            listing.sizes[position] = size
+            listing.mtimes[position] = mtime
+            rows.append(listing.row(position))
+        rows = [row for row in rows if row >= 0]
+        if rows:
+            parent = self._parent_index(listing)
+            self.dataChanged.emit(self.index(min(rows), 1, parent), self.index(max(rows), 3, parent))
+
+    # ======================================================================
+    def _key(self, name: str, size: int, mtime: float):
+        column = self.sort_column
+        if column == 0:
+            return name.casefold()
+        value = size if column == 1 else os.path.splitext(name)[1].lower() if column == 2 else mtime
+        return value, name.casefold()
+
+    @staticmethod
+    def _ordered(items, is_dir, key, order) -> list:
+        """
+        :return: Items sorted by key, folders first in both orders
+        """
+        reverse = order == Qt.DescendingOrder
+        ordered = []
+        for group in ([item for item in items if is_dir(item)], [item for item in items if not is_dir(item)]):
+            # One sort holds the GIL throughout, merging sorted chunks lets the GUI thread run
+            chunks = [sorted(group[start:start + SORT_CHUNK], key=key, reverse=reverse)
+                      for start in range(0, len(group), SORT_CHUNK)]
+            ordered.extend(heapq.merge(*chunks, key=key, reverse=reverse))
+        return ordered
+
+    def _request_sort(self, listing: _Listing):
+        sizes = array('q', listing.sizes) if self.sort_column in (1, 3) else None
+        self._submit(self._sort, listing, listing.generation, listing.snapshot(), sizes,
+                     array('d', listing.mtimes) if sizes is not None else None,
+                     self.sort_column, self.sort_order)
+
+    def _sort(self, listing: _Listing, generation: int, snapshot: tuple, sizes, mtimes, column: int, order):
+        """
+        This function works out the sorted order of a listing, it runs on a worker thread.
+        Sorting by size or date first looks up the entries not known yet.
+        """
+        buffer, offsets, dirs, positions = snapshot
+        stats = []
+        if sizes is not None:
+            for position in positions:
+                if sizes[position] == UNKNOWN:
+                    if self._closed.is_set():
+                        return
+                    name = buffer[offsets[position]:offsets[position + 1]].decode('utf-8', 'surrogateescape')
+                    sizes[position], mtimes[position] = self._status(os.path.join(listing.path, name))
+                    stats.append((position, sizes[position], mtimes[position]))
+
+        if column == 1 and self.folder_sizes is not None:
+            # Folders by the totals known so far
+            for position in positions:
+                if dirs[position]:
+                    name = buffer[offsets[position]:offsets[position + 1]].decode('utf-8', 'surrogateescape')
+                    sizes[position] = self.folder_sizes.cached(os.path.join(listing.path, name)) or 0
+
+        if column != self.sort_column or order != self.sort_order or self._closed.is_set():
+            return
+        keys = [None] * (len(offsets) - 1)
+        for position in positions:
+            keys[position] = self._key(buffer[offsets[position]:offsets[position + 1]].decode('utf-8', 'surrogateescape'),
+                                       sizes[position] if sizes else 0, mtimes[position] if mtimes else 0.0)
+        ordered = array('I', self._ordered(positions, dirs.__getitem__, keys.__getitem__, order))
+        self._emit('sort', listing, generation, len(positions), ordered, stats)
+
+    def _apply_sort(self, listing: _Listing, count: int, ordered: array, stats: list):
+        for position, size, mtime in stats:
+            listing.sizes[position], listing.mtimes[position] = size, mtime
+        if count != len(listing.order):
+            # Rows were added or removed meanwhile
+            self._request_sort(listing)
+            return
+
+        parent = self._parent_index(listing)
+        parents = [QPersistentModelIndex(parent)] if parent.isValid() else []
+        self.layoutAboutToBeChanged.emit(parents)
+        rows = {position: row for row, position in enumerate(ordered[:listing.shown])}
+        old, new = [], []
+        for index in self.persistentIndexList():
+            if index.isValid() and index.internalPointer() is listing:
+                row = rows.get(listing.order[index.row()])
+                old.append(index)
+                new.append(QModelIndex() if row is None else self.createIndex(row, index.column(), listing))
+        listing.order = ordered
+        listing.reordered()
+        self.changePersistentIndexList(old, new)
+        self.layoutChanged.emit(parents)
+
+    # ======================================================================
+    def _folder_size(self, listing: _Listing, position: int, name: str) -> str:
+        """
+        :return: Total size of a folder row, empty while it is measured
+        """
+        if self.folder_sizes is None:
+            return ''
+        path = os.path.join(listing.path, name)
+        # The rows shown last are kept, a row dropped here registers again when it is shown
+        self._folders[path] = listing, position
+        self._folders.move_to_end(path)
+        if len(self._folders) > FOLDER_ROWS:
+            self._folders.popitem(last=False)
+        total = self.folder_sizes.size(path)
+        return '' if total is None else QLocale().formattedDataSize(total)
+
+    def _folder_measured(self, path: str, total: int):
+        listing, position = self._folders.get(path, (None, 0))
+        row = listing.row(position) if listing is not None and listing.alive else -1
+        if row >= 0:
+            index = self.createIndex(row, 1, listing)
+            self.dataChanged.emit(index, index)
+
+    def _folder_changed(self, path: str):
+        """
+        This function drops the measured size of a changed folder and of its ancestors, and
+        updates their rows, which measures them again.
+        """
+        if self.folder_sizes is None:
+            return
+        self.folder_sizes.invalidate(path)
+        while True:
+            self._folder_measured(path, None)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+            path = parent
+
+    # ======================================================================
+    def _directory_changed(self, path: str):
+        self._changed.add(path)
+        self._refresh_timer.start()
+
+    def _refresh_changed(self):
+        changed, self._changed = self._changed, set()
+        for path in changed:
+            self._folder_changed(path)
+            listing = self._watched.get(path)
+            if listing is not None and listing.alive:
+                self._refresh(listing)
+
+    def _refresh(self, listing: _Listing):
+        if not listing.complete:
+            listing.dirty = True
+            return
+        listing.dirty = False
+        self._submit(self._rescan, listing, listing.generation, listing.snapshot())
+
+    def _rescan(self, listing: _Listing, generation: int, snapshot: tuple):
+        """
+        This function lists a changed folder again and compares it with the listing, it runs
+        on a worker thread.
+        """
+        buffer, offsets, _, positions = snapshot
+        found = {}
+        try:
+            with os.scandir(listing.path) as scan:
+                for entry in scan:
+                    if not entry.name.startswith('.'):
+                        try:
+                            found[entry.name] = entry.is_dir()
+                        except OSError:
+                            found[entry.name] = False
+        except OSError:
+            pass
+        removed = []
+        for position in positions:
+            name = buffer[offsets[position]:offsets[position + 1]].decode('utf-8', 'surrogateescape')
+            if found.pop(name, None) is None:
+                removed.append(position)
+        self._emit('refresh', listing, generation, removed, list(found.items()))
+
+    def _apply_refresh(self, listing: _Listing, removed: list, added: list):
+        # A listing shown completely stays so with the new entries
+        shown = len(listing.order) - len(removed) + len(added) \
+            if listing.shown == len(listing.order) else listing.shown
+        gone = set(removed)
+        for position in removed:
+            child = listing.children.pop(position, None)
+            if child is not None:
+                self._retire(child)
+        listing.order = array('I', listing.order[:listing.shown]) + \
+            array('I', (position for position in listing.order[listing.shown:] if position not in gone))
+
+        parent = self._parent_index(listing)
+        for row in sorted((listing.row(position) for position in removed), reverse=True):
+            if row >= 0:
+                self.beginRemoveRows(parent, row, row)
+                del listing.order[row]
+                listing.shown -= 1
+                listing.reordered()
+                self.endRemoveRows()
+        # The view has dropped its indexes into the removed rows, the retired listings can go
+        self._retired.clear()
+
+        # Sizes and dates may have changed too, they are looked up again when shown
+        listing.sizes = array('q', [UNKNOWN]) * len(listing.sizes)
+        listing.requested = bytearray(len(listing.requested))
+        listing.generation += 1
+        if listing.shown:
+            self.dataChanged.emit(self.index(0, 1, parent), self.index(listing.shown - 1, 3, parent))
+        self._apply_rows(listing, added, True if added else (self.sort_column, self.sort_order))
+        self._show(listing, shown)
+
+    def _retire(self, listing: _Listing):
+        """
+        This function forgets a listing whose folder is gone. The object is kept until its
+        rows are removed, indexes of the view may still point to it until then.
+        """
+        for child in self._listings(listing):
+            child.alive = False
+            self._watched.pop(child.path, None)
+            if child.path in self.watcher.directories():
+                self.watcher.removePath(child.path)
+            self._retired.append(child)
@@ -0,0 +1,256 @@
+import os
+import errno
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from walker import Walker
+from hash_cache import HashCache
+from transfer_stats import TransferStats
+
+
+DuplicateGroup = namedtuple('DuplicateGroup', ['size', 'digest', 'paths'])
+
+EDGE_SIZE = 64 * 1024
+CHUNK_FILES = 20000
+INSERT_BATCH = 10000
+
+
+class DuplicateEngine:
+    """
+    Finds files with identical contents below one or more folders.
+
+    It runs as a narrowing pipeline, each stage only reading what the previous one left:
+    the walk records every file's size in a temporary SQLite file (so tens of millions of
+    files cost disk, not memory), files of a unique size are dropped, the rest are grouped
+    by a hash of their first and last 64 KB read on a thread pool, and only files still
+    sharing that hash are hashed in full through the HashCache. Paths which are hardlinks of
+    each other count as one file. Memory holds one chunk of candidates plus the duplicates.
+    """
+    def __init__(self, roots: list, min_size: int = 1, workers: int = None, progress=None,
+                 cancelled: threading.Event = None):
+        """
+        :param roots: Folders to search, overlapping folders are fine
+        :param min_size: Smallest file size considered, in bytes
+        :param workers: Number of files read at once by the edge hashing
+        :param progress: Callable receiving the TransferStats as files are checked
+        :param cancelled: Event which stops the search when set
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.min_size = max(min_size, 1)
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.errors: list = []
+
+    def summary(self, groups: list) -> str:
+        return f"{len(groups)} groups, {self.reclaimable(groups) / 1048576:.1f} MB reclaimable " \
+               f"among {self.stats.files} files in {self.stats.elapsed:.1f}s"
+
+    @staticmethod
+    def reclaimable(groups: list) -> int:
+        """
+        :return: Bytes freed if every group was reduced to one copy
+        """
+        return sum(group.size * (len(group.paths) - 1) for group in groups)
+
+    # ======================================================================
+    def find(self) -> list:
+        """
+        :return: List of DuplicateGroup, the groups freeing the most space first
+        """
+        folder = tempfile.mkdtemp(prefix='commander-duplicates-')
+        connection = sqlite3.connect(os.path.join(folder, 'files.sqlite'))
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute("CREATE TABLE files (size INTEGER, dev INTEGER, ino INTEGER, path TEXT)")
+            self._record(connection)
+            connection.execute("CREATE INDEX files_size ON files (size)")
+
+            groups = []
+            chunk = []
+            rows = connection.execute(
+                "SELECT size, dev, ino, path FROM files WHERE size IN "
+                "(SELECT size FROM files GROUP BY size HAVING COUNT(*) > 1) ORDER BY size, dev, ino")
+            for size, dev, ino, path in rows:
+                if self.cancelled.is_set():
+                    break
+                # Only change chunks between sizes, a size group is never split
+                if len(chunk) >= CHUNK_FILES and chunk[-1][0] != size:
+                    groups.extend(self._narrow(chunk))
+                    chunk = []
+                chunk.append((size, dev, ino, path))
+            if chunk and not self.cancelled.is_set():
+                groups.extend(self._narrow(chunk))
+        finally:
+            connection.close()
+            for name in os.listdir(folder):
+                os.unlink(os.path.join(folder, name))
+            os.rmdir(folder)
+
+        self.stats.finish()
+        groups.sort(key=lambda group: group.size * (len(group.paths) - 1), reverse=True)
+        return groups
+
+    def _record(self, connection: sqlite3.Connection):
+        batch = []
+        for root in self.roots:
+            for listing in Walker(stat=True, cancelled=self.cancelled, onerror=self.errors.append).walk(root):
+                for entry in listing.files:
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        status = entry.stat(follow_symlinks=False)
+                    except OSError as error:
+                        self.errors.append(error)
+                        continue
+                    if status.st_size >= self.min_size:
+                        batch.append((status.st_size, status.st_dev, status.st_ino, entry.path))
+                self._advance(len(listing.files), 0)
+                if len(batch) >= INSERT_BATCH:
+                    connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", batch)
+                    batch = []
+        connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", batch)
+        connection.commit()
+
+    def _narrow(self, chunk: list) -> list:
+        """
+        This function turns a chunk of same sized candidates into groups of duplicates.
+
+        :param chunk: List of (size, dev, ino, path) sorted by size
+        :return: List of DuplicateGroup
+        """
+        # One path per inode, hardlinks are the same file already
+        files = {}
+        for size, dev, ino, path in chunk:
+            files.setdefault((dev, ino), (size, path))
+        by_size = defaultdict(list)
+        for size, path in files.values():
+            by_size[size].append(path)
+        candidates = [(size, path) for size, paths in by_size.items() if len(paths) > 1 for path in paths]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            edges = list(pool.map(self._edge_hash, candidates))
+
+        by_edge = defaultdict(list)
+        for (size, path), edge in zip(candidates, edges):
+            if edge:
+                by_edge[(size, edge)].append(path)
+
+        groups = []
+        full = []
+        for (size, edge), paths in by_edge.items():
+            if len(paths) < 2:
+                continue
+            if size <= 2 * EDGE_SIZE:
+                # The edges covered the whole file
+                groups.append(DuplicateGroup(size, edge, sorted(paths)))
+            else:
+                full.extend((size, path) for path in paths)
+
+        if full and not self.cancelled.is_set():
+            with HashCache(progress=self.progress, cancelled=self.cancelled) as cache:
+                digests = cache.hashes([path for _, path in full])
+                self.errors.extend(cache.errors)
+            by_digest = defaultdict(list)
+            for size, path in full:
+                if path in digests:
+                    by_digest[(size, digests[path])].append(path)
+            groups.extend(DuplicateGroup(size, digest, sorted(paths))
+                          for (size, digest), paths in by_digest.items() if len(paths) > 1)
+        return groups
+
+    def _edge_hash(self, candidate: tuple):
+        """
+        :return: Digest of the size and the first and last EDGE_SIZE bytes, None if unreadable
+        """
+        size, path = candidate
+        if self.cancelled.is_set():
+            return None
+        try:
+            digest = self._edge_digest(path, size)
+        except OSError as error:
+            self.errors.append(error)
+            return None
+        self._advance(0, min(size, 2 * EDGE_SIZE))
+        return digest
+
+    @staticmethod
+    def _edge_digest(path: str, size: int) -> str:
+        digest = hashlib.blake2b(str(size).encode())
+        with open(path, 'rb') as file:
+            digest.update(file.read(EDGE_SIZE if size > 2 * EDGE_SIZE else size))
+            if size > 2 * EDGE_SIZE:
+                file.seek(-EDGE_SIZE, os.SEEK_END)
+                digest.update(file.read(EDGE_SIZE))
+        return digest.hexdigest()
+
+    def _advance(self, files: int, size: int):
+        self.stats.add(files, size)
+        if self.progress:
+            self.progress(self.stats)
+
+    # ======================================================================
+    def link(self, groups: list) -> tuple:
+        """
+        This function replaces every copy in the groups by a hardlink to the group's first
+        file. The original and each copy are hashed again just before and checked against the
+        group's digest (through the hash cache for large files, a stat if they are unchanged),
+        then the copy is replaced atomically by renaming the new link over it.
+
+        :param groups: List of DuplicateGroup
+        :return: (number of files replaced, bytes freed), copies with other hardlinks free nothing
+        """
+        linked, freed = 0, 0
+        with HashCache(cancelled=self.cancelled) as cache:
+            for group in groups:
+                original = group.paths[0]
+                for path in group.paths[1:]:
+                    if self.cancelled.is_set():
+                        return linked, freed
+                    try:
+                        replaced = self._link(cache, group, original, path)
+                    except OSError as error:
+                        self.errors.append(error)
+                        continue
+                    if replaced is not None:
+                        linked += 1
+                        freed += replaced
+        return linked, freed
+
+    @staticmethod
+    def _link(cache: HashCache, group: DuplicateGroup, original: str, path: str):
+        """
+        :return: Bytes freed by replacing the copy, None if it was a hardlink of the original already
+        """
+        status, other = os.stat(original), os.lstat(path)
+        if (status.st_dev, status.st_ino) == (other.st_dev, other.st_ino):
+            return None
+        if status.st_dev != other.st_dev:
+            raise OSError(errno.EXDEV, "Copy is on another file system, it cannot be hardlinked", path)
+        if status.st_size != group.size or other.st_size != group.size:
+            raise OSError(errno.EIO, "File changed since the search, not replaced", path)
+        if group.size > 2 * EDGE_SIZE:
+            same = cache.file_hash(original) == cache.file_hash(path) == group.digest
+        else:
+            # The digest of small files is their edge hash, which covers all of them
+            same = DuplicateEngine._edge_digest(original, group.size) == \
+                DuplicateEngine._edge_digest(path, group.size) == group.digest
+        if not same:
+            raise OSError(errno.EIO, "File changed since the search, not replaced", path)
+
+        folder, name = os.path.split(path)
+        temporary = os.path.join(folder, f".{name}.commander-link")
+        os.link(original, temporary)
+        try:
+            os.replace(temporary, path)
+        except OSError:
+            os.unlink(temporary)
+            raise
+        # The copy's data stays on disk while other hardlinks to it remain
+        return group.size if other.st_nlink == 1 else 0
@@ -0,0 +1,328 @@
+import os
+import time
+import zlib
+import errno
+import tarfile
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from archive_engine import BUFFER_SIZE, CHUNK_SIZE, BATCH_FILES, PARALLEL_THRESHOLD
+from archive_index import ARCHIVE_SUFFIXES
+from transfer_stats import TransferStats
+
+
+TAR_WRITERS = 8
+TAR_PENDING = 64
+
+
+class ExtractEngine:
+    """
+    Extracts zip and tar (.gz, .bz2, .xz) archives.
+
+    Zip members are independent of each other: the directory skeleton is created first and
+    the members are then split in batches which worker processes decompress in parallel,
+    each from its own handle on the archive. A tar is one stream, it is read once front to
+    back with large buffers.
+
+    Member paths are checked before anything is written: absolute paths and paths leaving
+    the destination through '..' are refused, and so are tar links pointing outside of it.
+    As links extracted earlier can lead a checked name elsewhere, the real folder of every
+    tar member is checked too. Devices and fifos are skipped.
+    """
+    def __init__(self, workers: int = None, progress=None, cancelled: threading.Event = None):
+        """
+        :param workers: Number of extracting processes for zips, the CPU count by default
+        :param progress: Callable receiving the TransferStats as data is extracted
+        :param cancelled: Event which stops the extraction when set
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+        self.stats = TransferStats()
+        self.errors: list = []
+
+    @staticmethod
+    def default_destination(archive: str) -> str:
+        """
+        :return: Folder next to the archive, named after it without its extension
+        """
+        folder, name = os.path.split(os.path.abspath(archive))
+        for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+            if name.lower().endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        return os.path.join(folder, name or 'Extracted')
+
+    def extract(self, archive: str, destination: str) -> TransferStats:
+        """
+        This function extracts everything in the archive below the destination folder.
+
+        :param archive: Path of the zip or tar archive
+        :param destination: Folder to extract into, created if needed
+        :return: TransferStats of the extracted data
+        """
+        destination = os.path.abspath(destination)
+        os.makedirs(destination, exist_ok=True)
+        try:
+            if zipfile.is_zipfile(archive):
+                self._extract_zip(archive, destination)
+            else:
+                self._extract_tar(archive, destination)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as error:
+            raise OSError(errno.EIO, f"Damaged archive: {error}", archive)
+
+        self.stats.finish()
+        if self.errors and not self.cancelled.is_set():
+            raise self.errors[0]
+        return self.stats
+
+    @staticmethod
+    def target(destination: str, name: str) -> str:
+        """
+        This function maps a member name to its path below the destination.
+
+        :raises OSError: EPERM for names which would end up outside of the destination
+        """
+        parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+        if name.startswith(('/', '\\')) or '..' in parts or (parts and ':' in parts[0]):
+            raise OSError(errno.EPERM, "Unsafe path in archive", name)
+        return os.path.join(destination, *parts)
+
+    # ======================================================================
+    def _extract_zip(self, archive: str, destination: str):
+        folders = set()
+        members = []
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                try:
+                    path = self.target(destination, info.filename)
+                except OSError as error:
+                    self.errors.append(error)
+                    continue
+                if info.is_dir():
+                    folders.add(path)
+                    continue
+                folders.add(os.path.dirname(path))
+                mode = (info.external_attr >> 16) & 0o777 if info.create_system == 3 else 0
+                members.append((info.filename, path, info.file_size, mode,
+                                time.mktime(info.date_time + (0, 0, -1))))
+                self.stats.expect(1, info.file_size)
+
+        for folder in sorted(folders):
+            os.makedirs(folder, exist_ok=True)
+
+        batches = self._batches(members)
+        if self.workers > 1 and len(batches) > 1 and self.stats.total_bytes >= PARALLEL_THRESHOLD:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(self.workers, mp_context=context, initializer=open_archive,
+                                     initargs=(archive,)) as pool:
+                futures = [pool.submit(extract_members, batch) for batch in batches]
+                for future in as_completed(futures):
+                    if self.cancelled.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    self._collect(future.result())
+        else:
+            with zipfile.ZipFile(archive) as zip_file:
+                for batch in batches:
+                    if self.cancelled.is_set():
+                        break
+                    self._collect(extract_members(batch, zip_file))
+
+    @staticmethod
+    def _batches(members: list) -> list:
+        """
+        :return: Members split in batches of at most BATCH_FILES files or about CHUNK_SIZE bytes
+        """
+        batches, batch, size = [], [], 0
+        for member in members:
+            batch.append(member)
+            size += member[2]
+            if len(batch) >= BATCH_FILES or size >= CHUNK_SIZE:
+                batches.append(batch)
+                batch, size = [], 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _collect(self, result: tuple):
+        files, size, errors = result
+        self.errors.extend(OSError(error_number, message, name) for error_number, message, name in errors)
+        self._advance(files, size)
+
+    # ======================================================================
+    def _extract_tar(self, archive: str, destination: str):
+        folders = []
+        made = {destination}
+        pending = {}
+        real_destination = os.path.realpath(destination)
+        with open(archive, 'rb', buffering=BUFFER_SIZE) as file, \
+                tarfile.open(fileobj=file, mode='r|*') as tar_file, \
+                ThreadPoolExecutor(TAR_WRITERS) as writers:
+            for info in tar_file:
+                if self.cancelled.is_set():
+                    break
+                try:
+                    path = self.target(destination, info.name)
+                    if path == destination:
+                        continue
+                    self._check_real(real_destination, os.path.dirname(path), info.name)
+                    if info.isdir():
+                        self._make_folder(path, made)
+                        folders.append((path, info))
+                        continue
+                    self._make_folder(os.path.dirname(path), made)
+                    if path in pending or info.islnk():
+                        self._wait(pending)
+
+                    if info.isreg() and info.size <= BUFFER_SIZE:
+                        # Small files are written by threads while the stream is decompressed further
+                        if len(pending) >= TAR_PENDING:
+                            self._wait(pending)
+                        pending[path] = writers.submit(self._write_small, tar_file.extractfile(info).read(),
+                                                       path, info)
+                        continue
+                    if info.isreg():
+                        self._write_tar_member(tar_file.extractfile(info), path)
+                    elif info.issym() or info.islnk():
+                        self._link(destination, real_destination, path, info)
+                    else:
+                        continue
+                    self._apply(path, info)
+                    self._advance(1, 0)
+                except OSError as error:
+                    self.errors.append(error)
+            self._wait(pending)
+
+        # Folder times last, writing their contents changed them
+        for path, info in reversed(folders):
+            try:
+                self._apply(path, info)
+            except OSError as error:
+                self.errors.append(error)
+
+    @staticmethod
+    def _make_folder(path: str, made: set):
+        """
+        This function creates a folder once, remembering it saves a stat per member.
+        """
+        if path not in made:
+            os.makedirs(path, exist_ok=True)
+            made.add(path)
+
+    def _wait(self, pending: dict):
+        for future in pending.values():
+            try:
+                future.result()
+            except OSError as error:
+                self.errors.append(error)
+        pending.clear()
+
+    def _write_small(self, data: bytes, path: str, info: tarfile.TarInfo):
+        if os.path.islink(path):
+            os.unlink(path)
+        with open(path, 'wb') as file_out:
+            file_out.write(data)
+        self._apply(path, info)
+        self._advance(1, len(data))
+
+    def _write_tar_member(self, file_in, path: str):
+        if os.path.islink(path):
+            os.unlink(path)
+        with file_in, open(path, 'wb') as file_out:
+            while True:
+                block = file_in.read(BUFFER_SIZE)
+                if not block:
+                    return
+                file_out.write(block)
+                self._advance(0, len(block))
+                if self.cancelled.is_set():
+                    file_out.close()
+                    os.unlink(path)
+                    raise OSError(errno.ECANCELED, "Extraction cancelled", path)
+
+    @staticmethod
+    def _check_real(real_destination: str, path: str, name: str):
+        """
+        This function checks that a path, with the links in it resolved, is below the destination.
+
+        :raises OSError: EPERM if it leads outside of the destination
+        """
+        if os.path.commonpath([real_destination, os.path.realpath(path)]) != real_destination:
+            raise OSError(errno.EPERM, "Link in archive leads outside of the destination", name)
+
+    def _link(self, destination: str, real_destination: str, path: str, info: tarfile.TarInfo):
+        if info.issym():
+            if os.path.isabs(info.linkname):
+                raise OSError(errno.EPERM, "Link in archive points outside of the destination", info.name)
+            # Relative to the real folder of the link, the checked one may itself be reached through links
+            pointed = os.path.normpath(os.path.join(os.path.realpath(os.path.dirname(path)), info.linkname))
+            self._check_real(real_destination, pointed, info.name)
+        else:
+            pointed = self.target(destination, info.linkname)
+            self._check_real(real_destination, pointed, info.name)
+
+        if os.path.lexists(path):
+            os.unlink(path)
+        if info.issym():
+            os.symlink(info.linkname, path)
+        else:
+            os.link(pointed, path)
+
+    @staticmethod
+    def _apply(path: str, info: tarfile.TarInfo):
+        if info.issym():
+            return
+        os.chmod(path, info.mode & 0o777)
+        os.utime(path, (info.mtime, info.mtime))
+
+    def _advance(self, files: int, size: int):
+        self.stats.add(files, size)
+        if self.progress:
+            self.progress(self.stats)
+
+
+_worker_archive = None
+
+
+def open_archive(archive: str):
+    """
+    This function opens the zip once per worker process, reading its central directory
+    again for every batch would cost more than the extraction of small members.
+    """
+    global _worker_archive
+    _worker_archive = zipfile.ZipFile(archive)
+
+
+def extract_members(members: list, zip_file: zipfile.ZipFile = None) -> tuple:
+    """
+    This function writes a batch of zip members to their paths, it runs in the worker processes.
+
+    :param members: List of (member name, path, size, mode, mtime)
+    :param zip_file: Open zip, the one of the worker process by default
+    :return: (files written, bytes written, list of (errno, message, name) of failures)
+    """
+    zip_file = zip_file or _worker_archive
+    files, size, errors = 0, 0, []
+    for name, path, _, mode, mtime in members:
+        try:
+            if os.path.islink(path):
+                os.unlink(path)
+            with zip_file.open(name) as file_in, open(path, 'wb') as file_out:
+                while True:
+                    block = file_in.read(BUFFER_SIZE)
+                    if not block:
+                        break
+                    file_out.write(block)
+                    size += len(block)
+            if mode:
+                os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+            files += 1
+        except OSError as error:
+            errors.append((error.errno, error.strerror, name))
+        except (zipfile.BadZipFile, zlib.error) as error:
+            errors.append((errno.EIO, f"Damaged member: {error}", name))
+    return files, size, errors
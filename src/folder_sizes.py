@@ -0,0 +1,188 @@
+import os
+import time
+import queue
+import threading
+from collections import namedtuple
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+Folder = namedtuple('Folder', ['key', 'files', 'subdirs', 'total', 'listed'])
+
+WORKERS = 2
+VERIFY_AGE = 30
+RESCAN_AGE = 300
+MAX_FOLDERS = 1000000
+RETRIES = 3
+
+
+class FolderSizes(QObject):
+    """
+    Recursive folder sizes, measured on demand by background threads.
+
+    Every folder measured is cached with the device, inode and mtime of the folder, the
+    size of the files right in it, its subfolders and its total. A folder's mtime changes
+    whenever an entry is added, removed or renamed in it, so checking a cached tree costs
+    one stat per folder: only the folders whose key changed are listed again and the totals
+    above them added up again. Cached totals are returned at once, and checked in the
+    background when older than VERIFY_AGE seconds. A change seen by a folder watch drops
+    the folder (its files may have grown) and the totals of all its ancestors.
+
+    A file growing or shrinking in place does not change the mtime of its folder, so the key
+    check alone only follows entries being added, removed or renamed. Folders listed more
+    than RESCAN_AGE seconds ago are therefore listed again when checked, which picks up such
+    changes in unwatched folders with that delay.
+
+    Sizes are the apparent sizes of the files, symlinks are not followed and other file
+    systems mounted below a folder are not counted, like du -x. Requests are served last
+    in first out, so the rows just scrolled to are measured first.
+    """
+    measured = pyqtSignal(str, object)
+
+    def __init__(self, workers: int = WORKERS, parent=None):
+        """
+        :param workers: Number of measuring threads
+        :param parent: QObject owning the cache
+        """
+        super(FolderSizes, self).__init__(parent)
+        self.folders = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = set()
+        self._requests = queue.LifoQueue()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def size(self, path: str):
+        """
+        This function returns the total size of a folder if it is known and otherwise queues
+        its measurement, the measured signal then gives it.
+
+        :param path: Folder
+        :return: Total size in bytes, None while it is measured
+        """
+        with self._lock:
+            folder = self.folders.get(path)
+            stale = time.monotonic() - self._checked.get(path, 0) > VERIFY_AGE
+            if (folder is None or folder.total is None or stale) and path not in self._pending:
+                self._pending.add(path)
+                self._requests.put(path)
+        return None if folder is None else folder.total
+
+    def cached(self, path: str):
+        """
+        :return: Total size of a folder if it is known, without measuring it
+        """
+        folder = self.folders.get(path)
+        return None if folder is None else folder.total
+
+    def invalidate(self, path: str):
+        """
+        This function forgets what changed in a folder: its own entry and the totals of all
+        folders above it. The totals of its subfolders stay valid.
+
+        :param path: Folder which changed
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            self._generation += 1
+            self.folders.pop(path, None)
+            self._checked.pop(path, None)
+            while True:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return
+                path = parent
+                folder = self.folders.get(path)
+                if folder is not None:
+                    self.folders[path] = folder._replace(total=None)
+
+    # ======================================================================
+    def _work(self):
+        while True:
+            path = self._requests.get()
+            for _ in range(RETRIES):
+                total, stored = self._measure(path, self._generation)
+                if stored:
+                    break
+            with self._lock:
+                self._pending.discard(path)
+            try:
+                self.measured.emit(path, total)
+            except RuntimeError:
+                # The cache was deleted
+                return
+
+    def _measure(self, root: str, generation: int):
+        """
+        This function adds up the size of a folder tree, checking the cached folders of it
+        against their key and listing the others. Subtrees checked recently are not descended.
+
+        :return: (total size in bytes, False if a folder was invalidated meanwhile and nothing was cached)
+        """
+        try:
+            device = os.stat(root).st_dev
+        except OSError:
+            return 0, True
+        now = time.monotonic()
+        measured = {}
+        visited = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            folder = self._folder(path, path == root)
+            if folder is None or folder.key[0] != device:
+                # Unreadable, or another file system mounted here
+                measured[path] = 0
+                continue
+            if path != root and folder.total is not None and now - self._checked.get(path, 0) <= VERIFY_AGE:
+                measured[path] = folder.total
+                continue
+            visited.append((path, folder))
+            stack.extend(os.path.join(path, name) for name in folder.subdirs)
+
+        # Subfolders come after their parent, add up from the bottom
+        for path, folder in reversed(visited):
+            measured[path] = folder.files + sum(measured[os.path.join(path, name)] for name in folder.subdirs)
+
+        with self._lock:
+            if generation != self._generation:
+                return measured[root], False
+            if len(self.folders) > MAX_FOLDERS:
+                self.folders.clear()
+                self._checked.clear()
+            for path, folder in visited:
+                self.folders[path] = folder._replace(total=measured[path])
+                self._checked[path] = now
+        return measured[root], True
+
+    def _folder(self, path: str, follow_symlinks: bool):
+        """
+        :return: The cached Folder if its key still matches and it was listed recently, otherwise
+            the folder listed again, None if it cannot be read
+        """
+        try:
+            status = os.stat(path) if follow_symlinks else os.lstat(path)
+        except OSError:
+            return None
+        key = (status.st_dev, status.st_ino, status.st_mtime_ns)
+        now = time.monotonic()
+        folder = self.folders.get(path)
+        if folder is not None and folder.key == key and now - folder.listed <= RESCAN_AGE:
+            return folder
+
+        files = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as scan:
+                for entry in scan:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        else:
+                            files += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+        return Folder(key, files, tuple(subdirs), None, now)
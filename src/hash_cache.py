@@ -0,0 +1,228 @@
+import os
+import time
+import errno
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from transfer_stats import TransferStats
+
+
+CACHE_FILE = os.path.join(str(Path.home()), '.commander', 'hashes.sqlite')
+MAX_ENTRIES = 1000000
+HASH_BLOCK = 4 * 1024 * 1024
+BATCH_FILES = 256
+BATCH_BYTES = 64 * 1024 * 1024
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+TOUCH_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT,
+                                   used INTEGER, PRIMARY KEY (dev, ino)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used);
+"""
+
+
+class HashCache:
+    """
+    Persistent cache of file content digests (blake2b).
+
+    A digest is stored with the device, inode, size and mtime_ns of the file it was taken
+    from and is only returned while all four still match, so checking a cached file again
+    costs a stat and an index lookup instead of reading it. Files missing from the cache are
+    read in large blocks, by a pool of processes when there is enough data, and a digest is
+    only stored if the file did not change while it was read. The least recently used
+    entries are dropped once the cache holds more than max_entries.
+    """
+    def __init__(self, path: str = CACHE_FILE, max_entries: int = MAX_ENTRIES, workers: int = None,
+                 progress=None, cancelled: threading.Event = None):
+        """
+        :param path: SQLite file of the cache
+        :param max_entries: Number of digests kept
+        :param workers: Number of hashing processes, the CPU count by default
+        :param progress: Callable receiving the TransferStats as files are hashed
+        :param cancelled: Event which stops hashing when set
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.workers = workers or os.cpu_count() or 1
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.hits = 0
+        self.misses = 0
+        self.errors: list = []
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("CREATE TEMP TABLE wanted (position INTEGER PRIMARY KEY, dev INTEGER, ino INTEGER, "
+                                "size INTEGER, mtime_ns INTEGER)")
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ======================================================================
+    def file_hash(self, path: str) -> str:
+        """
+        :return: Digest of the file's content
+        :raises OSError: If the file cannot be read
+        """
+        errors = len(self.errors)
+        digests = self.hashes([path])
+        if path not in digests:
+            raise self.errors[-1] if len(self.errors) > errors else \
+                OSError(errno.ECANCELED, "Hashing cancelled", path)
+        return digests[path]
+
+    def hashes(self, paths: list, statuses: list = None) -> dict:
+        """
+        This function returns the digests of many files, taking whatever it can from the
+        cache and hashing the rest.
+
+        :param paths: Files to hash
+        :param statuses: Their stat results if already known (from a scandir), saves a stat per file
+        :return: Dictionary of path to digest, files which could not be read are left out
+            (their errors are in self.errors)
+        """
+        digests = {}
+        missing = []
+        touched = []
+        now = int(time.time())
+
+        wanted = []
+        for path, status in zip(paths, statuses or [None] * len(paths)):
+            try:
+                status = status or os.stat(path)
+            except OSError as error:
+                self.errors.append(error)
+                continue
+            wanted.append((path, (status.st_dev, status.st_ino, status.st_size, status.st_mtime_ns)))
+
+        with self._lock:
+            # One join against the wanted keys instead of a query per file
+            self.connection.execute("DELETE FROM wanted")
+            self.connection.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?, ?)",
+                                        ((position,) + key for position, (_, key) in enumerate(wanted)))
+            found = {position: (digest, used) for position, digest, used in self.connection.execute(
+                "SELECT wanted.position, hashes.digest, hashes.used FROM wanted JOIN hashes "
+                "ON hashes.dev = wanted.dev AND hashes.ino = wanted.ino "
+                "WHERE hashes.size = wanted.size AND hashes.mtime_ns = wanted.mtime_ns")}
+            self.connection.execute("DELETE FROM wanted")
+
+            for position, (path, key) in enumerate(wanted):
+                if position in found:
+                    digest, used = found[position]
+                    digests[path] = digest
+                    if used < now - TOUCH_INTERVAL:
+                        touched.append((now, key[0], key[1]))
+                else:
+                    missing.append((path, key))
+            if touched:
+                self.connection.executemany("UPDATE hashes SET used = ? WHERE dev = ? AND ino = ?", touched)
+            self.connection.commit()
+
+        self.hits += len(digests)
+        self.misses += len(missing)
+        if missing:
+            digests.update(self._compute(missing, now))
+        self.stats.finish()
+        return digests
+
+    def _compute(self, missing: list, now: int) -> dict:
+        self.stats.expect(len(missing), sum(key[2] for _, key in missing))
+        batches, batch, size = [], [], 0
+        for path, key in missing:
+            batch.append((path, key))
+            size += key[2]
+            if len(batch) >= BATCH_FILES or size >= BATCH_BYTES:
+                batches.append(batch)
+                batch, size = [], 0
+        if batch:
+            batches.append(batch)
+
+        digests = {}
+        if self.workers > 1 and len(batches) > 1 and self.stats.total_bytes >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {pool.submit(hash_batch, [path for path, _ in batch]): batch for batch in batches}
+                for future in as_completed(futures):
+                    if self.cancelled.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    digests.update(self._collect(futures[future], future.result(), now))
+        else:
+            for batch in batches:
+                if self.cancelled.is_set():
+                    break
+                digests.update(self._collect(batch, hash_batch([path for path, _ in batch]), now))
+        self._trim()
+        return digests
+
+    def _collect(self, batch: list, results: list, now: int) -> dict:
+        digests = {}
+        rows = []
+        for (path, key), (digest, error) in zip(batch, results):
+            if digest is None:
+                self.errors.append(OSError(error[0], error[1], path))
+                continue
+            digests[path] = digest
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            # Only remember digests of files which did not change while they were read
+            if (status.st_dev, status.st_ino, status.st_size, status.st_mtime_ns) == key:
+                rows.append(key + (digest, now))
+
+        with self._lock:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+        self.stats.add(len(digests), sum(key[2] for _, key in batch))
+        if self.progress:
+            self.progress(self.stats)
+        return digests
+
+    def _trim(self):
+        with self._lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute("DELETE FROM hashes WHERE (dev, ino) IN (SELECT dev, ino FROM hashes "
+                                        "ORDER BY used LIMIT ?)", (count - self.max_entries,))
+                self.connection.commit()
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_batch(paths: list) -> list:
+    """
+    This function hashes a batch of files, it runs in the worker processes.
+
+    :return: List of (digest, None) or (None, (errno, message)) per file
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append((file_digest(path), None))
+        except OSError as error:
+            results.append((None, (error.errno, error.strerror)))
+    return results
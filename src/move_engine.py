@@ -0,0 +1,153 @@
+import os
+import stat
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from walker import Walker
+from copy_engine import CopyEngine
+from hash_cache import HashCache
+from support_functions import Supporting
+from transfer_stats import TransferStats
+
+
+class MoveEngine:
+    """
+    Moves files and directory trees, also between file systems.
+
+    A move within one file system (same st_dev) stays an instant os.rename. Across file
+    systems, where rename fails with EXDEV, the sources are stream copied in parallel by the
+    CopyEngine, the copies are verified against their sources by size (and optionally by
+    content hash, through the HashCache) and only the sources which the CopyEngine copied
+    completely and which verified are deleted.
+    """
+    def __init__(self, verify_hash: bool = False, workers: int = None, progress=None,
+                 cancelled: threading.Event = None):
+        """
+        :param verify_hash: Also compare contents before a source is deleted
+        :param workers: Number of concurrent file copies
+        :param progress: Callable receiving the TransferStats whenever progress is made
+        :param cancelled: Event which stops the move when set, sources are only deleted once verified
+        """
+        self.verify_hash = verify_hash
+        self.copier = CopyEngine(workers, progress, cancelled)
+        self.cancelled = self.copier.cancelled
+        self.stats: TransferStats = self.copier.stats
+
+    @staticmethod
+    def same_device(source: str, destination: str) -> bool:
+        return os.lstat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+
+    def move(self, source: str, destination: str) -> TransferStats:
+        """
+        This function moves a file or directory to the given destination path.
+
+        :param source: File or directory to move
+        :param destination: Path the item should have
+        :return: TransferStats of the move
+        """
+        return self.move_all([(source, destination)])
+
+    def move_all(self, pairs: list) -> TransferStats:
+        """
+        This function moves several files and directories as one operation.
+
+        :param pairs: List of (source, destination path)
+        :return: TransferStats of all the moves
+        """
+        crossing = []
+        renames = []
+        for source, destination in pairs:
+            try:
+                (renames if self.same_device(source, destination) else crossing).append((source, destination))
+            except OSError:
+                renames.append((source, destination))
+
+        def rename(pair: tuple):
+            try:
+                os.rename(*pair)
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise
+                crossing.append(pair)
+
+        moved, errors = Supporting.run_batch(renames, rename, cancelled=self.cancelled)
+        self.stats.add(moved.files - len(errors))
+
+        if crossing:
+            try:
+                self.copier.copy_all(crossing)
+            except OSError as error:
+                errors.append(error)
+
+            for source, destination in crossing:
+                if self.cancelled.is_set():
+                    break
+                if source not in self.copier.completed:
+                    # Not copied in this run, an older file of the same size may be in its place
+                    continue
+                try:
+                    self.verify(source, destination)
+                    self._delete(source)
+                except OSError as error:
+                    errors.append(error)
+
+        self.stats.finish()
+        if errors:
+            raise errors[0]
+        return self.stats
+
+    def verify(self, source: str, destination: str):
+        """
+        This function checks that the destination holds a complete copy of the source.
+
+        :raises OSError: EIO naming the first item which did not verify
+        """
+        if os.path.isdir(source) and not os.path.islink(source):
+            with ThreadPoolExecutor(self.copier.workers) as pool:
+                checks = [pool.submit(self._verify_entry, entry.path,
+                                      os.path.join(destination, os.path.relpath(entry.path, source)))
+                          for listing in Walker(cancelled=self.cancelled).walk(source)
+                          for entry in listing.dirs + listing.files]
+                files = [check.result() for check in checks]
+            if self.cancelled.is_set():
+                raise OSError(errno.ECANCELED, "Move cancelled before verification", source)
+        else:
+            files = [self._verify_entry(source, destination)]
+
+        files = [pair for pair in files if pair]
+        if self.verify_hash and files:
+            with HashCache(cancelled=self.cancelled) as cache:
+                sources = cache.hashes([source for source, _ in files])
+                copies = cache.hashes([destination for _, destination in files])
+            for source, destination in files:
+                if sources.get(source) is None or sources.get(source) != copies.get(destination):
+                    raise OSError(errno.EIO, "Verification failed, content differs", destination)
+
+    def _verify_entry(self, source: str, destination: str):
+        """
+        :return: (source, destination) if both are regular files, whose contents can be compared
+        """
+        status = os.lstat(source)
+        try:
+            other = os.lstat(destination)
+        except FileNotFoundError:
+            raise OSError(errno.EIO, "Verification failed, copy missing", destination)
+
+        if os.path.islink(source):
+            if not os.path.islink(destination) or os.readlink(source) != os.readlink(destination):
+                raise OSError(errno.EIO, "Verification failed, link differs", destination)
+        elif os.path.isdir(source):
+            if not os.path.isdir(destination):
+                raise OSError(errno.EIO, "Verification failed, folder missing", destination)
+        elif status.st_size != other.st_size:
+            raise OSError(errno.EIO, "Verification failed, size differs", destination)
+        elif stat.S_ISREG(status.st_mode):
+            return source, destination
+        return None
+
+    @staticmethod
+    def _delete(source: str):
+        if os.path.isdir(source) and not os.path.islink(source):
+            Supporting.remove_tree(source)
+        else:
+            os.unlink(source)
@@ -0,0 +1,68 @@
+import os
+from collections import OrderedDict
+from PyQt5.QtCore import QModelIndex
+from archive_index import ArchiveIndex
+from archive_model import ArchiveModel
+from directory_model import DirectoryModel
+
+
+PANE_MODELS = 8
+PATH_EDIT_DELAY = 300
+
+
+class PaneModelCache:
+    """
+    Least recently used cache of the models shown in the explorer panes, one per folder.
+
+    Each DirectoryModel is rooted at its own folder, so its workers only list and watch that
+    folder (and the subfolders expanded in it), and it keeps its listing: going back to a
+    folder shown recently reuses its model as it is instead of listing the folder again.
+    Both panes share the cache. Past the capacity the least recently used models are deleted, skipping those
+    still shown in a pane, so the number of models (and of their threads) stays bounded.
+    """
+    def __init__(self, capacity: int = PANE_MODELS, parent=None, in_use=None, folder_sizes=None):
+        """
+        :param capacity: Number of models kept
+        :param parent: QObject owning the models
+        :param in_use: Callable telling if a model is shown in a pane, those are never deleted
+        :param folder_sizes: FolderSizes measuring the folders of all models
+        """
+        self.capacity = capacity
+        self.parent = parent
+        self.in_use = in_use or (lambda model: False)
+        self.folder_sizes = folder_sizes
+        self.models = OrderedDict()
+
+    def model(self, path: str) -> tuple:
+        """
+        This function returns the model for a folder, creating it if it is not cached. Paths
+        inside a zip or tar archive (/data/backup.zip/docs) are browsed through an ArchiveModel.
+
+        :param path: Folder to show
+        :return: The model and the index of the folder in it
+        """
+        key = os.path.normpath(os.path.abspath(path))
+        model = self.models.pop(key, None)
+        if model is None:
+            model = self._create(key)
+        self.models[key] = model
+        self._evict()
+
+        return model, QModelIndex()
+
+    def _create(self, path: str):
+        inside = ArchiveIndex.split(path)
+        if inside:
+            return ArchiveModel(*inside, parent=self.parent)
+
+        return DirectoryModel(path, self.parent, self.folder_sizes)
+
+    def _evict(self):
+        for key in list(self.models):
+            if len(self.models) <= self.capacity:
+                return
+            if not self.in_use(self.models[key]):
+                model = self.models.pop(key)
+                if isinstance(model, DirectoryModel):
+                    model.close()
+                model.deleteLater()
@@ -0,0 +1,164 @@
+import os
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from transfer_stats import TransferStats
+
+
+PREVIEW_LIMIT = 1000
+
+
+class PermissionEngine:
+    """
+    Sets file and folder permissions, recursively if asked.
+
+    Every directory is opened once and its entries are changed relative to that descriptor
+    (fchmodat through dir_fd), so paths are not resolved again for each file. The current
+    mode comes from the scandir stat and entries already carrying the wanted mode are
+    skipped without a syscall. Subtrees are processed in parallel on a thread pool. Symlinks
+    are never changed or followed.
+
+    A dry run changes nothing and lists (up to PREVIEW_LIMIT of) the changes it would make.
+    """
+    def __init__(self, file_mode: int, folder_mode: int, dry_run: bool = False, workers: int = None,
+                 progress=None, cancelled: threading.Event = None):
+        """
+        :param file_mode: Permission bits for files
+        :param folder_mode: Permission bits for folders
+        :param dry_run: Only count and list what would change
+        :param workers: Number of directories processed at once
+        :param progress: Callable receiving the TransferStats as entries are checked
+        :param cancelled: Event which stops the change when set
+        """
+        self.file_mode = file_mode
+        self.folder_mode = folder_mode
+        self.dry_run = dry_run
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.changed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors: list = []
+        self.preview: list = []
+
+        self._lock = threading.Lock()
+
+    def summary(self) -> str:
+        verb = 'would change' if self.dry_run else 'changed'
+        return f"{self.changed} {verb}, {self.skipped} already set, {self.failed} failed " \
+               f"in {self.stats.elapsed:.1f}s"
+
+    def apply(self, paths: list, recursive: bool = False):
+        """
+        This function sets the permissions of the given items, and of everything below the
+        folders among them when recursive.
+
+        :param paths: Files and folders to change
+        :param recursive: Descend into folders
+        """
+        folders = []
+        for path in paths:
+            try:
+                status = os.lstat(path)
+            except OSError as error:
+                self._count(0, 0, [error])
+                continue
+            if stat.S_ISLNK(status.st_mode):
+                self._count(0, 1, [])
+            elif stat.S_ISDIR(status.st_mode):
+                folders.append((path, stat.S_IMODE(status.st_mode)))
+            else:
+                self._count(*self._change(path, stat.S_IMODE(status.st_mode), self.file_mode))
+
+        if not recursive:
+            for path, mode in folders:
+                self._count(*self._change(path, mode, self.folder_mode))
+        else:
+            with ThreadPoolExecutor(self.workers) as pool:
+                pending = {pool.submit(self._directory, path, mode) for path, mode in folders}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if not self.cancelled.is_set():
+                            pending.update(pool.submit(self._directory, path, mode)
+                                           for path, mode in future.result())
+
+        self.stats.finish()
+
+    def _directory(self, path: str, mode: int) -> list:
+        """
+        This function changes the entries of one directory and then the directory itself.
+
+        :return: List of (path, mode) of its subdirectories
+        """
+        subdirs = []
+        changed, skipped, errors = 0, 0, []
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError as error:
+            self._count(0, 0, [error])
+            return subdirs
+
+        try:
+            with os.scandir(fd) as scan:
+                for entry in scan:
+                    try:
+                        if entry.is_symlink():
+                            skipped += 1
+                            continue
+                        current = stat.S_IMODE(entry.stat(follow_symlinks=False).st_mode)
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append((os.path.join(path, entry.name), current))
+                        elif current == self.file_mode:
+                            skipped += 1
+                        else:
+                            if not self.dry_run:
+                                os.chmod(entry.name, self.file_mode, dir_fd=fd)
+                            self._preview(os.path.join(path, entry.name), current, self.file_mode)
+                            changed += 1
+                    except OSError as error:
+                        errors.append(error)
+
+            # The directory itself last, so a mode without read access does not stop its listing
+            if mode == self.folder_mode:
+                skipped += 1
+            else:
+                if not self.dry_run:
+                    os.chmod(fd, self.folder_mode)
+                self._preview(path, mode, self.folder_mode)
+                changed += 1
+        except OSError as error:
+            errors.append(error)
+        finally:
+            os.close(fd)
+
+        self._count(changed, skipped, errors)
+        return subdirs
+
+    def _change(self, path: str, current: int, wanted: int) -> tuple:
+        if current == wanted:
+            return 0, 1, []
+        try:
+            if not self.dry_run:
+                os.chmod(path, wanted)
+            self._preview(path, current, wanted)
+            return 1, 0, []
+        except OSError as error:
+            return 0, 0, [error]
+
+    def _preview(self, path: str, current: int, wanted: int):
+        if self.dry_run and len(self.preview) < PREVIEW_LIMIT:
+            self.preview.append((path, current, wanted))
+
+    def _count(self, changed: int, skipped: int, errors: list):
+        with self._lock:
+            self.changed += changed
+            self.skipped += skipped
+            self.failed += len(errors)
+            self.errors.extend(errors[:PREVIEW_LIMIT - len(self.errors)])
+        self.stats.add(changed + skipped + len(errors))
+        if self.progress:
+            self.progress(self.stats)
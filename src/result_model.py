@@ -0,0 +1,460 @@
+import threading
+from array import array
+from PyQt5.QtCore import Qt, QAbstractListModel, QAbstractTableModel, QAbstractItemModel, QModelIndex, QTimer, \
+    pyqtSignal
+from PyQt5.QtGui import QColor
+
+
+FILTER_DELAY = 250
+
+
+class PathStore:
+    """
+    Compact append-only list of strings.
+
+    All strings are kept UTF-8 encoded back to back in one bytearray, with an array of
+    offsets marking where each one starts, so a million paths cost tens of megabytes
+    instead of a Python object (and a widget item) each.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array('Q', [0])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].decode('utf-8', 'surrogateescape')
+
+    def append(self, text: str):
+        self.buffer += text.encode('utf-8', 'surrogateescape')
+        self.offsets.append(len(self.buffer))
+
+    def clear(self):
+        self.buffer = bytearray()
+        self.offsets = array('Q', [0])
+
+
+class ResultListModel(QAbstractListModel):
+    """
+    List model for search results backed by PathStore.
+
+    Rows are only turned into strings when the view asks for them, i.e. when they are
+    visible. Sorting and filtering never touch the stored results, they just rebuild the
+    array of store positions the view is showing. That is done on a worker thread, the
+    filter once typing pauses for FILTER_DELAY ms. A filter extending the one shown only
+    narrows the rows shown, and the sorted order of all results is kept for the next sort
+    or filter until results are added.
+    """
+    rows_ready = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(ResultListModel, self).__init__(parent)
+
+        self.paths = PathStore()
+        self.details = PathStore()
+        self.lines = array('I')
+
+        self.rows = None
+        self.filter_text = ''
+        self.sort_order = None
+
+        # What the rows shown were built for, and the ascending order of the first results
+        self._shown = ('', None)
+        self._ordered = None
+        self._generation = 0
+        self._filter_timer = QTimer(self, singleShot=True, interval=FILTER_DELAY)
+        self._filter_timer.timeout.connect(self._request_rows)
+        self.rows_ready.connect(self._apply_rows)
+
+    # ======================================================================
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.paths) if self.rows is None else len(self.rows)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        return self.text(self._position(index.row()))
+
+    def sort(self, column: int = 0, order=Qt.AscendingOrder):
+        self.sort_order = order
+        self._request_rows()
+
+    # ======================================================================
+    def text(self, position: int) -> str:
+        return self._text((self.paths, self.details, self.lines), position)
+
+    @staticmethod
+    def _text(stores: tuple, position: int) -> str:
+        paths, details, lines = stores
+        if lines[position]:
+            return f"{paths[position]}:{lines[position]}: {details[position]}"
+        return paths[position]
+
+    def path(self, row: int) -> str:
+        """
+        :param row: Row as shown in the view
+        :return: Path of the file or folder behind the row
+        """
+        return self.paths[self._position(row)]
+
+    def append(self, matches: list):
+        """
+        This function adds a batch of search results, either paths or content hits given as
+        (path, line number, line text). New results are appended after the current rows, so
+        a sort order in effect only covers the results present when it was chosen.
+
+        :param matches: List of results
+        """
+        first = len(self.paths)
+        for match in matches:
+            if isinstance(match, tuple):
+                path, line, detail = match
+            else:
+                path, line, detail = match, 0, ''
+            self.paths.append(path)
+            self.details.append(detail)
+            self.lines.append(line)
+
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), first, len(self.paths) - 1)
+            self.endInsertRows()
+            return
+
+        added = [position for position in range(first, len(self.paths)) if self._accepts(position)]
+        if added:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(added) - 1)
+            self.rows.extend(added)
+            self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        # New stores, a worker may still be reading the old ones
+        self.paths = PathStore()
+        self.details = PathStore()
+        self.lines = array('I')
+        self.rows = array('I') if self.filter_text else None
+        self.sort_order = None
+        self._shown = (self.filter_text, None)
+        self._ordered = None
+        self._generation += 1
+        self.endResetModel()
+
+    def set_filter(self, text: str):
+        """
+        This function limits the rows shown to those containing the given text (case
+        insensitive) once typing pauses, the stored results themselves are kept.
+
+        :param text: Filter text, empty to show everything
+        """
+        self.filter_text = text.lower()
+        self._filter_timer.start()
+
+    # ======================================================================
+    def _position(self, row: int) -> int:
+        return row if self.rows is None else self.rows[row]
+
+    def _accepts(self, position: int) -> bool:
+        # Rows added are matched against the filter the rows shown were built for
+        return not self._shown[0] or self._shown[0] in self.text(position).lower()
+
+    def _request_rows(self):
+        """
+        This function rebuilds the rows shown for the current filter and sort order in the
+        background, the view keeps the rows it has until they are ready.
+        """
+        self._filter_timer.stop()
+        self._generation += 1
+        if not self.filter_text and self.sort_order is None:
+            self._apply_rows((self._generation, len(self.paths), None, None))
+            return
+
+        count = len(self.paths)
+        shown_filter, shown_order = self._shown
+        base = None
+        if shown_filter and shown_filter in self.filter_text and shown_order == self.sort_order \
+                and self.rows is not None:
+            base = array('I', self.rows)
+        ordered = self._ordered if self._ordered is not None and len(self._ordered) == count else None
+        threading.Thread(target=self._build_rows, daemon=True,
+                         args=(self._generation, (self.paths, self.details, self.lines), count,
+                               self.filter_text, self.sort_order, base, ordered)).start()
+
+    def _build_rows(self, generation: int, stores: tuple, count: int, filter_text: str, order, base, ordered):
+        """
+        This function works out the store positions to show, it runs on a worker thread.
+
+        :param base: Rows shown for a filter the new one extends, only they can still match
+        :param ordered: Ascending order of the first count results if known
+        """
+        if base is not None:
+            positions = base
+        elif order is not None:
+            if ordered is None:
+                ordered = array('I', sorted(range(count), key=lambda position: self._text(stores, position)))
+            positions = reversed(ordered) if order == Qt.DescendingOrder else ordered
+        else:
+            positions = range(count)
+        if filter_text:
+            positions = (position for position in positions
+                         if filter_text in self._text(stores, position).lower())
+        try:
+            self.rows_ready.emit((generation, count, array('I', positions), ordered))
+        except RuntimeError:
+            # The model was deleted meanwhile
+            pass
+
+    def _apply_rows(self, result: tuple):
+        generation, count, rows, ordered = result
+        if generation != self._generation:
+            return
+        if ordered is not None:
+            self._ordered = ordered
+        reordered = self._shown[0] == self.filter_text and rows is not None
+        if reordered:
+            self.layoutAboutToBeChanged.emit()
+        else:
+            self.beginResetModel()
+        self._shown = (self.filter_text, self.sort_order)
+        if rows is not None:
+            # Results which came in while the rows were built go at the end
+            rows.extend(position for position in range(count, len(self.paths)) if self._accepts(position))
+        self.rows = rows
+        if reordered:
+            self.layoutChanged.emit()
+        else:
+            self.endResetModel()
+
+
+class DiffTableModel(QAbstractTableModel):
+    """
+    Sortable table of the DiffEntry results of a folder comparison.
+
+    The entries are kept as they came from the DiffEngine, sorting and filtering by status
+    only rebuild the list of rows shown.
+    """
+    COLUMNS = ('Status', 'Path', 'Left size', 'Right size', 'Reason')
+
+    def __init__(self, parent=None):
+        super(DiffTableModel, self).__init__(parent)
+
+        self.entries: list = []
+        self.rows: list = []
+        self.status_filter = None
+        self.sort_column = 1
+        self.sort_order = Qt.AscendingOrder
+
+    # ======================================================================
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole and index.column() in (2, 3):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+
+        value = self.rows[index.row()][index.column()]
+        if index.column() in (2, 3):
+            return '' if value < 0 else f"{value:,}"
+        return value
+
+    def sort(self, column: int = 1, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.sort_column, self.sort_order = column, order
+        self._rebuild()
+        self.layoutChanged.emit()
+
+    # ======================================================================
+    def entry(self, row: int):
+        return self.rows[row]
+
+    def set_entries(self, entries: list):
+        self.beginResetModel()
+        self.entries = entries
+        self._rebuild()
+        self.endResetModel()
+
+    def set_status_filter(self, status: str = None):
+        """
+        :param status: Only show entries of this status, None to show all
+        """
+        self.beginResetModel()
+        self.status_filter = status
+        self._rebuild()
+        self.endResetModel()
+
+    def _rebuild(self):
+        rows = self.entries if self.status_filter is None else \
+            [entry for entry in self.entries if entry.status == self.status_filter]
+        self.rows = sorted(rows, key=lambda entry: (entry[self.sort_column], entry.relative),
+                           reverse=self.sort_order == Qt.DescendingOrder)
+
+
+class DuplicateTreeModel(QAbstractItemModel):
+    """
+    Two level tree of DuplicateGroup results: a row per group with its size and reclaimable
+    bytes, the paths of its copies below it.
+
+    Group rows carry internal id 0 and path rows the row of their group plus one, so no
+    object is kept per row.
+    """
+    COLUMNS = ('Path', 'Copies', 'Size', 'Reclaimable')
+
+    def __init__(self, parent=None):
+        super(DuplicateTreeModel, self).__init__(parent)
+
+        self.groups: list = []
+
+    # ======================================================================
+    def index(self, row: int, column: int, parent=QModelIndex()) -> QModelIndex:
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column, parent.row() + 1 if parent.isValid() else 0)
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        if not index.isValid() or not index.internalId():
+            return QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, 0)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        if not parent.isValid():
+            return len(self.groups)
+        if parent.internalId() or parent.column() > 0:
+            return 0
+        return len(self.groups[parent.row()].paths)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return len(self.COLUMNS)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole and index.column() > 0:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+
+        if index.internalId():
+            return self.groups[index.internalId() - 1].paths[index.row()] if index.column() == 0 else None
+        group = self.groups[index.row()]
+        return (group.paths[0], len(group.paths), f"{group.size:,}",
+                f"{group.size * (len(group.paths) - 1):,}")[index.column()]
+
+    def sort(self, column: int = 3, order=Qt.DescendingOrder):
+        keys = (lambda group: group.paths[0], lambda group: len(group.paths), lambda group: group.size,
+                lambda group: group.size * (len(group.paths) - 1))
+        self.beginResetModel()
+        self.groups.sort(key=keys[column], reverse=order == Qt.DescendingOrder)
+        self.endResetModel()
+
+    # ======================================================================
+    def group(self, index: QModelIndex):
+        """
+        :return: DuplicateGroup the row belongs to, None for an invalid index
+        """
+        if not index.isValid():
+            return None
+        return self.groups[index.internalId() - 1 if index.internalId() else index.row()]
+
+    def set_groups(self, groups: list):
+        self.beginResetModel()
+        self.groups = list(groups)
+        self.endResetModel()
+
+
+class TextDiffModel(QAbstractTableModel):
+    """
+    Table of the rendered lines of a TextDiffEngine's hunks.
+
+    Hunks are rendered when the view scrolls down to them (canFetchMore/fetchMore, as
+    QFileSystemModel fills in directories), so a comparison with many differences only
+    costs the hunks which were looked at.
+    """
+    COLUMNS = ('Left', 'Right', 'Text')
+    FETCH_ROWS = 500
+    COLOURS = {'-': QColor(255, 220, 220), '+': QColor(220, 255, 220), '@': QColor(225, 230, 245)}
+
+    def __init__(self, parent=None):
+        super(TextDiffModel, self).__init__(parent)
+
+        self.engine = None
+        self.rows: list = []
+        self.next_hunk = 0
+        self.error = None
+
+    # ======================================================================
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        tag, left, right, text = self.rows[index.row()]
+        if role == Qt.BackgroundRole:
+            return self.COLOURS.get(tag)
+        if role == Qt.ForegroundRole and tag in self.COLOURS:
+            # The light backgrounds need dark text in the dark theme too
+            return QColor(Qt.black)
+        if role == Qt.TextAlignmentRole and index.column() < 2:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+
+        value = (left, right, text if tag in ('@', ' ') else f"{tag} {text}")[index.column()]
+        return '' if value is None else value
+
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and self.engine is not None and self.error is None and \
+            self.next_hunk < len(self.engine.hunks)
+
+    def fetchMore(self, parent=QModelIndex()):
+        rows = []
+        try:
+            while len(rows) < self.FETCH_ROWS and self.next_hunk < len(self.engine.hunks):
+                rows.extend(self.engine.render(self.next_hunk))
+                self.next_hunk += 1
+        except OSError as error:
+            self.error = error
+            rows.append(('@', None, None, str(error)))
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    # ======================================================================
+    def set_engine(self, engine):
+        """
+        :param engine: Compared TextDiffEngine, None to clear the table
+        """
+        self.beginResetModel()
+        self.engine = engine
+        self.rows = []
+        self.next_hunk = 0
+        self.error = None
+        self.endResetModel()
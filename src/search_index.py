@@ -0,0 +1,235 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from transfer_stats import TransferStats
+
+
+INDEX_HOME = os.path.join(str(Path.home()), '.commander', 'index')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, dir_id INTEGER, name TEXT, is_dir INTEGER);
+CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir_id);
+CREATE TABLE IF NOT EXISTS grams (gram TEXT, entry_id INTEGER, PRIMARY KEY (gram, entry_id)) WITHOUT ROWID;
+"""
+
+
+class TrigramIndex:
+    """
+    On-disk trigram index of the file and folder names below a chosen root.
+
+    The index is built once and afterwards only directories whose mtime has changed are
+    re-listed, so keeping it current costs a stat per directory rather than a full walk.
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.db_path = self.index_file(self.root)
+
+        os.makedirs(INDEX_HOME, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('root', ?)", (self.root,))
+        self.connection.commit()
+
+    @staticmethod
+    def index_file(root: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(root).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(INDEX_HOME, f"{digest}.sqlite")
+
+    @staticmethod
+    def index_for(location: str):
+        """
+        This function looks for an existing index covering the given location.
+
+        :param location: Directory about to be searched
+        :return: TrigramIndex of the nearest indexed ancestor or None
+        """
+        path = os.path.abspath(location)
+        while True:
+            if os.path.isfile(TrigramIndex.index_file(path)):
+                return TrigramIndex(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    @staticmethod
+    def trigrams(name: str) -> set:
+        name = name.lower()
+        return {name[i:i + 3] for i in range(len(name) - 2)}
+
+    @staticmethod
+    def required_trigrams(find: str) -> set:
+        """
+        This function collects the trigrams any match of the search criteria must contain,
+        taken from the literal runs of the expression. Alternations, classes, groups and
+        escapes are not analysed and give an empty set (no narrowing).
+
+        :param find: Search criteria as entered by the user
+        :return: Set of trigrams
+        """
+        if any(char in find for char in '|[(\\'):
+            return set()
+
+        runs = []
+        run = ''
+        skip = False
+        for char in find:
+            if skip:
+                skip = char != '}'
+            elif char in '.^$*+?{}':
+                if char in '?*{':
+                    run = run[:-1]
+                    skip = char == '{'
+                runs.append(run)
+                run = ''
+            else:
+                run += char
+        runs.append(run)
+
+        return set().union(*(TrigramIndex.trigrams(run) for run in runs))
+
+    def close(self):
+        self.connection.close()
+
+    def updated(self):
+        """
+        :return: Time of the last build/update or None if never built
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'updated'").fetchone()
+        return float(row[0]) if row else None
+
+    # ======================================================================
+    def update(self, progress=None, cancelled=None) -> int:
+        """
+        This function builds the index, or brings an existing one up to date by re-listing
+        only those directories whose mtime differs from the stored value. A cancelled update
+        keeps the directories listed so far, the next one carries on from there.
+
+        :param progress: Callable receiving the TransferStats, counting directories checked
+        :param cancelled: Event which stops the update when set
+        :return: Number of directories that had to be re-listed
+        """
+        cursor = self.connection.cursor()
+        rescanned = 0
+        stack = [self.root]
+        stats = TransferStats()
+
+        while stack:
+            if cancelled and cancelled.is_set():
+                self.connection.commit()
+                logging.info(f"Search index update for {self.root} cancelled - {rescanned} directories re-listed")
+                return rescanned
+            stats.add(1, 0)
+            if progress:
+                progress(stats)
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                self._drop_tree(cursor, path)
+                continue
+
+            row = cursor.execute("SELECT id, mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+            if row and row[1] == mtime_ns:
+                subdirs = [name for (name,) in cursor.execute(
+                    "SELECT name FROM entries WHERE dir_id = ? AND is_dir = 1", (row[0],))]
+            else:
+                subdirs = self._rescan(cursor, path, row[0] if row else None, mtime_ns)
+                rescanned += 1
+
+            stack.extend(os.path.join(path, name) for name in subdirs)
+
+        cursor.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (str(time.time()),))
+        self.connection.commit()
+
+        logging.info(f"Search index for {self.root} updated - {rescanned} directories re-listed")
+        return rescanned
+
+    def _rescan(self, cursor, path: str, dir_id, mtime_ns: int) -> list:
+        try:
+            with os.scandir(path) as scan:
+                listing = [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in scan]
+        except OSError as error:
+            logging.error(error)
+            listing = []
+
+        if dir_id is None:
+            cursor.execute("INSERT INTO dirs (path, mtime_ns) VALUES (?, ?)", (path, mtime_ns))
+            dir_id = cursor.lastrowid
+            old = {}
+        else:
+            cursor.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?", (mtime_ns, dir_id))
+            old = {(name, bool(is_dir)): entry_id for entry_id, name, is_dir in cursor.execute(
+                "SELECT id, name, is_dir FROM entries WHERE dir_id = ?", (dir_id,))}
+
+        current = set(listing)
+        for key, entry_id in old.items():
+            if key not in current:
+                self._drop_entry(cursor, entry_id, key[0])
+                if key[1]:
+                    self._drop_tree(cursor, os.path.join(path, key[0]))
+
+        for name, is_dir in current - old.keys():
+            cursor.execute("INSERT INTO entries (dir_id, name, is_dir) VALUES (?, ?, ?)",
+                           (dir_id, name, int(is_dir)))
+            entry_id = cursor.lastrowid
+            cursor.executemany("INSERT OR IGNORE INTO grams VALUES (?, ?)",
+                               ((gram, entry_id) for gram in self.trigrams(name)))
+
+        return [name for name, is_dir in listing if is_dir]
+
+    def _drop_entry(self, cursor, entry_id: int, name: str):
+        cursor.executemany("DELETE FROM grams WHERE gram = ? AND entry_id = ?",
+                           ((gram, entry_id) for gram in self.trigrams(name)))
+        cursor.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+    def _drop_tree(self, cursor, path: str):
+        low, high = self._prefix_range(path)
+        doomed = cursor.execute("SELECT id FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                                (path, low, high)).fetchall()
+        for (dir_id,) in doomed:
+            for entry_id, name in cursor.execute("SELECT id, name FROM entries WHERE dir_id = ?",
+                                                 (dir_id,)).fetchall():
+                self._drop_entry(cursor, entry_id, name)
+            cursor.execute("DELETE FROM dirs WHERE id = ?", (dir_id,))
+
+    @staticmethod
+    def _prefix_range(path: str):
+        prefix = path.rstrip(os.sep) + os.sep
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    # ======================================================================
+    def search(self, location: str, find: str) -> list:
+        """
+        This function answers a name search from the index rather than the file system.
+
+        Plain text of three or more characters is narrowed down using the trigram postings,
+        anything else (short text or a regular expression) is matched against the stored
+        names, which still avoids touching the disk.
+
+        :param location: Directory below which matches are wanted
+        :param find: Lower case search criteria, interpreted as a regular expression
+        :return: List of matching paths
+        """
+        location = os.path.abspath(location)
+        low, high = self._prefix_range(location)
+        pattern = re.compile(find)
+
+        query = "SELECT d.path, e.name FROM entries e JOIN dirs d ON d.id = e.dir_id " \
+                "WHERE (d.path = ? OR (d.path >= ? AND d.path < ?))"
+        parameters = [location, low, high]
+
+        grams = self.required_trigrams(find)
+        if grams:
+            postings = " INTERSECT ".join(["SELECT entry_id FROM grams WHERE gram = ?"] * len(grams))
+            query += f" AND e.id IN ({postings})"
+            parameters.extend(grams)
+
+        return [os.path.join(path, name) for path, name in self.connection.execute(query, parameters)
+                if pattern.search(name.lower())]
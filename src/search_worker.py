@@ -0,0 +1,112 @@
+import re
+import time
+import logging
+import threading
+from concurrent.futures import BrokenExecutor
+from PyQt5.QtCore import QThread, pyqtSignal
+from search_index import TrigramIndex
+from content_search import ContentSearcher
+from walker import Walker
+
+
+class SearchWorker(QThread):
+    """
+    Runs a name (or, given a ContentSearcher, a content) search off the GUI thread and
+    streams the matches back in small batches.
+
+    Batches are flushed at least every BATCH_INTERVAL seconds, so the first hits show up
+    almost immediately even when the walk over a large tree takes minutes.
+    """
+    found = pyqtSignal(list)
+    progress = pyqtSignal(int, float)
+    completed = pyqtSignal(int, float)
+
+    BATCH_INTERVAL = 0.05
+    BATCH_SIZE = 2000
+
+    def __init__(self, parent, location: str, find: str, searcher: ContentSearcher = None):
+        super(SearchWorker, self).__init__(parent)
+
+        self.location = location
+        self.find = find
+        self.searcher = searcher
+
+        self._cancelled = searcher.cancelled if searcher else threading.Event()
+        self._batch: list = []
+        self._flushed = 0.0
+        self._scanned = 0
+        self._started = 0.0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def run(self):
+        self._started = time.monotonic()
+        self._flushed = self._started
+
+        try:
+            if self.searcher:
+                self._search_contents()
+            else:
+                index = TrigramIndex.index_for(self.location)
+                if index:
+                    try:
+                        self._search_index(index)
+                    finally:
+                        index.close()
+                else:
+                    self._search_tree()
+        except (OSError, re.error, BrokenExecutor) as error:
+            logging.error(error)
+
+        self._flush()
+        elapsed = time.monotonic() - self._started
+        self.completed.emit(self._scanned, elapsed)
+
+    def _search_index(self, index: TrigramIndex):
+        for match in index.search(self.location, self.find):
+            if self.is_cancelled():
+                return
+            self._scanned += 1
+            self._add(match)
+
+    def _search_tree(self):
+        pattern = re.compile(self.find)
+
+        for listing in Walker(cancelled=self._cancelled).walk(self.location):
+            for entry in listing.dirs + listing.files:
+                if pattern.search(entry.name.lower()):
+                    self._add(entry.path)
+            self._scanned += len(listing.dirs) + len(listing.files)
+            self._tick()
+
+    def _search_contents(self):
+        for hits in self.searcher.search(self.location):
+            for hit in hits:
+                self._add(hit)
+            self._scanned = self.searcher.files_scanned
+            self._tick()
+
+    def _add(self, match):
+        self._batch.append(match)
+        if len(self._batch) >= self.BATCH_SIZE:
+            self._flush()
+        else:
+            self._tick()
+
+    def _tick(self):
+        if time.monotonic() - self._flushed >= self.BATCH_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        now = time.monotonic()
+        if self._batch and not self.is_cancelled():
+            self.found.emit(self._batch)
+            self._batch = []
+        self._flushed = now
+
+        elapsed = now - self._started
+        self.progress.emit(self._scanned, self._scanned / elapsed if elapsed else 0.0)
@@ -0,0 +1,188 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from pathlib import Path
+from support_functions import Supporting
+
+
+STAGING_NAME = '.commander-trash'
+STAGING_LIST = os.path.join(str(Path.home()), '.commander', 'staging.json')
+STAGED_LIST = os.path.join(str(Path.home()), '.commander', 'staged.json')
+
+
+class StagedDelete:
+    """
+    Instant deletes of whole trees.
+
+    The item is first renamed into a hidden staging directory on its own file system, which
+    is atomic and takes the same time for any size of tree, so it disappears from the panes
+    at once. The staged copy is then purged in the background. Staging directories in use are
+    recorded in ~/.commander/staging.json, and the original path of every staged item in
+    ~/.commander/staged.json: a cancelled purge renames what is left of the item back, and
+    items left behind by an interrupted session can be purged or restored on the next start.
+    """
+    _lock = threading.Lock()
+
+    @staticmethod
+    def staging_dir(path: str) -> str:
+        """
+        This function finds (or creates) the staging directory for the file system of a path,
+        preferring the mount point, then the home folder and finally the item's own folder.
+
+        :param path: Item to be deleted
+        :return: Staging directory on the same device as the item
+        """
+        path = os.path.abspath(path)
+        parent = os.path.dirname(path)
+        device = os.lstat(path).st_dev
+
+        mount = parent
+        while not os.path.ismount(mount):
+            mount = os.path.dirname(mount)
+
+        for folder in (mount, str(Path.home()), parent):
+            staging = os.path.join(folder, STAGING_NAME)
+            try:
+                if os.stat(folder).st_dev != device:
+                    continue
+                os.makedirs(staging, exist_ok=True)
+                if os.stat(staging).st_dev == device and os.access(staging, os.W_OK):
+                    StagedDelete._remember(staging)
+                    return staging
+            except OSError:
+                continue
+
+        raise PermissionError(f"No staging directory available for {path}")
+
+    @staticmethod
+    def stage(path: str) -> str:
+        """
+        This function moves an item out of sight into its staging directory.
+
+        :param path: Item to be deleted
+        :return: Path of the staged item, to be purged
+        """
+        staging = StagedDelete.staging_dir(path)
+        staged = os.path.join(staging, f"{uuid.uuid4().hex}-{os.path.basename(os.path.abspath(path))}")
+        os.rename(path, staged)
+        StagedDelete._record(staged, os.path.abspath(path))
+        return staged
+
+    @staticmethod
+    def purge(staged: str, progress=None, cancelled=None):
+        """
+        This function removes a staged item, with the parallel tree removal for folders. If
+        the removal is cancelled what is left of the item is renamed back to where it was.
+        """
+        if os.path.isdir(staged) and not os.path.islink(staged):
+            Supporting.remove_tree(staged, progress, cancelled)
+        else:
+            os.unlink(staged)
+        if not (cancelled and cancelled.is_set() and os.path.lexists(staged)):
+            StagedDelete._record(staged, None)
+        elif staged in StagedDelete._staged():
+            StagedDelete.restore(staged)
+
+    @staticmethod
+    def restore(staged: str) -> bool:
+        """
+        This function renames a staged item back to its original path.
+
+        :param staged: Path of the staged item
+        :return: False if its original path is unknown or taken
+        """
+        original = StagedDelete._staged().get(staged)
+        if original is None or os.path.lexists(original):
+            logging.error(f"{staged} cannot be restored, {original or 'its original path'} is unknown or taken")
+            return False
+        os.rename(staged, original)
+        StagedDelete._record(staged, None)
+        logging.info(f"{original} restored")
+        return True
+
+    @staticmethod
+    def leftovers() -> list:
+        """
+        :return: Staged items still waiting in any of the recorded staging directories
+        """
+        items = []
+        for staging in StagedDelete._remembered():
+            try:
+                items.extend(entry.path for entry in os.scandir(staging))
+            except OSError:
+                continue
+        return items
+
+    @staticmethod
+    def purge_all(items: list, progress=None, cancelled=None) -> bool:
+        """
+        This function removes staged items, the items not reached when it is cancelled are
+        restored.
+        """
+        errors = 0
+        for staged in items:
+            try:
+                if cancelled and cancelled.is_set():
+                    StagedDelete.restore(staged)
+                else:
+                    StagedDelete.purge(staged, progress, cancelled)
+            except OSError as error:
+                logging.error(error)
+                errors += 1
+        return not errors
+
+    @staticmethod
+    def restore_all(items: list) -> bool:
+        """
+        :return: False if any of the staged items could not be restored
+        """
+        restored = True
+        for staged in items:
+            try:
+                restored = StagedDelete.restore(staged) and restored
+            except OSError as error:
+                logging.error(error)
+                restored = False
+        return restored
+
+    @staticmethod
+    def _remembered() -> list:
+        try:
+            with open(STAGING_LIST) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return []
+
+    @staticmethod
+    def _staged() -> dict:
+        try:
+            with open(STAGED_LIST) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _record(staged: str, original):
+        """
+        This function records the original path of a staged item, or forgets it if original is None.
+        """
+        with StagedDelete._lock:
+            known = StagedDelete._staged()
+            if original is None:
+                if known.pop(staged, None) is None:
+                    return
+            else:
+                known[staged] = original
+            os.makedirs(os.path.dirname(STAGED_LIST), exist_ok=True)
+            with open(STAGED_LIST, 'w') as file:
+                json.dump(known, file)
+
+    @staticmethod
+    def _remember(staging: str):
+        known = StagedDelete._remembered()
+        if staging not in known:
+            os.makedirs(os.path.dirname(STAGING_LIST), exist_ok=True)
+            with open(STAGING_LIST, 'w') as file:
+                json.dump(known + [staging], file)
@@ -1,6 +1,8 @@
 import os
-import shutil
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from walker import Walker
+from transfer_stats import TransferStats
 
 
 class Supporting:
@@ -26,24 +28,78 @@ class Supporting:
         #         logging.error(error)
 
     @staticmethod
-    def zip_it(active_item: str):
+    def run_batch(items: list, operation, progress=None, cancelled=None, workers: int = 16):
         """
-        This function attempts to zip the user selected item.
+        This function applies a metadata operation (rename, unlink, chmod, ...) to many items
+        as one operation. The calls are spread over a thread pool so their latencies overlap,
+        and a single TransferStats counts them.
 
-        :param active_item: Item to zip
+        :param items: Argument of each call of the operation
+        :param operation: Callable taking one item
+        :param progress: Callable receiving the TransferStats as items are done
+        :param cancelled: Event which stops the batch when set
+        :param workers: Number of concurrent calls
+        :return: TransferStats and the list of errors met
         """
-        try:
-            base = os.path.basename(active_item)
-            name = base.split('.')[0]
-            format_type = 'zip'
+        errors = []
+        stats = TransferStats(total_files=len(items))
 
-            archive_from = os.path.dirname(active_item)
-            archive_to = os.path.basename(active_item.strip(os.sep))
-            destination = os.path.join(archive_from, name + '.' + format_type)
+        def apply(item):
+            if cancelled and cancelled.is_set():
+                return
+            try:
+                operation(item)
+            except OSError as error:
+                errors.append(error)
+            stats.add(1)
+            if progress:
+                progress(stats)
+
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(apply, items))
+
+        stats.finish()
+        return stats, errors
+
+    @staticmethod
+    def remove_tree(path: str, progress=None, cancelled=None):
+        """
+        This function removes a directory and all of its contents. The tree is listed with
+        the parallel walker, files are unlinked by a thread pool as their directory listings
+        arrive and the emptied directories are then removed deepest first.
+
+        :param path: Directory to remove
+        :param progress: Callable receiving the TransferStats as files are removed
+        :param cancelled: Event which stops the removal when set
+        """
+        errors = []
+        directories = [(0, path)]
+        stats = TransferStats()
 
-            shutil.make_archive(name, format_type, archive_from, archive_to)
-            shutil.move(f"{name}.{format_type}", destination)
+        with ThreadPoolExecutor() as pool:
+            for listing in Walker(cancelled=cancelled, onerror=errors.append).walk(path):
+                directories.extend((listing.depth + 1, d.path) for d in listing.dirs)
+                pool.submit(Supporting._unlink_all, [f.path for f in listing.files], errors)
+                stats.add(len(listing.files))
+                if progress:
+                    progress(stats)
 
-            logging.info(f"Zip file {destination} created")
-        except OSError as error:
-            logging.error(error)
+        if cancelled and cancelled.is_set():
+            return
+
+        for _, directory in sorted(directories, reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError as error:
+                errors.append(error)
+
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _unlink_all(paths: list, errors: list):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError as error:
+                errors.append(error)
@@ -0,0 +1,220 @@
+import os
+import stat
+import errno
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from walker import Walker
+from copy_engine import CopyEngine
+from support_functions import Supporting
+from hash_cache import HashCache
+
+
+SyncAction = namedtuple('SyncAction', ['action', 'relative', 'size', 'reason'])
+
+MKDIR = 'mkdir'
+COPY = 'copy'
+TOUCH = 'touch'
+DELETE = 'delete'
+CHECK = 'check'
+
+
+class SyncEngine:
+    """
+    One way, rsync style synchronisation of a destination tree with a source tree.
+
+    plan() walks the source in parallel and compares every source directory with its
+    destination counterpart by type, size and mtime (optionally confirming content with a
+    hash when only the mtime differs), so an unchanged tree costs one metadata scan.
+    apply() carries the plan out: conflicting or extra entries are deleted, missing
+    directories created and new or changed files copied by the CopyEngine.
+    """
+    def __init__(self, source: str, destination: str, use_hash: bool = False, delete_extras: bool = False,
+                 progress=None, cancelled: threading.Event = None):
+        """
+        :param source: Directory to mirror
+        :param destination: Directory to bring up to date
+        :param use_hash: Compare contents when sizes match but mtimes differ
+        :param delete_extras: Remove destination entries that are not in the source
+        :param progress: Callable receiving the TransferStats of the copies
+        :param cancelled: Event which stops planning or applying when set
+        """
+        self.source = os.path.abspath(source)
+        self.destination = os.path.abspath(destination)
+        self.use_hash = use_hash
+        self.delete_extras = delete_extras
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+        self.errors: list = []
+
+    def _check_folders(self):
+        """
+        :raises OSError: If one folder is the other or inside it, the sync would copy the tree into
+            itself or delete the source as an extra
+        """
+        source, destination = os.path.realpath(self.source), os.path.realpath(self.destination)
+        if os.path.commonpath([source, destination]) in (source, destination):
+            raise OSError(errno.EINVAL, "Cannot sync a folder with itself or a folder inside it", self.destination)
+
+    # ======================================================================
+    def plan(self) -> list:
+        """
+        Entries which cannot be read are left out of the plan, their errors are collected in errors.
+
+        :return: List of SyncAction in the order they would be applied
+        """
+        self._check_folders()
+        actions = []
+        candidates = []
+        with ThreadPoolExecutor() as pool:
+            futures = [pool.submit(self._compare_directory, listing)
+                       for listing in Walker(stat=True, cancelled=self.cancelled).walk(self.source)]
+            for future in futures:
+                found, hashes = future.result()
+                actions.extend(found)
+                candidates.extend(hashes)
+        actions.extend(self._compare_contents(candidates))
+
+        order = {DELETE: 0, MKDIR: 1, COPY: 2, TOUCH: 3}
+        actions.sort(key=lambda action: (order[action.action], action.relative))
+        return actions
+
+    def _compare_directory(self, listing) -> tuple:
+        """
+        :return: (list of SyncAction, list of (relative path, size) whose contents decide)
+        """
+        relative = os.path.relpath(listing.path, self.source)
+        relative = '' if relative == '.' else relative
+        target = os.path.join(self.destination, relative)
+
+        existing = {}
+        try:
+            with os.scandir(target) as scan:
+                for entry in scan:
+                    existing[entry.name] = entry
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+        actions, candidates = [], []
+        for entry in listing.dirs:
+            other = existing.pop(entry.name, None)
+            path = os.path.join(relative, entry.name)
+            if other is None or not other.is_dir(follow_symlinks=False):
+                if other is not None:
+                    actions.append(SyncAction(DELETE, path, 0, 'replaced by a folder'))
+                actions.append(SyncAction(MKDIR, path, 0, 'new folder'))
+
+        for entry in listing.files:
+            other = existing.pop(entry.name, None)
+            path = os.path.join(relative, entry.name)
+            try:
+                status = entry.stat(follow_symlinks=False)
+            except OSError as error:
+                # Removed or unreadable since it was listed
+                self.errors.append(error)
+                continue
+
+            if other is None:
+                actions.append(SyncAction(COPY, path, status.st_size, 'new'))
+            elif other.is_dir(follow_symlinks=False):
+                actions.append(SyncAction(DELETE, path, 0, 'replaced by a file'))
+                actions.append(SyncAction(COPY, path, status.st_size, 'new'))
+            else:
+                try:
+                    reason = self._difference(entry, status, other)
+                except OSError as error:
+                    self.errors.append(error)
+                    continue
+                if reason == CHECK:
+                    candidates.append((path, status.st_size))
+                elif reason:
+                    actions.append(SyncAction(COPY, path, status.st_size, reason))
+
+        if self.delete_extras:
+            actions.extend(SyncAction(DELETE, os.path.join(relative, name), 0, 'not in source')
+                           for name in existing)
+        return actions, candidates
+
+    def _difference(self, entry: os.DirEntry, status: os.stat_result, other: os.DirEntry):
+        """
+        :return: Reason to copy, CHECK if the contents have to be compared or None if equal
+        """
+        other_status = other.stat(follow_symlinks=False)
+
+        if stat.S_ISLNK(status.st_mode) or stat.S_ISLNK(other_status.st_mode):
+            if stat.S_ISLNK(status.st_mode) and stat.S_ISLNK(other_status.st_mode) \
+                    and os.readlink(entry.path) == os.readlink(other.path):
+                return None
+            return 'link changed'
+        if status.st_size != other_status.st_size:
+            return 'size differs'
+        if status.st_mtime_ns != other_status.st_mtime_ns:
+            return CHECK if self.use_hash else 'time differs'
+        return None
+
+    def _compare_contents(self, candidates: list) -> list:
+        """
+        This function decides between TOUCH and COPY for files which only differ in mtime by
+        their digests, taken from the HashCache where the files are unchanged since last time.
+        """
+        if not candidates:
+            return []
+        with HashCache(cancelled=self.cancelled) as cache:
+            sources = cache.hashes([os.path.join(self.source, path) for path, _ in candidates])
+            targets = cache.hashes([os.path.join(self.destination, path) for path, _ in candidates])
+
+        actions = []
+        for path, size in candidates:
+            digest = sources.get(os.path.join(self.source, path))
+            if digest and digest == targets.get(os.path.join(self.destination, path)):
+                actions.append(SyncAction(TOUCH, path, 0, 'same content, time differs'))
+            else:
+                actions.append(SyncAction(COPY, path, size, 'content differs'))
+        return actions
+
+    # ======================================================================
+    def apply(self, actions: list) -> CopyEngine:
+        """
+        This function carries out a plan made by plan().
+
+        :param actions: List of SyncAction
+        :return: CopyEngine used for the copies, holding the transfer statistics
+        """
+        self._check_folders()
+        errors = []
+        engine = CopyEngine(progress=self.progress, cancelled=self.cancelled)
+        os.makedirs(self.destination, exist_ok=True)
+
+        for action in actions:
+            if self.cancelled.is_set():
+                break
+            target = os.path.join(self.destination, action.relative)
+            try:
+                if action.action == DELETE:
+                    if os.path.isdir(target) and not os.path.islink(target):
+                        Supporting.remove_tree(target)
+                    else:
+                        os.unlink(target)
+                elif action.action == MKDIR:
+                    os.makedirs(target, exist_ok=True)
+            except OSError as error:
+                errors.append(error)
+
+        errors.extend(engine.copy_files(
+            (os.path.join(self.source, action.relative), os.path.join(self.destination, action.relative),
+             action.size, os.path.islink(os.path.join(self.source, action.relative)))
+            for action in actions if action.action == COPY and not self.cancelled.is_set()))
+
+        for action in actions:
+            if action.action in (TOUCH, MKDIR) and not self.cancelled.is_set():
+                try:
+                    shutil.copystat(os.path.join(self.source, action.relative),
+                                    os.path.join(self.destination, action.relative))
+                except OSError as error:
+                    errors.append(error)
+
+        engine.stats.finish()
+        if errors:
+            raise errors[0]
+        return engine
@@ -1,33 +1,45 @@
 # -*- coding: utf-8 -*-
 import os
-import shutil
 import sys
 import logging
-import subprocess
 import pwd
 from pathlib import Path
 from PyQt5 import QtWidgets, uic
 from PyQt5.QtWidgets import QMainWindow, QAction, QMessageBox, QFileDialog, \
-    QApplication, QFileSystemModel
-from PyQt5.QtCore import pyqtSlot, QModelIndex, QDir, QSettings
+    QApplication, QFileSystemModel, QVBoxLayout, QAbstractItemView
+from PyQt5.QtCore import Qt, pyqtSlot, pyqtSignal, QObject, QModelIndex, QDir, QSettings, QTimer
 from PyQt5.QtGui import QIcon
 from dialogs import MoveDialog, CopyDialog, PermissionsDialog, RenameDialog, \
-    MakeFileDialog, MakeFolderDialog, SearchDialog
+    MakeFileDialog, MakeFolderDialog, SearchDialog, SyncDialog, ArchiveDialog, ExtractDialog, \
+    DiffDialog, DuplicatesDialog, TextDiffDialog, BinaryDiffDialog
 from support_functions import Supporting
+from staged_delete import StagedDelete, STAGING_NAME
+from archive_index import ArchiveIndex
+from archive_model import ArchiveModel
+from pane_models import PaneModelCache, PATH_EDIT_DELAY
+from folder_sizes import FolderSizes
+from binary_diff_engine import BinaryDiffEngine
+from transfer_queue import TransferQueue, Job
+from transfer_panel import TransferPanel
 
 
 start = f"PyCommander session for user: {pwd.getpwuid(os.getuid())[0]}"
 
 
-class QTextEditLogger(logging.Handler):
+class QTextEditLogger(logging.Handler, QObject):
+    # Records may come from background jobs, the signal hands them to the GUI thread
+    append = pyqtSignal(str)
+
     def __init__(self, widget):
         super().__init__()
+        QObject.__init__(self)
         self.widget = widget
         self.widget.setReadOnly(True)
+        self.append.connect(self.widget.appendPlainText)
 
     def emit(self, record):
         msg = self.format(record)
-        self.widget.appendPlainText(msg)
+        self.append.emit(msg)
 
 
 class LaunchCommander(QMainWindow):
@@ -58,6 +70,17 @@ class LaunchCommander(QMainWindow):
         self.header_indices_left: list = []
         self.header_indices_right: list = []
 
+        self.folder_sizes = FolderSizes(parent=self)
+        self.pane_models = PaneModelCache(parent=self, in_use=lambda model: model in (self.treeView_2.model(),
+                                                                                    self.treeView_4.model()),
+                                          folder_sizes=self.folder_sizes)
+
+        self.transfer_queue = TransferQueue(self, int(self.settings.value("transfer_concurrency", 2)))
+        self.transfer_panel = TransferPanel(self.transfer_queue, self.tab_2)
+        QVBoxLayout(self.tab_2).addWidget(self.transfer_panel)
+        self.purge_leftovers()
+        QApplication.instance().aboutToQuit.connect(ArchiveIndex.remove_extracted)
+
         self.restore_settings()
         self.setup_ui()
         self.set_menu()
@@ -100,8 +123,15 @@ class LaunchCommander(QMainWindow):
             self.treeView_4.hideColumn(i)
         self.folders_right()
 
-        self.directory_line_1.textChanged.connect(lambda: self.folder_viewer_left(self.directory_line_1.text()))
-        self.directory_line_2.textChanged.connect(lambda: self.folder_viewer_right(self.directory_line_2.text()))
+        # Typed paths are shown once typing pauses, paths set by the program right away
+        self.path_timer_1 = QTimer(self, singleShot=True, interval=PATH_EDIT_DELAY)
+        self.path_timer_2 = QTimer(self, singleShot=True, interval=PATH_EDIT_DELAY)
+        self.path_timer_1.timeout.connect(lambda: self.folder_viewer_left(self.directory_line_1.text()))
+        self.path_timer_2.timeout.connect(lambda: self.folder_viewer_right(self.directory_line_2.text()))
+        self.directory_line_1.textChanged.connect(
+            lambda: self.path_timer_1.start(0 if not self.directory_line_1.isModified() else PATH_EDIT_DELAY))
+        self.directory_line_2.textChanged.connect(
+            lambda: self.path_timer_2.start(0 if not self.directory_line_2.isModified() else PATH_EDIT_DELAY))
         self.browse_1.released.connect(self.browse_gen)
         self.browse_2.released.connect(self.browse_gen)
         self.move_down_button_1.released.connect(self.move_down_left)
@@ -122,21 +152,31 @@ class LaunchCommander(QMainWindow):
         self.terminal_button_1.released.connect(lambda: self._terminal('left'))
         self.terminal_button_2.released.connect(lambda: self._terminal('right'))
 
+        self.treeView_2.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.treeView_4.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.treeView_2.setSortingEnabled(True)
+        self.treeView_4.setSortingEnabled(True)
+        self.treeView_2.sortByColumn(0, Qt.AscendingOrder)
+        self.treeView_4.sortByColumn(0, Qt.AscendingOrder)
         self.treeView_2.clicked.connect(self.active_left)
         self.treeView_4.clicked.connect(self.active_right)
+        self.treeView_2.doubleClicked.connect(lambda index: self.open_item(index, 'left'))
+        self.treeView_4.doubleClicked.connect(lambda index: self.open_item(index, 'right'))
 
         # Set button functions
         self.move_button.released.connect(self.move_it)
         self.copy_button.released.connect(self.copy_it)
         self.compare_button.released.connect(self.compare_it)
-        self.delete_button.released.connect(lambda: self.remove_item(self.active_item))
+        self.delete_button.released.connect(self.remove_items)
         self.permission_button.released.connect(self.permission_it)
         self.rename_button.released.connect(self.rename_it)
         self.edit_button.released.connect(lambda: Supporting.read_write(self.active_item))
         self.make_file_button.released.connect(self.make_file)
         self.make_folder_button.released.connect(self.make_folder)
         self.zip_button.released.connect(self.zipper)
+        self.extract_button.released.connect(self.extract_it)
         self.search_button.released.connect(self.search_item)
+        self.sync_button.released.connect(self.sync_it)
 
     def set_menu(self):
         # set up windows menubar
@@ -199,10 +239,25 @@ class LaunchCommander(QMainWindow):
         data_menu.addAction(search_it)
         search_it.triggered.connect(self.search_item)
 
+        sync_it = QAction("Sync", self)
+        sync_it.setShortcut("Ctrl+Y")
+        data_menu.addAction(sync_it)
+        sync_it.triggered.connect(self.sync_it)
+
+        extract_it = QAction("Extract", self)
+        extract_it.setShortcut("Ctrl+U")
+        data_menu.addAction(extract_it)
+        extract_it.triggered.connect(self.extract_it)
+
+        duplicates_it = QAction("Find Duplicates", self)
+        duplicates_it.setShortcut("Ctrl+Shift+F")
+        data_menu.addAction(duplicates_it)
+        duplicates_it.triggered.connect(self.duplicates_it)
+
         delete_it = QAction("Delete", self)
         delete_it.setShortcut("Ctrl+D")
         data_menu.addAction(delete_it)
-        delete_it.triggered.connect(lambda: self.remove_item(self.active_item))
+        delete_it.triggered.connect(self.remove_items)
 
     def grey_sheet(self):
         with open('themes/darkGrey.css') as file:
@@ -226,7 +281,7 @@ class LaunchCommander(QMainWindow):
         current_path = self.directory_line_1.text()
         moved_down = os.path.split(current_path)[0]
 
-        if os.path.isdir(moved_down):
+        if os.path.isdir(moved_down) or ArchiveIndex.split(moved_down):
             self.directory_line_1.clear()
             self.directory_line_1.setText(moved_down)
 
@@ -234,7 +289,7 @@ class LaunchCommander(QMainWindow):
         current_path = self.directory_line_2.text()
         moved_down = os.path.split(current_path)[0]
 
-        if os.path.isdir(moved_down):
+        if os.path.isdir(moved_down) or ArchiveIndex.split(moved_down):
             self.directory_line_2.clear()
             self.directory_line_2.setText(moved_down)
 
@@ -254,11 +309,7 @@ class LaunchCommander(QMainWindow):
             self.directory_line_2.setText(str(Path.home()))
 
     def folder_viewer_left(self, path: str, index: int = None):
-        self.fileModel_left = QFileSystemModel()
-        self.fileModel_left.setReadOnly(False)
-        self.fileModel_left.setFilter(QDir.NoDotAndDotDot | QDir.AllDirs | QDir.Files)
-        self.fileModel_left.setRootPath(QDir.rootPath())
-        self.fileModel_left.setResolveSymlinks(True)
+        self.fileModel_left = self.show_folder(self.treeView_2, path)
 
         if index:
             headers_remove = self.update_view(index, 'left')
@@ -274,10 +325,28 @@ class LaunchCommander(QMainWindow):
         for i in headers_remove:
             self.treeView_2.header().hideSection(i)
 
-        self.treeView_2.setModel(self.fileModel_left)
-        self.treeView_2.setRootIndex(self.fileModel_left.index(path))
         self.treeView_2.resizeColumnToContents(-1)
 
+    def show_folder(self, view, path: str):
+        """
+        This function shows a folder in an explorer pane through the cached pane models. A
+        path which is not a folder (yet), like one half typed, leaves the pane as it is.
+
+        :param view: Explorer tree view
+        :param path: Folder to show
+        :return: The model of the pane
+        """
+        if not os.path.isdir(path) and not ArchiveIndex.split(path):
+            if view.model() is not None:
+                return view.model()
+            path = QDir.rootPath()
+
+        model, root_index = self.pane_models.model(path)
+        if view.model() is not model:
+            view.setModel(model)
+        view.setRootIndex(root_index)
+        return model
+
     def folders_left(self):
         self.dirModel_left = QFileSystemModel()
         self.dirModel_left.setRootPath(str(Path.home()))
@@ -303,11 +372,7 @@ class LaunchCommander(QMainWindow):
             self.directory_line_1.setText(os.path.dirname(filepath))
 
     def folder_viewer_right(self, path: str, index: int = None):
-        self.fileModel_right = QFileSystemModel()
-        self.fileModel_right.setReadOnly(False)
-        self.fileModel_right.setFilter(QDir.NoDotAndDotDot | QDir.AllDirs | QDir.Files)
-        self.fileModel_right.setRootPath(QDir.rootPath())
-        self.fileModel_right.setResolveSymlinks(True)
+        self.fileModel_right = self.show_folder(self.treeView_4, path)
 
         if index:
             headers_remove = self.update_view(index, 'right')
@@ -323,8 +388,6 @@ class LaunchCommander(QMainWindow):
         for i in headers_remove:
             self.treeView_4.header().hideSection(i)
 
-        self.treeView_4.setModel(self.fileModel_right)
-        self.treeView_4.setRootIndex(self.fileModel_right.index(path))
         self.treeView_4.resizeColumnToContents(-1)
 
     def folders_right(self):
@@ -397,13 +460,26 @@ class LaunchCommander(QMainWindow):
 
     def zipper(self):
         """
-        This function launches the zipping of the selected item
+        This function opens the archiving of the selected items
         """
-        if self.active_item:
-            Supporting.zip_it(self.active_item)
+        items = self.selected_items()
+        if items:
+            self.archive_dialog = ArchiveDialog(self, [os.path.abspath(item) for item in items])
+            self.archive_dialog.show()
         else:
             logging.error('No files or directories selected')
 
+    def extract_it(self):
+        """
+        This function opens the extraction of the selected archives
+        """
+        archives = [os.path.abspath(item) for item in self.selected_items() if ArchiveIndex.is_archive(item)]
+        if archives:
+            self.extract_dialog = ExtractDialog(self, archives)
+            self.extract_dialog.show()
+        else:
+            logging.error('No archives selected')
+
     def _terminal(self, side: str):
         """
         This function attempts to open a terminal from the currently selected folder.
@@ -436,9 +512,9 @@ class LaunchCommander(QMainWindow):
     def move_it(self):
         if self.active_item:
             if self.active_tree == 'treeView_2':
-                self.move_dialog = MoveDialog(self, self.active_item, self.directory_line_2.text())
+                self.move_dialog = MoveDialog(self, self.selection(), self.directory_line_2.text())
             else:
-                self.move_dialog = MoveDialog(self, self.active_item, self.directory_line_1.text())
+                self.move_dialog = MoveDialog(self, self.selection(), self.directory_line_1.text())
         else:
             self.move_dialog = MoveDialog(self)
             logging.error('No files or directories selected')
@@ -448,15 +524,33 @@ class LaunchCommander(QMainWindow):
     def copy_it(self):
         if self.active_item:
             if self.active_tree == 'treeView_2':
-                self.copy_dialog = CopyDialog(self, self.active_item, self.directory_line_2.text())
+                self.copy_dialog = CopyDialog(self, self.selection(), self.directory_line_2.text())
             else:
-                self.copy_dialog = CopyDialog(self, self.active_item, self.directory_line_1.text())
+                self.copy_dialog = CopyDialog(self, self.selection(), self.directory_line_1.text())
         else:
             self.copy_dialog = CopyDialog(self)
             logging.error('No files or directories selected')
 
         self.copy_dialog.show()
 
+    def sync_it(self):
+        """
+        This function opens the sync of the active explorer's folder into the other one.
+        """
+        if self.active_tree == 'treeView_4':
+            self.sync_dialog = SyncDialog(self, self.directory_line_2.text(), self.directory_line_1.text())
+        else:
+            self.sync_dialog = SyncDialog(self, self.directory_line_1.text(), self.directory_line_2.text())
+
+        self.sync_dialog.show()
+
+    def duplicates_it(self):
+        """
+        This function opens the duplicate finder over the folders of both explorers.
+        """
+        self.duplicates_dialog = DuplicatesDialog(self, self.directory_line_1.text(), self.directory_line_2.text())
+        self.duplicates_dialog.show()
+
     def make_file(self):
         if self.active_item:
             if self.active_tree == 'treeView_2':
@@ -494,16 +588,84 @@ class LaunchCommander(QMainWindow):
 
         logging.info(f"Comparing {item_1} and {item_2}")
 
-        subprocess.Popen(["tkdiff", item_1, item_2])
+        # Two files get a line diff (byte compare if either is binary), anything else the folder comparison
+        if os.path.isfile(item_1) and os.path.isfile(item_2):
+            try:
+                binary = BinaryDiffEngine.is_binary(item_1) or BinaryDiffEngine.is_binary(item_2)
+            except OSError as error:
+                logging.error(error)
+                return
+            self.diff_dialog = (BinaryDiffDialog if binary else TextDiffDialog)(self, item_1, item_2)
+        else:
+            self.diff_dialog = DiffDialog(self, item_1, item_2)
+        self.diff_dialog.show()
 
     def permission_it(self):
         if self.active_item:
-            self.permission_dialog = PermissionsDialog(self, os.path.abspath(self.active_item))
+            selection = self.selection()
+            self.permission_dialog = PermissionsDialog(self, selection if isinstance(selection, list)
+                                                       else os.path.abspath(selection))
         else:
             return
 
         self.permission_dialog.show()
 
+    def purge_leftovers(self):
+        """
+        This function offers to purge items whose staged delete was interrupted in an earlier
+        session, declining puts them back where they were.
+        """
+        leftovers = StagedDelete.leftovers()
+        if not leftovers:
+            return
+        if not self._remove_dialog(f"{len(leftovers)} items of unfinished deletes were found - delete them? "
+                                   "Cancel puts them back."):
+            if not StagedDelete.restore_all(leftovers):
+                logging.error(f"Some unfinished deletes could not be put back, they stay in {STAGING_NAME}")
+        else:
+            self.transfer_queue.submit(Job('delete', f"Purge {len(leftovers)} unfinished deletes",
+                                           lambda job: StagedDelete.purge_all(leftovers, job.progress,
+                                                                              job.cancelled)))
+
+    def remove_items(self):
+        """
+        This function removes everything selected in the active explorer, several items are
+        removed as one background job after a single confirmation.
+        """
+        items = self.selected_items()
+        if not items:
+            logging.error('No files or directories selected')
+            return
+        if len(items) == 1:
+            self.remove_item(items[0])
+            return
+
+        if self._remove_dialog(f"Delete the {len(items)} selected items?"):
+            folders = [self._stage(item) for item in items if os.path.isdir(item) and not os.path.islink(item)]
+            others = [item for item in items if not os.path.isdir(item) or os.path.islink(item)]
+            self.transfer_queue.submit(Job('delete', f"Delete {len(items)} items",
+                                           lambda job: self._remove_all(folders, others, job)))
+
+    @staticmethod
+    def _remove_all(folders: list, others: list, job: Job) -> bool:
+        stats, errors = Supporting.run_batch(others, os.unlink, job.progress, job.cancelled)
+        for folder in folders:
+            try:
+                if job.cancelled.is_set():
+                    # Put back the folders not reached, they are still whole
+                    StagedDelete.restore(folder)
+                else:
+                    StagedDelete.purge(folder, job.progress, job.cancelled)
+            except OSError as error:
+                errors.append(error)
+
+        count = len(folders) + len(others)
+        if not job.cancelled.is_set():
+            logging.info(f"Removed {count - len(errors)} of {count} selected items")
+        for error in errors:
+            logging.error(error)
+        return not errors
+
     def remove_item(self, selected: str):
         item = os.path.abspath(selected)
 
@@ -524,11 +686,9 @@ class LaunchCommander(QMainWindow):
             else:
                 choice = self._remove_dialog()
                 if choice:
-                    try:
-                        shutil.rmtree(item)
-                        logging.info(f"{item} and contents have been removed")
-                    except OSError as error:
-                        print(error)
+                    staged = self._stage(item)
+                    self.transfer_queue.submit(Job('delete', f"Delete {item}",
+                                                   lambda job: self._remove_tree(staged, job, item)))
         elif os.path.islink(item):
             try:
                 os.unlink(item)
@@ -536,6 +696,30 @@ class LaunchCommander(QMainWindow):
             except OSError as error:
                 print(error)
 
+    @staticmethod
+    def _stage(item: str) -> str:
+        """
+        This function moves a folder to be deleted out of sight at once, see StagedDelete.
+
+        :return: Path to purge, the folder itself if it could not be staged
+        """
+        try:
+            return StagedDelete.stage(item)
+        except OSError as error:
+            logging.info(f"{item} removed in place, staging failed: {error}")
+            return item
+
+    @staticmethod
+    def _remove_tree(staged: str, job: Job, item: str) -> bool:
+        try:
+            StagedDelete.purge(staged, job.progress, job.cancelled)
+            if not job.cancelled.is_set():
+                logging.info(f"{item} and contents have been removed")
+            return True
+        except OSError as error:
+            logging.error(error)
+            return False
+
     def search_item(self):
         if os.path.isdir(self.active_item):
             if self.active_tree == 'treeView_2':
@@ -554,17 +738,18 @@ class LaunchCommander(QMainWindow):
         self.search_dialog.show()
 
     @staticmethod
-    def _remove_dialog():
+    def _remove_dialog(text: str = "Folder is not empty - do you want to continue with delete"):
         """
         This function creates a custom dialog to warn the user that the folder to be removed is not empty.
 
+        :param text: Warning shown
         :return: Boolean response
         """
         remove_check_dialog = QMessageBox()
         icon = QIcon('../images/delete.png')
         remove_check_dialog.setIconPixmap(icon.pixmap(20, 20))
         remove_check_dialog.setWindowTitle("Check Deletion Event")
-        remove_check_dialog.setText("Folder is not empty - do you want to continue with delete")
+        remove_check_dialog.setText(text)
         remove_check_dialog.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
 
         return_value = remove_check_dialog.exec()
@@ -576,7 +761,9 @@ class LaunchCommander(QMainWindow):
 
     def rename_it(self):
         if self.active_item:
-            self.rename_dialog = RenameDialog(self, os.path.abspath(self.active_item))
+            selection = self.selection()
+            self.rename_dialog = RenameDialog(self, selection if isinstance(selection, list)
+                                              else os.path.abspath(selection))
         else:
             logging.error("No files or directories selected")
             return
@@ -592,9 +779,66 @@ class LaunchCommander(QMainWindow):
         self.settings.setValue("path_2", self.directory_line_2.text())
         self.settings.setValue("tree_1", self.treeView_1.isHidden())
         self.settings.setValue("tree_2", self.treeView_3.isHidden())
+        self.settings.setValue("transfer_concurrency", self.transfer_queue.concurrency)
+
+        if self.transfer_queue.active_jobs():
+            logging.info(f"Cancelling {len(self.transfer_queue.active_jobs())} unfinished transfer jobs")
+            self.transfer_queue.cancel_all()
 
         QApplication.quit()
 
+    def open_item(self, index: QModelIndex, side: str):
+        """
+        This function opens a double-clicked item: archives are browsed like a folder and
+        archive members are extracted on their own to a temporary folder and opened.
+
+        :param index: Item double-clicked
+        :param side: left/right explorer
+        """
+        model, line = (self.fileModel_left, self.directory_line_1) if side == 'left' \
+            else (self.fileModel_right, self.directory_line_2)
+        path = model.filePath(model.index(index.row(), 0, index.parent()))
+
+        if ArchiveIndex.is_archive(path):
+            line.setText(path)
+        elif isinstance(model, ArchiveModel) and not model.isDir(index):
+            self.transfer_queue.submit(Job('extract', f"Extract {path}",
+                                           lambda job: self._open_member(path, job)))
+
+    @staticmethod
+    def _open_member(path: str, job: Job) -> bool:
+        try:
+            Supporting.read_write(ArchiveIndex.extract_item(path, progress=job.progress, cancelled=job.cancelled))
+            return True
+        except OSError as error:
+            logging.error(error)
+            return False
+
+    def selected_items(self) -> list:
+        """
+        This function returns the paths selected in the active explorer.
+
+        :return: List of the selected paths, the active item if nothing is selected
+        """
+        if self.active_tree == 'treeView_2':
+            view, model = self.treeView_2, self.fileModel_left
+        elif self.active_tree == 'treeView_4':
+            view, model = self.treeView_4, self.fileModel_right
+        else:
+            view, model = None, None
+
+        items = [model.filePath(index) for index in view.selectionModel().selectedRows(0)] if view else []
+        if not items and self.active_item:
+            items = [self.active_item]
+        return items
+
+    def selection(self):
+        """
+        :return: List of paths if several items are selected, otherwise the active item
+        """
+        items = self.selected_items()
+        return items if len(items) > 1 else self.active_item
+
     @pyqtSlot(QModelIndex)
     def active_left(self, index):
         index_item = self.fileModel_left.index(index.row(), 0, index.parent())
@@ -0,0 +1,295 @@
+import os
+import mmap
+import errno
+import difflib
+import threading
+from collections import namedtuple
+from transfer_stats import TransferStats
+
+
+Hunk = namedtuple('Hunk', ['a_start', 'a_end', 'b_start', 'b_end', 'a_line', 'b_line'])
+
+BLOCK_SIZE = 1024 * 1024
+FIRST_BLOCK_SIZE = 4 * 1024
+WINDOW_SIZE = 1024
+MAX_WINDOW_SIZE = 16 * 1024 * 1024
+SYNC_LINES = 3
+CONTEXT_LINES = 3
+RENDER_LINES = 10000
+
+
+class TextDiffEngine:
+    """
+    Line diff of two (possibly multi-GB) text files.
+
+    Both files are memory mapped and never read into memory as a whole. The common prefix
+    and suffix are skipped by comparing megabyte blocks, and the differing middle is walked
+    the same way: at each difference a window of lines from both sides is hashed and
+    matched until SYNC_LINES equal lines bring the files back in step, the lines in between
+    form a hunk and block comparison goes on from there. Hunks are byte ranges with their
+    first line numbers, their lines are only read when a hunk is rendered, so memory
+    depends on the number of differences, not on the size of the files.
+    """
+    def __init__(self, left: str, right: str, progress=None, cancelled: threading.Event = None):
+        """
+        :param left: Text file
+        :param right: Text file to compare it with
+        :param progress: Callable receiving the TransferStats as the files are compared
+        :param cancelled: Event which stops the comparison when set
+        """
+        self.left = os.path.abspath(left)
+        self.right = os.path.abspath(right)
+        self.progress = progress
+        self.cancelled = cancelled or threading.Event()
+
+        self.stats = TransferStats()
+        self.hunks: list = []
+
+        self._files = []
+        self.a, self.b = self._map(self.left), self._map(self.right)
+        self.stats.expect(2, len(self.a) + len(self.b))
+        self._sizes = (len(self.a), len(self.b))
+
+    def _map(self, path: str):
+        file = open(path, 'rb')
+        self._files.append(file)
+        if not os.fstat(file.fileno()).st_size:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for buffer in (self.a, self.b):
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+        for file in self._files:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def summary(self) -> str:
+        return f"{len(self.hunks)} differences, {self.stats.bytes / 1048576:.1f} MB compared " \
+               f"in {self.stats.elapsed:.1f}s"
+
+    # ======================================================================
+    def compare(self) -> list:
+        """
+        :return: List of Hunk, the differing byte ranges of both files in order
+        """
+        self.hunks = []
+        a_end, b_end = self._common_suffix()
+        a_position, b_position = 0, 0
+        a_line, b_line = 0, 0
+        while not self.cancelled.is_set():
+            a_position, b_position, lines = self._skip_equal(a_position, b_position, a_end, b_end)
+            if a_position == a_end and b_position == b_end:
+                break
+            a_line, b_line = a_line + lines, b_line + lines
+            a_next, b_next = self._resync(a_position, b_position, a_end, b_end)
+            self.hunks.append(Hunk(a_position, a_next, b_position, b_next, a_line, b_line))
+            a_line += self.a[a_position:a_next].count(b'\n')
+            b_line += self.b[b_position:b_next].count(b'\n')
+            self._advance(a_next - a_position + b_next - b_position)
+            a_position, b_position = a_next, b_next
+        self.stats.finish()
+        return self.hunks
+
+    def _common_suffix(self) -> tuple:
+        """
+        :return: Start of the identical tail of both files, on a line start
+        """
+        a, b = self.a, self.b
+        a_end, b_end = len(a), len(b)
+        limit = min(a_end, b_end)
+        equal = 0
+        while equal < limit and not self.cancelled.is_set():
+            size = min(BLOCK_SIZE, limit - equal)
+            if a[a_end - equal - size:a_end - equal] != b[b_end - equal - size:b_end - equal]:
+                # Narrow the block down to the last differing byte
+                low, high = 0, size
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if a[a_end - equal - middle:a_end - equal] == b[b_end - equal - middle:b_end - equal]:
+                        low = middle
+                    else:
+                        high = middle
+                equal += low
+                break
+            equal += size
+            self._advance(2 * size)
+
+        a_tail, b_tail = a_end - equal, b_end - equal
+        if self._line_start(a, a_tail) and self._line_start(b, b_tail):
+            return a_tail, b_tail
+        # Otherwise the tail starts after the first line break within the identical bytes
+        newline = a.find(b'\n', a_tail, a_end)
+        if newline < 0:
+            return a_end, b_end
+        return newline + 1, b_tail + newline + 1 - a_tail
+
+    @staticmethod
+    def _line_start(buffer, position: int) -> bool:
+        return position == 0 or buffer[position - 1:position] == b'\n'
+
+    def _skip_equal(self, a_position: int, b_position: int, a_end: int, b_end: int) -> tuple:
+        """
+        This function compares both files block by block from two line starts. Blocks start
+        small and double up to BLOCK_SIZE, differences close to each other are found
+        without copying megabytes.
+
+        :return: (line starts of the first differing line, or both ends, number of equal lines skipped)
+        """
+        a, b = self.a, self.b
+        equal = 0
+        lines = 0
+        block = FIRST_BLOCK_SIZE
+        while not self.cancelled.is_set():
+            size = min(block, a_end - a_position - equal, b_end - b_position - equal)
+            if size <= 0:
+                if a_position + equal == a_end and b_position + equal == b_end:
+                    return a_end, b_end, lines
+                break
+            first, second = a[a_position + equal:a_position + equal + size], \
+                b[b_position + equal:b_position + equal + size]
+            if first != second:
+                low, high = 0, size
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if first[:middle] == second[:middle]:
+                        low = middle
+                    else:
+                        high = middle
+                equal += low
+                lines += first[:low].count(b'\n')
+                self._advance(2 * low)
+                break
+            equal += size
+            lines += first.count(b'\n')
+            block = min(2 * block, BLOCK_SIZE)
+            self._advance(2 * size)
+
+        # Back to the start of the line holding the difference, the bytes before it are equal
+        newline = a.rfind(b'\n', a_position, a_position + equal) if equal else -1
+        line = newline + 1 - a_position if newline >= 0 else 0
+        return a_position + line, b_position + line, lines
+
+    def _resync(self, a_position: int, b_position: int, a_end: int, b_end: int) -> tuple:
+        """
+        This function finds where the files are back in step after a difference, matching
+        hashed lines of a window which grows until SYNC_LINES equal lines are found.
+
+        :return: Line starts of the first equal lines in both files, the ends if there are none
+        """
+        window = WINDOW_SIZE
+        while True:
+            a_lines = self._lines(self.a, a_position, a_end, window)
+            b_lines = self._lines(self.b, b_position, b_end, window)
+            a_length, b_length = sum(map(len, a_lines)), sum(map(len, b_lines))
+            at_end = a_position + a_length == a_end and b_position + b_length == b_end
+
+            matcher = difflib.SequenceMatcher(None, [hash(line) for line in a_lines],
+                                              [hash(line) for line in b_lines], autojunk=False)
+            for a_index, b_index, size in matcher.get_matching_blocks():
+                ends = a_index + size == len(a_lines) and b_index + size == len(b_lines)
+                if (a_index or b_index) and (size >= SYNC_LINES or (size and ends and at_end)):
+                    return (a_position + sum(map(len, a_lines[:a_index])),
+                            b_position + sum(map(len, b_lines[:b_index])))
+            if at_end:
+                return a_end, b_end
+            if window >= MAX_WINDOW_SIZE or self.cancelled.is_set():
+                # No anchor in reach, the whole window is one hunk
+                return a_position + a_length, b_position + b_length
+            window *= 4
+
+    @staticmethod
+    def _lines(buffer, start: int, end: int, size: int) -> list:
+        """
+        :return: Lines (with their line break) in about size bytes from start, complete lines only
+        """
+        stop = min(end, start + size)
+        if stop < end:
+            newline = buffer.rfind(b'\n', start, stop)
+            if newline < 0:
+                newline = buffer.find(b'\n', stop, end)
+            stop = end if newline < 0 else newline + 1
+        lines = buffer[start:stop].split(b'\n')
+        last = lines.pop()
+        lines = [line + b'\n' for line in lines]
+        return lines + [last] if last else lines
+
+    def _advance(self, size: int):
+        self.stats.add(0, size)
+        if self.progress:
+            self.progress(self.stats)
+
+    # ======================================================================
+    def render(self, index: int) -> list:
+        """
+        This function produces the lines of a hunk with CONTEXT_LINES of context around it.
+
+        :return: List of (tag, left line number, right line number, text), tag being '@' for the
+            header, ' ' for context, '-' for left only and '+' for right only lines
+        :raises OSError: If a file was truncated since the comparison
+        """
+        # Each file on its own, a tuple comparison would let the right one shrink unnoticed
+        for file, before, path in zip(self._files, self._sizes, (self.left, self.right)):
+            if os.fstat(file.fileno()).st_size < before:
+                raise OSError(errno.ESTALE, "File truncated since the comparison", path)
+
+        hunk = self.hunks[index]
+        a_line, b_line = hunk.a_line, hunk.b_line
+        floor = self._context_end(index - 1) if index else 0
+        position = hunk.a_start
+        for _ in range(CONTEXT_LINES):
+            if position <= floor:
+                break
+            position = max(self.a.rfind(b'\n', floor, position - 1) + 1, floor)
+        before = self._lines(self.a, position, hunk.a_start, hunk.a_start - position)
+        after = self._lines(self.a, hunk.a_end, self._context_end(index), self._context_end(index) - hunk.a_end)
+
+        a_lines = self._lines(self.a, hunk.a_start, hunk.a_end, hunk.a_end - hunk.a_start)
+        b_lines = self._lines(self.b, hunk.b_start, hunk.b_end, hunk.b_end - hunk.b_start)
+        rows = [('@', None, None, f"@@ -{a_line + 1},{len(a_lines)} +{b_line + 1},{len(b_lines)} @@")]
+        rows.extend((' ', a_line - len(before) + number, b_line - len(before) + number, self._text(line))
+                    for number, line in enumerate(before))
+
+        a_number, b_number = a_line, b_line
+        matcher = difflib.SequenceMatcher(None, a_lines[:RENDER_LINES], b_lines[:RENDER_LINES], autojunk=False)
+        for tag, a_first, a_last, b_first, b_last in matcher.get_opcodes():
+            if tag == 'equal':
+                rows.extend((' ', a_number + offset, b_number + offset, self._text(line))
+                            for offset, line in enumerate(a_lines[a_first:a_last]))
+            else:
+                rows.extend(('-', a_number + offset, None, self._text(line))
+                            for offset, line in enumerate(a_lines[a_first:a_last]))
+                rows.extend(('+', None, b_number + offset, self._text(line))
+                            for offset, line in enumerate(b_lines[b_first:b_last]))
+            a_number += a_last - a_first
+            b_number += b_last - b_first
+        if max(len(a_lines), len(b_lines)) > RENDER_LINES:
+            rows.append(('@', None, None, f"... {max(len(a_lines), len(b_lines)) - RENDER_LINES} more lines"))
+
+        a_number, b_number = a_line + len(a_lines), b_line + len(b_lines)
+        rows.extend((' ', a_number + offset, b_number + offset, self._text(line)) for offset, line in enumerate(after))
+        return [(tag, None if left is None else left + 1, None if right is None else right + 1, text)
+                for tag, left, right, text in rows]
+
+    def _context_end(self, index: int) -> int:
+        """
+        :return: End of the context shown after a hunk, CONTEXT_LINES past it but not into the next hunk
+        """
+        limit = self.hunks[index + 1].a_start if index + 1 < len(self.hunks) else len(self.a)
+        position = self.hunks[index].a_end
+        for _ in range(CONTEXT_LINES):
+            if position >= limit:
+                break
+            newline = self.a.find(b'\n', position, limit)
+            position = limit if newline < 0 else newline + 1
+        return position
+
+    @staticmethod
+    def _text(line: bytes) -> str:
+        return line.rstrip(b'\r\n').decode('utf-8', 'replace')
@@ -0,0 +1,106 @@
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, \
+    QProgressBar, QPushButton, QSpinBox, QLabel, QHeaderView, QAbstractItemView
+from transfer_queue import TransferQueue, Job
+
+
+class TransferPanel(QWidget):
+    """
+    Table of queued and running jobs with their progress, throughput and ETA, plus
+    pause/resume/cancel controls and the number of jobs allowed to run at once.
+    """
+    COLUMNS = ['Job', 'State', 'Progress', 'Speed', 'ETA']
+    REFRESH_MS = 250
+
+    def __init__(self, queue: TransferQueue, parent=None):
+        super(TransferPanel, self).__init__(parent)
+
+        self.queue = queue
+        self.rows: list = []
+
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        self.pause_button = QPushButton('Pause', self)
+        self.resume_button = QPushButton('Resume', self)
+        self.cancel_button = QPushButton('Cancel', self)
+        self.clear_button = QPushButton('Clear finished', self)
+        self.concurrency_spin = QSpinBox(self)
+        self.concurrency_spin.setRange(1, 16)
+        self.concurrency_spin.setValue(queue.concurrency)
+
+        buttons = QHBoxLayout()
+        for widget in (self.pause_button, self.resume_button, self.cancel_button, self.clear_button):
+            buttons.addWidget(widget)
+        buttons.addStretch()
+        buttons.addWidget(QLabel('Concurrent jobs', self))
+        buttons.addWidget(self.concurrency_spin)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+
+        self.pause_button.released.connect(lambda: self._selected_jobs(self.queue.pause))
+        self.resume_button.released.connect(lambda: self._selected_jobs(self.queue.resume))
+        self.cancel_button.released.connect(lambda: self._selected_jobs(self.queue.cancel))
+        self.clear_button.released.connect(self.clear_finished)
+        self.concurrency_spin.valueChanged.connect(self.queue.set_concurrency)
+        self.queue.job_added.connect(self.add_job)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(self.REFRESH_MS)
+
+    def add_job(self, job: Job):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, QTableWidgetItem(job.description))
+        for column in (1, 3, 4):
+            self.table.setItem(row, column, QTableWidgetItem(''))
+        bar = QProgressBar(self.table)
+        bar.setRange(0, 1000)
+        self.table.setCellWidget(row, 2, bar)
+
+        self.rows.append(job)
+        self.refresh()
+
+    def clear_finished(self):
+        for row in reversed(range(len(self.rows))):
+            if not self.rows[row].active:
+                self.table.removeRow(row)
+                del self.rows[row]
+
+    def refresh(self):
+        for row, job in enumerate(self.rows):
+            stats = job.stats
+            self.table.item(row, 1).setText(job.state)
+
+            bar = self.table.cellWidget(row, 2)
+            if job.state == Job.DONE:
+                bar.setRange(0, 1000)
+                bar.setValue(1000)
+            elif job.state == Job.RUNNING and not (stats.total_bytes or stats.total_files):
+                bar.setRange(0, 0)
+            else:
+                bar.setRange(0, 1000)
+                bar.setValue(int(stats.fraction * 1000))
+
+            if job.state in (Job.RUNNING, Job.DONE):
+                self.table.item(row, 3).setText(f"{stats.bytes_per_second / 1048576:.1f} MB/s, "
+                                                f"{stats.files_per_second:.0f} files/s")
+            eta = stats.eta if job.state == Job.RUNNING else None
+            self.table.item(row, 4).setText(self._duration(eta) if eta is not None else '')
+
+    def _selected_jobs(self, action):
+        for index in self.table.selectionModel().selectedRows():
+            action(self.rows[index.row()])
+        self.refresh()
+
+    @staticmethod
+    def _duration(seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
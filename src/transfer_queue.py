@@ -0,0 +1,180 @@
+import logging
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+from transfer_stats import TransferStats
+
+
+class Job:
+    """
+    A queued file operation.
+
+    The work callable receives the job itself and hands job.progress and job.cancelled to
+    the engine doing the work. Progress callbacks double as pause points: while the job is
+    paused they block the calling thread until it is resumed or cancelled. The callable
+    returns False (or raises) when the operation failed.
+    """
+    QUEUED = 'Queued'
+    RUNNING = 'Running'
+    PAUSED = 'Paused'
+    DONE = 'Done'
+    FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
+
+    def __init__(self, kind: str, description: str, work):
+        """
+        :param kind: copy, move, delete, zip, chmod, ...
+        :param description: Text shown in the transfer panel
+        :param work: Callable taking the job, returns False on failure
+        """
+        self.kind = kind
+        self.description = description
+        self.work = work
+
+        self.state = Job.QUEUED
+        self.started = False
+        self.stats = TransferStats()
+        self.cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def active(self) -> bool:
+        return self.state in (Job.QUEUED, Job.RUNNING, Job.PAUSED)
+
+    def progress(self, stats: TransferStats):
+        self.stats = stats
+        while not self._resumed.wait(0.2):
+            if self.cancelled.is_set():
+                return
+
+    def pause(self):
+        if self.state in (Job.QUEUED, Job.RUNNING):
+            self._resumed.clear()
+            self.state = Job.PAUSED
+
+    def resume(self):
+        if self.state == Job.PAUSED:
+            self.state = Job.RUNNING if self.started else Job.QUEUED
+            self._resumed.set()
+
+    def cancel(self):
+        if self.active:
+            self.cancelled.set()
+            self._resumed.set()
+            if not self.started:
+                self.state = Job.CANCELLED
+
+    def run(self):
+        self._resumed.wait()
+        if self.cancelled.is_set():
+            self.state = Job.CANCELLED
+            self.work = None
+            return
+
+        self.stats = TransferStats()
+        try:
+            success = self.work(self) is not False
+        except Exception as error:
+            logging.error(f"{self.description} failed: {error}")
+            success = False
+        finally:
+            # The work holds on to whatever started it, like a dialog
+            self.work = None
+        self.stats.finish()
+
+        if self.cancelled.is_set():
+            self.state = Job.CANCELLED
+            logging.info(f"{self.description} cancelled")
+        else:
+            self.state = Job.DONE if success else Job.FAILED
+
+
+class TransferQueue(QObject):
+    """
+    Runs queued jobs on background threads, at most `concurrency` at a time.
+
+    jobs holds the unfinished jobs only. Every job submitted ends with job_finished, also one
+    cancelled before it started, and leaves jobs just before that.
+    """
+    job_added = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+
+    def __init__(self, parent=None, concurrency: int = 2):
+        super(TransferQueue, self).__init__(parent)
+
+        self.jobs: list = []
+        self.concurrency = concurrency
+
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job: Job) -> Job:
+        with self._lock:
+            self.jobs.append(job)
+        self.job_added.emit(job)
+        logging.info(f"Queued: {job.description}")
+
+        self._schedule()
+        return job
+
+    def set_concurrency(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self._schedule()
+
+    def active_jobs(self) -> list:
+        return [job for job in self.jobs if job.active]
+
+    def pause(self, job: Job):
+        job.pause()
+
+    def resume(self, job: Job):
+        """
+        This function resumes a paused job, one paused while queued is queued again and
+        started once a slot is free.
+        """
+        job.resume()
+        self._schedule()
+
+    def cancel(self, job: Job):
+        job.cancel()
+        self._drop_cancelled()
+        self._schedule()
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            job.cancel()
+        self._drop_cancelled()
+        self._schedule()
+
+    def _drop_cancelled(self):
+        """
+        This function finishes the jobs cancelled before they started, they never run.
+        """
+        with self._lock:
+            cancelled = [job for job in self.jobs if job.state == Job.CANCELLED and not job.started]
+            self.jobs = [job for job in self.jobs if job not in cancelled]
+        for job in cancelled:
+            job.work = None
+            logging.info(f"{job.description} cancelled")
+            self.job_finished.emit(job)
+
+    def _schedule(self):
+        with self._lock:
+            while self._running < self.concurrency:
+                job = next((job for job in self.jobs if job.state == Job.QUEUED), None)
+                if not job:
+                    return
+                job.state = Job.RUNNING
+                job.started = True
+                self._running += 1
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job: Job):
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.jobs.remove(job)
+            self.job_finished.emit(job)
+            self._schedule()
@@ -0,0 +1,68 @@
+import time
+import threading
+
+
+class TransferStats:
+    """
+    Thread safe byte and file counters of a running operation, with throughput figures.
+    """
+    def __init__(self, total_bytes: int = 0, total_files: int = 0):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+
+        self.bytes = 0
+        self.files = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+        self._lock = threading.Lock()
+
+    def add(self, files: int = 0, size: int = 0):
+        with self._lock:
+            self.files += files
+            self.bytes += size
+
+    def expect(self, files: int = 0, size: int = 0):
+        with self._lock:
+            self.total_files += files
+            self.total_bytes += size
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def fraction(self) -> float:
+        """
+        :return: Completed share of the expected bytes (or files if no byte total is known)
+        """
+        if self.total_bytes:
+            return min(self.bytes / self.total_bytes, 1.0)
+        if self.total_files:
+            return min(self.files / self.total_files, 1.0)
+        return 0.0
+
+    @property
+    def eta(self):
+        """
+        :return: Estimated seconds left, None while unknown
+        """
+        fraction = self.fraction
+        if not fraction or fraction >= 1.0:
+            return None
+        return self.elapsed * (1.0 - fraction) / fraction
+
+    def summary(self) -> str:
+        return f"{self.files} files, {self.bytes / 1048576:.1f} MB in {self.elapsed:.1f}s " \
+               f"({self.files_per_second:.0f} files/s, {self.bytes_per_second / 1048576:.1f} MB/s)"